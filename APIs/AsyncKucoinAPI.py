@@ -0,0 +1,261 @@
+from queue import Queue
+from threading import Thread
+from typing import List, Tuple
+from urllib.parse import urlsplit
+from uuid import uuid4
+import asyncio
+import json
+import time
+import aiohttp
+
+import Config
+from CustomExceptions import TooManyRequests
+from util.currency_funcs import remove_single_swapable_coins
+from APIs.authentication import KucoinAuthenticator
+from APIs.ExchangeAPI import ExchangeAPI
+from APIs.RateLimiter import RateLimiter
+from APIs.KucoinAPI import KucoinAPI
+from Modules.OrderCreation import LimitOrder, MarketOrder
+
+class AsyncConnection:
+    ''' One Kucoin websocket on the event loop with its own connect id, ping interval and subscriptions'''
+    def __init__(self, ws:aiohttp.ClientWebSocketResponse, connect_id:str, ping_interval:float):
+        self.ws = ws
+        self.connect_id = connect_id
+        self.ping_interval = ping_interval
+        self.last_pong_time = 0
+        self.topics = 0
+        self.subscriptions = []
+        self.tasks = []
+
+    @property
+    def connected(self) -> bool:
+        return not self.ws.closed
+
+    async def send(self, payload:str) -> None:
+        await self.ws.send_str(payload)
+
+class AsyncKucoinAPI(ExchangeAPI):
+    '''
+    asyncio implementation of the Kucoin API. REST requests are coroutines sharing one pooled aiohttp session
+    and paced by the rate limiter (shared with the KucoinAPI facade), batches keeping at most max_concurrent in flight.
+    Each websocket is a reader task plus a ping task on the same event loop. Subscriptions are spread
+    over as many sockets as the subscription limit requires. Stream frames are queued in the order they are
+    read and passed to listener by a dispatch thread (KucoinAPI.stream_listen when used through the KucoinAPI
+    facade), so listeners never run on the event loop. Auth is shared with the facade when given, as is
+    get_timeout (the facade's HTTPSession.get_timeout) so both clients time out each endpoint alike
+    '''
+    def __init__(self, private=True, sandbox=False, listener=None, subscription_limit:int=300, limiter:RateLimiter=None,
+                 Auth:KucoinAuthenticator=None, max_concurrent:int=40, get_timeout=None):
+        self.private = private
+        self.server = "https://openapi-sandbox.kucoin.com" if sandbox else KucoinAPI.SERVER
+        if Auth is None and private:
+            Auth = KucoinAuthenticator(self.server)
+        self.Auth = Auth
+        self.listener = listener
+        self.frames = Queue()
+        if listener:
+            self.dispatch_thread = Thread(target=self.dispatch)
+            self.dispatch_thread.daemon = True
+            self.dispatch_thread.start()
+        self.subscription_limit = subscription_limit
+        self.limiter = limiter or RateLimiter()
+        self.max_concurrent = max_concurrent
+        self.get_timeout = get_timeout or (lambda url: KucoinAPI.REQUEST_TIMEOUTS.get(urlsplit(url).path, KucoinAPI.REQUEST_TIMEOUT))
+        self.ping_interval_scale = 1
+        self.session = None
+        self.connections = []
+        self.connection_lock = None
+
+    async def start(self) -> None:
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+            self.connection_lock = asyncio.Lock()
+
+    async def close(self) -> None:
+        for connection in self.connections:
+            for task in connection.tasks:
+                task.cancel()
+            await connection.ws.close()
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, endpoint:str, type:str="GET", data:str=None, signed:bool=False) -> dict:
+        await self.start()
+        endpoint_class = KucoinAPI.endpoint_class(type.upper(), endpoint.split("?")[0])
+        url = f"{self.server}{endpoint}"
+        timeout = aiohttp.ClientTimeout(total=self.get_timeout(url))
+        for _ in range(self.limiter.max_retries + 1):
+            await self.limiter.acquire_async(endpoint_class)
+            headers = self.Auth.headers(endpoint, type, data) if signed else None
+            async with self.session.request(type.upper(), url, headers=headers, data=data, timeout=timeout) as response:
+                text = await response.text()
+                if not RateLimiter.is_rate_limited(response.status, text):
+                    self.limiter.success(endpoint_class)
+                    return json.loads(text)
+                retry_after = RateLimiter.retry_after(response.headers)
+            self.limiter.backoff(endpoint_class, retry_after)
+        return json.loads(text)
+
+    # REST
+    async def get_tradeable_pairs(self, tuple_separate=True, remove_singles=True) -> list:
+        r = await self.request(KucoinAPI.SYMBOLS_ENDPOINT)
+        skip = Config.skipCurrencies
+        pairs = [tuple(pair_data["symbol"].split("-")) for pair_data in r['data']]
+        pairs = [(base, qoute) for base, qoute in pairs if base not in skip and qoute not in skip]
+        if remove_singles:
+            pairs = remove_single_swapable_coins(pairs)
+        return pairs if tuple_separate else [f"{base}-{qoute}" for base, qoute in pairs]
+
+    async def get_pair_spread(self, pair: Tuple[str]) -> Tuple[float]:
+        r = await self.request(f"{KucoinAPI.TICKER_ENDPOINT}?symbol={pair[0]}-{pair[1]}")
+        if r['data']:
+            return (float(r['data']['bestBid']), float(r['data']['bestAsk']), float(r['data']['price']))
+        return None, None, None
+
+    async def gather_bounded(self, coroutines) -> list:
+        ''' asyncio.gather with at most max_concurrent of the coroutines running at once'''
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        async def run(coroutine):
+            async with semaphore:
+                return await coroutine
+        return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
+
+    async def get_multiple_spreads(self, pairs: List[tuple]) -> List[Tuple[float]]:
+        return await self.gather_bounded(self.get_pair_spread(pair) for pair in pairs)
+
+    async def get_orderbook(self, pair: Tuple[str]) -> dict:
+        data = await self.request(f"{KucoinAPI.ORDERBOOK_ENDPOINT}?symbol={pair[0]}-{pair[1]}")
+        if 'data' in data:
+            return data['data']
+        if data['code'] == '429000':
+            raise TooManyRequests
+        raise Exception (f"Unexpected response from API: {data}")
+
+    async def get_multiple_orderbooks(self, pairs: List[tuple]) -> dict:
+        ''' Fetch orderbook snapshots concurrently, paced by the rate limiter'''
+        return dict(zip(pairs, await self.gather_bounded(self.get_orderbook(pair) for pair in pairs)))
+
+    async def market_order(self, order:MarketOrder):
+        volume_type = {"buy":"funds", "sell":"size"}
+        data = json.dumps({"clientOid":str(uuid4()).replace('-', ''),
+                           "side":order.side.name.lower(),
+                           "symbol":f"{order.pair[0]}-{order.pair[1]}",
+                           volume_type[order.side.name.lower()]:order.amount,
+                           "type":"market"})
+        r = await self.request(KucoinAPI.ORDER_ENDPOINT, "POST", data=data, signed=True)
+        print(r)
+        if 'data' in r:
+            return r['data']['orderId']
+
+    async def limit_order(self, order:LimitOrder):
+        data = json.dumps({"clientOid":str(uuid4()).replace('-', ''),
+                           "side":order.side.name.lower(),
+                           "symbol":f"{order.pair[0]}-{order.pair[1]}",
+                           "size":order.amount,
+                           "price":order.price,
+                           "timeInForce":order.tif.value,
+                           "type":"limit"})
+        r = await self.request(KucoinAPI.ORDER_ENDPOINT, "POST", data=data, signed=True)
+        print(r)
+        if 'data' in r:
+            return r['data']['orderId']
+
+    async def get_portfolio(self) -> dict:
+        r = await self.request(KucoinAPI.ACCOUNT_ENDPOINT, "GET", signed=True)
+        return {data['currency']: float(data['balance']) for data in r['data'] if data['type'] == "trade"}
+
+    # Websocket
+    async def open_connection(self) -> AsyncConnection:
+        await self.start()
+        if self.private:
+            r = await self.request("/api/v1/bullet-private", "POST", signed=True)
+        else:
+            r = await self.request("/api/v1/bullet-public", "POST")
+        server = r['data']['instanceServers'][0]
+        connect_id = str(uuid4()).replace('-', '')
+        ws = await self.session.ws_connect(f"{server['endpoint']}?token={r['data']['token']}&connectId={connect_id}")
+        connection = AsyncConnection(ws, connect_id, float(server['pingInterval'])*10**-3)
+        connection.tasks = [asyncio.ensure_future(self.read(connection)), asyncio.ensure_future(self.ping(connection))]
+        self.connections.append(connection)
+        return connection
+
+    async def read(self, connection:AsyncConnection) -> None:
+        async for message in connection.ws:
+            if message.type == aiohttp.WSMsgType.TEXT:
+                self.stream_listen(message.data)
+        print(f"Websocket connection {connection.connect_id} closed")
+
+    async def ping(self, connection:AsyncConnection) -> None:
+        while connection.connected:
+            await connection.send(json.dumps({"id": connection.connect_id, "type": "ping"}))
+            send_time = time.time()
+            await asyncio.sleep(connection.ping_interval*self.ping_interval_scale)
+            if connection.last_pong_time < send_time:
+                print(f"Pong not received ({connection.connect_id})...")
+
+    def pong_received(self, connect_id:str, receive_time:float) -> None:
+        for connection in self.connections:
+            if connection.connect_id == connect_id:
+                connection.last_pong_time = receive_time
+
+    async def subscribe(self, payload:dict, n_topics:int=1) -> AsyncConnection:
+        ''' Send a subscription on the first socket with room for n_topics more, opening a new one if none has'''
+        await self.start()
+        async with self.connection_lock:
+            connection = next((c for c in self.connections if c.topics + n_topics <= self.subscription_limit), None)
+            if connection is None:
+                connection = await self.open_connection()
+            connection.topics += n_topics
+            connection.subscriptions.append(payload)
+        await connection.send(json.dumps(payload))
+        return connection
+
+    async def reset_subscriptions(self) -> None:
+        for connection in self.connections:
+            for type in ("unsubscribe", "subscribe"):
+                for payload in connection.subscriptions:
+                    payload['type'] = type
+                    await connection.send(json.dumps(payload))
+                    await asyncio.sleep(.1)
+
+    async def add_price_stream(self, pair:Tuple[str]) -> None:
+        await self.subscribe({"id": str(uuid4()), "type": "subscribe",
+                              "topic": f"/market/ticker:{pair[0]}-{pair[1]}", "privateChannel": False})
+
+    async def subscribe_all(self, pairs: List[tuple]=None, limit:int=None) -> None:
+        if not pairs:
+            await self.subscribe({"id": str(uuid4()), "type": "subscribe", "topic": "/market/ticker:all", "response": "true"})
+            return
+        pairs = pairs[:limit] if limit else pairs
+        for i in range(0, len(pairs), 100):
+            tickers = ','.join([f"{base}-{qoute}" for base, qoute in pairs[i:i + 100]])
+            await self.subscribe({"id": str(uuid4()), "type": "subscribe", "topic": f"/market/ticker:{tickers}"},
+                                 n_topics=len(pairs[i:i + 100]))
+
+    async def subscribe_level2(self, pairs: List[tuple], limit:int=None) -> None:
+        pairs = pairs[:limit] if limit else pairs
+        for i in range(0, len(pairs), 100):
+            symbols = ','.join([f"{base}-{qoute}" for base, qoute in pairs[i:i + 100]])
+            await self.subscribe({"id": str(uuid4()), "type": "subscribe", "topic": f"/market/level2:{symbols}"},
+                                 n_topics=len(pairs[i:i + 100]))
+
+    async def subscribe_order_status(self) -> None:
+        await self.subscribe({"id": str(uuid4()), "type": "subscribe", "topic": "/spotMarket/tradeOrders", "privateChannel": "true"})
+
+    async def subscribe_account_balance_notice(self) -> None:
+        await self.subscribe({"id": str(uuid4()), "type": "subscribe", "topic": "/account/balance", "privateChannel": "true"})
+
+    def stream_listen(self, message) -> None:
+        # Called on the event loop, only queue the frame
+        if self.listener:
+            self.frames.put(message)
+
+    def dispatch(self) -> None:
+        while True:
+            message = self.frames.get()
+            try:
+                self.listener(message)
+            except Exception as e:
+                print(f"Failed to process websocket message: {e}")
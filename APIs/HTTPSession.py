@@ -0,0 +1,57 @@
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from APIs.RateLimiter import RateLimiter
+
+class HTTPSession:
+    '''
+    Shared requests.Session with a pooled keep-alive adapter, so REST calls reuse open TCP+TLS connections
+    instead of handshaking on every request. pool_size is the number of connections kept per host (size it
+    to the largest thread pool making requests), and timeouts maps endpoint paths to their own timeout.
+    With a limiter, every request waits for a token of the class classify(method, path) returns and is
+    retried after a backoff when rate limited. headers may be a function, so signed requests are re-signed
+    on every attempt
+    '''
+    def __init__(self, pool_size:int=40, keep_alive:bool=True, timeout:float=10, timeouts:dict=None,
+                 limiter:RateLimiter=None, classify=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+        self.timeout = timeout # Used for endpoints without their own timeout
+        self.timeouts = dict(timeouts or {}) # endpoint path: seconds
+        self.limiter = limiter
+        self.classify = classify or (lambda method, path: RateLimiter.PUBLIC)
+
+    def set_timeout(self, endpoint:str, timeout:float) -> None:
+        self.timeouts[endpoint] = timeout
+
+    def get_timeout(self, url:str) -> float:
+        return self.timeouts.get(urlsplit(url).path, self.timeout)
+
+    def request(self, method:str, url:str, headers=None, data:str=None) -> requests.Response:
+        timeout = self.get_timeout(url)
+        sign = headers if callable(headers) else lambda: headers
+        if not self.limiter:
+            return self.session.request(method.upper(), url, headers=sign(), data=data, timeout=timeout)
+
+        endpoint_class = self.classify(method.upper(), urlsplit(url).path)
+        for _ in range(self.limiter.max_retries + 1):
+            self.limiter.acquire(endpoint_class)
+            response = self.session.request(method.upper(), url, headers=sign(), data=data, timeout=timeout)
+            if not RateLimiter.is_rate_limited(response.status_code, response.text):
+                self.limiter.success(endpoint_class)
+                return response
+            self.limiter.backoff(endpoint_class, RateLimiter.retry_after(response.headers))
+        return response # Still rate limited after max_retries, left to the caller
+
+    def get(self, url:str, headers=None) -> requests.Response:
+        return self.request("GET", url, headers=headers)
+
+    def post(self, url:str, headers=None, data:str=None) -> requests.Response:
+        return self.request("POST", url, headers=headers, data=data)
+
+    def close(self) -> None:
+        self.session.close()
@@ -1,19 +1,25 @@
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from threading import Thread
 from typing import List, Tuple
 from uuid import uuid4
 import time
 import asyncio
-import requests
 import json
 import Config
-import re
+
+try:
+    from orjson import loads # Faster frame decoding when orjson is installed
+except ImportError:
+    from json import loads
 
 from CustomExceptions import TooManyRequests
 from util import events
 from util.currency_funcs import remove_single_swapable_coins
 from APIs.authentication import KucoinAuthenticator
-from APIs.WebSocketClient import WebSocketClient
+from APIs.HTTPSession import HTTPSession
+from APIs.RateLimiter import RateLimiter
+from APIs.WebSocketClient import WebSocketClient, WebSocketPool
 from APIs.ExchangeAPI import ExchangeAPI
 from Modules.OrderCreation import LimitOrder, MarketOrder
 
@@ -37,24 +43,84 @@ class KucoinAPI(ExchangeAPI):
     ACCOUNT_ENDPOINT = "/api/v1/accounts"
     ORDER_ENDPOINT = "/api/v1/orders"
     TRADE_FEE_ENDPOINT = "/api/v1/trade-fee"
-
-    def __init__(self, private=True, sandbox=False):
-
+    PRIVATE_ENDPOINTS = (ACCOUNT_ENDPOINT, TRADE_FEE_ENDPOINT, TRADE_FEE_ENDPOINT + "s", "/api/v1/bullet-private")
+    REQUEST_TIMEOUT = 10 # Seconds, for endpoints without their own timeout in REQUEST_TIMEOUTS
+    REQUEST_TIMEOUTS = {ORDER_ENDPOINT: 5, ORDERBOOK_ENDPOINT: 10, TICKER_ENDPOINT: 5}
+
+    def __init__(self, private=True, sandbox=False, use_asyncio=False, pool_size:int=40, keep_alive:bool=True,
+                 limiter:RateLimiter=None):
+
+        # One pooled keep-alive session for every REST call (signed ones included), paced by the rate limiter
+        self.limiter = limiter or RateLimiter()
+        self.http_pool_size = pool_size
+        self.http = HTTPSession(pool_size=pool_size, keep_alive=keep_alive, timeout=self.REQUEST_TIMEOUT,
+                                timeouts=self.REQUEST_TIMEOUTS, limiter=self.limiter, classify=self.endpoint_class)
         if private:
             if not sandbox:
-                self.Auth = KucoinAuthenticator(self.SERVER)
+                self.Auth = KucoinAuthenticator(self.SERVER, self.http)
             else:
-                self.Auth = KucoinAuthenticator("https://openapi-sandbox.kucoin.com")
-
-        self.socket = WebSocketClient(self, url=self.generate_connection_url(private))
-        self.streaming = self.socket.connected
+                self.Auth = KucoinAuthenticator("https://openapi-sandbox.kucoin.com", self.http)
+
+        self.private = private
+        self.subscription_limit = 300 # Topics a single socket can hold, more are spread over extra sockets
+        self.aio = None # AsyncKucoinAPI doing the streaming, snapshot and order I/O when use_asyncio is set
+        if use_asyncio:
+            self.start_asyncio_client(private, sandbox)
+            self.socket = None
+        else:
+            self.socket = WebSocketPool(self, self.new_connection, self.subscription_limit)
+        self.streaming = self.socket.connected if self.socket else False
         self.showDataStream = False
         self.active_streams = [] # stores EVENT_IDs
-        self.request_freq = 5
         self.ping_interval_scale = 1
         self.last_pong_time = 0
         self.payloads = [] # Stores subscription functions with arguements so they can be recalled when reconnect occurs
-        self.subscription_limit = 300
+
+        # Stream frames are routed on their topic prefix (the part before ':') with one dict lookup
+        self.level2_handler = partial(events.post_event, self.LEVEL2_UPDATE_EVENT_ID)
+        self.routes = {"/market/ticker": self.route_ticker,
+                       "/market/level2": lambda topic, subject, data: self.level2_handler(data),
+                       "/spotMarket/tradeOrders": lambda topic, subject, data: events.post_event(self.ORDER_UPDATE_EVENT_ID, data),
+                       "/account/balance": lambda topic, subject, data: events.post_event(self.ACCOUNT_BALANCE_UPDATE_EVENT_ID, data)}
+
+    def start_asyncio_client(self, private:bool, sandbox:bool) -> None:
+        ''' 
+        Run an AsyncKucoinAPI on an event loop in a background thread. This class then stays a blocking 
+        facade over it, with every stream frame still handled by stream_listen
+        '''
+        from APIs.AsyncKucoinAPI import AsyncKucoinAPI # aiohttp is only needed in asyncio mode
+        self.aio = AsyncKucoinAPI(private, sandbox, listener=self.stream_listen, subscription_limit=self.subscription_limit,
+                                  limiter=self.limiter, Auth=getattr(self, "Auth", None), max_concurrent=self.http_pool_size,
+                                  get_timeout=self.http.get_timeout)
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = Thread(target=self.loop.run_forever)
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+        self.connectID = str(uuid4()).replace('-', '')
+
+    @classmethod
+    def endpoint_class(cls, method:str, path:str) -> str:
+        ''' Rate limit class of a REST endpoint'''
+        if path == cls.ORDER_ENDPOINT and method == "POST":
+            return RateLimiter.ORDERS
+        if path in cls.PRIVATE_ENDPOINTS or path.startswith(cls.ORDER_ENDPOINT):
+            return RateLimiter.PRIVATE
+        return RateLimiter.PUBLIC
+
+    def run(self, coroutine):
+        ''' Run a coroutine on the asyncio client's loop and wait for the result'''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def subscribe(self, payload:dict, n_topics:int=1) -> None:
+        if self.aio:
+            self.run(self.aio.subscribe(payload, n_topics))
+        else:
+            self.socket.subscribe(payload, n_topics)
+
+    def new_connection(self, pool:WebSocketPool) -> WebSocketClient:
+        ''' Create a socket with its own token and connect id for the connection pool'''
+        url = self.generate_connection_url(self.private)
+        return WebSocketClient(pool, url=url, connect_id=self.connectID, ping_interval=self.pingInterval)
 
     def generate_connection_url(self, private=True):
         # Request token
@@ -63,7 +129,7 @@ class KucoinAPI(ExchangeAPI):
             r = self.Auth.request(req, "POST").json()
         else:
             req = "/api/v1/bullet-public"
-            r = requests.post(f"{self.SERVER}{req}").json()
+            r = self.http.post(f"{self.SERVER}{req}").json()
         token = r['data']['token']
         
         # get endpoint and ping info
@@ -75,29 +141,37 @@ class KucoinAPI(ExchangeAPI):
         return f"{endpoint}?token={token}&connectId={self.connectID}"
 
     def maintain_connection(self):
-        def send_ping():
+        ''' Ping every pooled connection (including ones opened later) on its own interval'''
+        if self.aio:
+            return # The asyncio client pings each of its sockets from the event loop
+        def send_ping(connection:WebSocketClient):
             while True:
-                payload = {"id":f"{self.connectID}",
+                payload = {"id":f"{connection.connect_id}",
                             "type":"ping"}
-                self.socket.send(json.dumps(payload))
-                print("sending ping")
+                connection.send(json.dumps(payload))
+                print(f"sending ping ({connection.connect_id})")
                 send_time = time.time()
-                time.sleep(self.pingInterval*self.ping_interval_scale)
+                time.sleep(connection.ping_interval*self.ping_interval_scale)
 
-                if self.last_pong_time < send_time:
+                if connection.last_pong_time < send_time:
                     # No pong received since last sent
-                    print("Pong not received...")
-                    #if self.socket.attempt_reconnect():
+                    print(f"Pong not received ({connection.connect_id})...")
+                    #if connection.attempt_reconnect():
                     #    # If reconnect succesful, resubscribe
                     #    events.post_event(self.DISCONNECT_EVENT_ID)
                     #    self.reset_subscriptions()
 
-        self.ping_thread = Thread(target=send_ping)
-        self.ping_thread.daemon=True
-        self.ping_thread.start()
+        def start_pinging(connection:WebSocketClient):
+            ping_thread = Thread(target=send_ping, args=(connection,))
+            ping_thread.daemon=True
+            ping_thread.start()
+            self.ping_threads.append(ping_thread)
+
+        self.ping_threads = []
+        self.socket.for_each_connection(start_pinging)
     
     def get_tradeable_pairs(self, tuple_separate=True, remove_singles=True) -> list:
-        r = requests.get(f"{self.SERVER}{self.SYMBOLS_ENDPOINT}").json()
+        r = self.http.get(f"{self.SERVER}{self.SYMBOLS_ENDPOINT}").json()
         pairs = []
         pairs2 =[]
         results = r['data']
@@ -121,7 +195,7 @@ class KucoinAPI(ExchangeAPI):
         return pairs
     
     def get_pair_info(self, pairs:list=None, limit:int=None) -> dict:
-        r1 = requests.get(f"{self.SERVER}{self.SYMBOLS_ENDPOINT}").json()
+        r1 = self.http.get(f"{self.SERVER}{self.SYMBOLS_ENDPOINT}").json()
         r2 = self.Auth.request(f"{self.TRADE_FEE_ENDPOINT}", "GET").json()
         pair_info = {}
         results = r1['data']
@@ -166,7 +240,7 @@ class KucoinAPI(ExchangeAPI):
             response_list = list(pool.map(self.Auth.request, urls))
 
         out = {}
-        for i, response in enumerate(response_list):
+        for response in response_list:
             data = response.json()
             if 'data' in data:
                 for fee_data in data['data']:
@@ -174,14 +248,16 @@ class KucoinAPI(ExchangeAPI):
                     out[(base, qoute)] = fee_data['takerFeeRate']
                 
             elif data['code'] == '429000':
-                raise TooManyRequests
+                raise TooManyRequests # Still rate limited after the limiter's retries
             else:
                 raise Exception(f"Unexpected response from API: {data}")
         return out
 
     def get_pair_spread(self, pair: Tuple[str]) -> Tuple[float]:        
+        if self.aio:
+            return self.run(self.aio.get_pair_spread(pair))
         
-        r = requests.get(f"{self.SERVER}{self.TICKER_ENDPOINT}?symbol={pair[0]}-{pair[1]}").json()
+        r = self.http.get(f"{self.SERVER}{self.TICKER_ENDPOINT}?symbol={pair[0]}-{pair[1]}").json()
         if r['data']:
             bid = r['data']['bestBid']
             ask = r['data']['bestAsk']
@@ -193,7 +269,7 @@ class KucoinAPI(ExchangeAPI):
     def get_multiple_spreads(self, pairs: List[tuple]) -> List[Tuple[float]]:
         urls = [f"{self.SERVER}{self.TICKER_ENDPOINT}?symbol={pair[0]}-{pair[1]}" for pair in pairs] 
         with ThreadPoolExecutor(max_workers=10) as pool:
-            response_list = list(pool.map(requests.get, urls))
+            response_list = list(pool.map(self.http.get, urls))
         
         out = {}
         for response in response_list:
@@ -209,62 +285,50 @@ class KucoinAPI(ExchangeAPI):
     
     def get_multiple_orderbooks(self, pairs: List[tuple]):
         ''' pairs : ('ETH', 'BTC') '''
-        
-        def divide_chunks(l, n):
-                # looping till length l
-                for i in range(0, len(l), n): 
-                    yield l[i:i + n]
+        if self.aio:
+            return self.run(self.aio.get_multiple_orderbooks(pairs))
+
+        # The rate limiter paces the requests, so they can all be queued at once
+        urls = [f"{self.SERVER}{self.ORDERBOOK_ENDPOINT}?symbol={pair[0]}-{pair[1]}" for pair in pairs] 
+        with ThreadPoolExecutor(max_workers=40) as pool:
+            response_list = list(pool.map(self.http.get, urls))
 
         out = {}
-        num_reqs = 0 
-        t_last_request = None
-        for chunk in divide_chunks(pairs, 20):
-            if t_last_request:
-                
-                while (time.time() - t_last_request) < 1/self.request_freq:
-                    time.sleep(.05)
-            
-            urls = [f"{self.SERVER}{self.ORDERBOOK_ENDPOINT}?symbol={pair[0]}-{pair[1]}" for pair in chunk] 
-            with ThreadPoolExecutor(max_workers=40) as pool:
-                response_list = list(pool.map(requests.get, urls))
-            t_last_request = time.time()
-
-            for i, response in enumerate(response_list):
-                data = response.json()
-                if 'data' in data:
-                    out[chunk[i]] = data['data']
-                elif data['code'] == '429000':
-                        print(data)
-                        raise TooManyRequests
-                else:
-                    raise Exception (f"Unexpected response from API: {data}")
-            
-                num_reqs += 1
-                print(num_reqs)
+        for pair, response in zip(pairs, response_list):
+            data = response.json()
+            if 'data' in data:
+                out[pair] = data['data']
+            elif data['code'] == '429000':
+                print(data)
+                raise TooManyRequests # Still rate limited after the limiter's retries
+            else:
+                raise Exception (f"Unexpected response from API: {data}")
 
         return out
     
     def add_price_stream(self, pair:Tuple[str]) -> None:
         # Facillitate easy selection of payload type, build payload, then send the dictionary to the socket
-        self.topics_in_use.append("/market/ticker:{pair[0]}-{pair[1]}")
         payload = { 'id': self.connectID,
                     "type": "subscribe",
                     "topic": f"/market/ticker:{pair[0]}-{pair[1]}",
                     "privateChannel": False}
         self.payloads.append(payload)
-        self.socket.send(json.dumps(payload))
+        self.subscribe(payload)
     
     def reset_subscriptions(self):
-        for payload in self.payloads:
-            payload['type'] = "unsubscribe"
-            self.socket.send(json.dumps(payload)) 
-            time.sleep(.1)     
-        for payload in self.payloads:
-            payload['type'] = "subscribe"
-            self.socket.send(json.dumps(payload)) 
-            time.sleep(.1)  
-
-    def subscribe_all(self, pairs: List[tuple]=None, limit:int=300) -> None:
+        if self.aio:
+            return self.run(self.aio.reset_subscriptions())
+        for connection in self.socket.connections:
+            for payload in connection.subscriptions:
+                payload['type'] = "unsubscribe"
+                connection.send(json.dumps(payload)) 
+                time.sleep(.1)     
+            for payload in connection.subscriptions:
+                payload['type'] = "subscribe"
+                connection.send(json.dumps(payload)) 
+                time.sleep(.1)  
+
+    def subscribe_all(self, pairs: List[tuple]=None, limit:int=None) -> None:
         ''' Subscribe too pair price and orderbook stream'''
         if pairs:
             if limit:
@@ -282,7 +346,7 @@ class KucoinAPI(ExchangeAPI):
                             "topic": f"/market/ticker:{tickers}",
                             "subscription": {"name": "ticker"}}
                 self.payloads.append(payload)
-                self.socket.send(json.dumps(payload)) 
+                self.subscribe(payload, n_topics=len(pairs)) 
             return     
         
         payload = { 'id': self.connectID,
@@ -290,9 +354,9 @@ class KucoinAPI(ExchangeAPI):
                     "topic": f"/market/ticker:all",
                     "response":"true"}
         self.payloads.append(payload)
-        self.socket.send(json.dumps(payload))
+        self.subscribe(payload)
 
-    def subscribe_level2(self, pairs: List[tuple], limit:int=300):
+    def subscribe_level2(self, pairs: List[tuple], limit:int=None):
         def divide_chunks(l, n):
                 # looping till length l
                 for i in range(0, len(l), n): 
@@ -306,7 +370,7 @@ class KucoinAPI(ExchangeAPI):
             payload = { 'id': self.connectID,
                         "type": "subscribe",
                         "topic": f"/market/level2:{symbols}"}
-            self.socket.send(json.dumps(payload))
+            self.subscribe(payload, n_topics=len(chunk))
         
         self.active_streams.append(self.LEVEL2_UPDATE_EVENT_ID)    
    
@@ -316,7 +380,7 @@ class KucoinAPI(ExchangeAPI):
                     "topic": "/spotMarket/tradeOrders",
                     "privateChannel": "true"}
         self.payloads.append(payload)
-        self.socket.send(json.dumps(payload))
+        self.subscribe(payload)
         self.active_streams.append(self.ORDER_UPDATE_EVENT_ID)      
     
     def subscribe_account_balance_notice(self):
@@ -325,7 +389,7 @@ class KucoinAPI(ExchangeAPI):
                     "topic": "/account/balance",
                     "privateChannel": "true"}
         self.payloads.append(payload)
-        self.socket.send(json.dumps(payload)) 
+        self.subscribe(payload) 
         self.active_streams.append(self.ACCOUNT_BALANCE_UPDATE_EVENT_ID)
 
     def stream_listen(self, message) -> None:
@@ -338,39 +402,29 @@ class KucoinAPI(ExchangeAPI):
         if self.showDataStream:
             print(message)
         
-        message = json.loads(message)
+        message = loads(message)
 
-        if message['type'] == "pong":
-            print(message)
-            self.last_pong_time = time.time()
-            return
         if message['type'] != "message":
+            if message['type'] == "pong":
+                self.last_pong_time = time.time()
+                (self.aio or self.socket).pong_received(message.get('id'), self.last_pong_time)
             print(message)
             return
         
-        if "/market/ticker" in message['topic']:
-            if message['subject'] == "trade.ticker":
-                ticker = re.search(r"ticker:(\w+-\w+)", message['topic']).group(1)
-            else:
-                ticker = message['subject']
-
-            base, qoute = ticker.split("-")
+        topic = message['topic']
+        prefix, _, symbols = topic.partition(':')
+        route = self.routes.get(prefix)
+        if route:
+            route(symbols, message['subject'], message['data'])
 
-            data = {}
-            data['close'] = message['data']['price']
-            data['bid'] = message['data']['bestBid']
-            data['ask'] = message['data']['bestAsk']
-            events.post_event(self.PAIR_UPDATE_EVENT_ID, ((base,qoute),data))
-            return
-        
-        if "/market/level2" in message['topic']:
-            events.post_event(self.LEVEL2_UPDATE_EVENT_ID, message['data'])
-        if "/spotMarket/tradeOrders" in message['topic']:
-            events.post_event(self.ORDER_UPDATE_EVENT_ID, message['data'])
-        if "/account/balance" in message['topic']:
-            events.post_event(self.ACCOUNT_BALANCE_UPDATE_EVENT_ID, message['data'])
+    def route_ticker(self, symbol:str, subject:str, data:dict) -> None:
+        # Single symbol subscriptions carry the symbol in the topic, '/market/ticker:all' carries it in the subject
+        base, qoute = (symbol if subject == "trade.ticker" else subject).split("-")
+        events.post_event(self.PAIR_UPDATE_EVENT_ID, ((base,qoute), {'close': data['price'], 'bid': data['bestBid'], 'ask': data['bestAsk']}))
 
     def market_order(self, order:MarketOrder):
+        if self.aio:
+            return self.run(self.aio.market_order(order))
         oID = str(uuid4()).replace('-', '')
         pair = f"{order.pair[0]}-{order.pair[1]}"
         volume_type = {"buy":"funds", "sell":"size"}
@@ -387,6 +441,8 @@ class KucoinAPI(ExchangeAPI):
             return r['data']['orderId']
 
     def limit_order(self, order:LimitOrder):
+        if self.aio:
+            return self.run(self.aio.limit_order(order))
         oID = str(uuid4()).replace('-', '')
         pair = f"{order.pair[0]}-{order.pair[1]}"
         
@@ -406,6 +462,8 @@ class KucoinAPI(ExchangeAPI):
 
     def get_portfolio(self, return_raw_balance=False) -> dict:
         '''Request portfolio information for an authenticated account and return a portfolio object'''
+        if self.aio:
+            return self.run(self.aio.get_portfolio())
         r = self.Auth.request(self.ACCOUNT_ENDPOINT, "GET").json()
 
 
@@ -0,0 +1,157 @@
+from bisect import insort
+from itertools import count
+from threading import Condition
+import asyncio
+import time
+
+class TokenBucket:
+    ''' Holds up to capacity tokens, refilled at rate tokens per second'''
+    def __init__(self, rate:float, capacity:float):
+        self.base_rate = rate # Configured rate, the adaptive rate recovers back up to this
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def refill(self, now:float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.last)*self.rate)
+        self.last = now
+
+    def wait_time(self, needed:float=1) -> float:
+        ''' Seconds until needed tokens are available (call after refill)'''
+        return max(0, (needed - self.tokens)/self.rate)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+class RateLimiter:
+    '''
+    Token buckets for each endpoint class plus one overall bucket shared by every REST call. Requests block
+    in acquire() until both their class bucket and the overall bucket have a token, and a waiting request
+    never takes an overall token while a higher priority request is ready for it, so order placement
+    pre-empts snapshot fetches. The last reserve overall tokens are kept for orders so they don't wait
+    behind a saturated bucket. A 429 pauses the class with exponential backoff and halves its rate,
+    and each success recovers the rate towards the configured one (additive increase, multiplicative decrease).
+    Coroutines wait in acquire_async, which sleeps on the event loop instead of blocking a thread.
+
+    The public rate matches the pacing snapshots were fetched at before the limiter (chunks of 20 requests
+    every .2s) and orders get the 45 requests per 3s Kucoin allows for order placement
+    '''
+    PUBLIC = "public" # Market data
+    PRIVATE = "private" # Account data
+    ORDERS = "orders" # Order placement
+    PRIORITY = {ORDERS: 0, PRIVATE: 1, PUBLIC: 2} # Lower goes first
+
+    def __init__(self, limits:dict=None, overall:tuple=(130, 50), reserve:int=3, max_retries:int=5, backoff:float=.5,
+                 max_backoff:float=30):
+        limits = limits or {self.PUBLIC: (100, 20), self.PRIVATE: (15, 30), self.ORDERS: (15, 45)} # class: (rate, capacity)
+        self.buckets = {endpoint_class: TokenBucket(*limit) for endpoint_class, limit in limits.items()}
+        self.overall = TokenBucket(*overall)
+        self.reserve = reserve
+        self.max_retries = max_retries
+        self.backoff_delay = backoff
+        self.max_backoff = max_backoff
+        self.paused_until = {endpoint_class: 0 for endpoint_class in self.buckets}
+        self.failures = {endpoint_class: 0 for endpoint_class in self.buckets} # Consecutive 429s
+        self.waiting = [] # (priority, order, endpoint_class) of the requests waiting in acquire, highest priority first
+        self.order = count()
+        self.condition = Condition()
+
+    def acquire(self, endpoint_class:str) -> None:
+        ''' Block until a request of endpoint_class may be sent'''
+        waiter = (self.PRIORITY[endpoint_class], next(self.order), endpoint_class)
+        with self.condition:
+            insort(self.waiting, waiter)
+            try:
+                while True:
+                    wait = self.try_take(waiter)
+                    if wait == 0:
+                        return
+                    self.condition.wait(wait)
+            finally:
+                self.waiting.remove(waiter)
+                self.condition.notify_all()
+
+    async def acquire_async(self, endpoint_class:str) -> None:
+        ''' Wait on the event loop until a request of endpoint_class may be sent'''
+        waiter = (self.PRIORITY[endpoint_class], next(self.order), endpoint_class)
+        with self.condition:
+            insort(self.waiting, waiter)
+        try:
+            while True:
+                with self.condition:
+                    wait = self.try_take(waiter)
+                if wait == 0:
+                    return
+                # Coroutines can't be notified, so a pre-empted one checks again after one overall token
+                await asyncio.sleep(wait or 1/self.overall.rate)
+        finally:
+            with self.condition:
+                self.waiting.remove(waiter)
+                self.condition.notify_all()
+
+    def try_take(self, waiter:tuple) -> float:
+        '''
+        Take the tokens for waiter if it may go now and return 0, otherwise return how long until it may
+        (None while a higher priority request is ahead of it). Call with condition held
+        '''
+        endpoint_class = waiter[2]
+        now = time.monotonic()
+        self.overall.refill(now)
+        for bucket in self.buckets.values():
+            bucket.refill(now)
+
+        wait = self.class_wait(endpoint_class, now)
+        if wait > 0:
+            return wait
+        if self.preempted(waiter, now):
+            return None
+        wait = self.overall.wait_time(1 if endpoint_class == self.ORDERS else 1 + self.reserve)
+        if wait == 0:
+            self.buckets[endpoint_class].take()
+            self.overall.take()
+        return wait
+
+    def class_wait(self, endpoint_class:str, now:float) -> float:
+        return max(self.buckets[endpoint_class].wait_time(), self.paused_until[endpoint_class] - now, 0)
+
+    def preempted(self, waiter:tuple, now:float) -> bool:
+        ''' True if a higher priority request is only waiting on the overall bucket'''
+        for other in self.waiting:
+            if other[0] >= waiter[0]:
+                return False
+            if self.class_wait(other[2], now) == 0:
+                return True
+        return False
+
+    def backoff(self, endpoint_class:str, retry_after:float=None) -> float:
+        ''' Register a 429 for endpoint_class and return how long the class is paused for'''
+        with self.condition:
+            self.failures[endpoint_class] += 1
+            delay = retry_after or min(self.backoff_delay*2**(self.failures[endpoint_class] - 1), self.max_backoff)
+            self.paused_until[endpoint_class] = max(self.paused_until[endpoint_class], time.monotonic() + delay)
+            bucket = self.buckets[endpoint_class]
+            bucket.rate = max(bucket.rate/2, bucket.base_rate/16)
+            bucket.tokens = min(bucket.tokens, 0)
+            self.condition.notify_all()
+        print(f"Rate limited ({endpoint_class}), backing off for {delay:.2f}s")
+        return delay
+
+    def success(self, endpoint_class:str) -> None:
+        bucket = self.buckets[endpoint_class]
+        if self.failures[endpoint_class] or bucket.rate < bucket.base_rate:
+            with self.condition:
+                self.failures[endpoint_class] = 0
+                bucket.rate = min(bucket.base_rate, bucket.rate + bucket.base_rate/20)
+
+    @staticmethod
+    def is_rate_limited(status:int, text:str) -> bool:
+        # Kucoin answers with HTTP 429 and/or a 429000 code in the body
+        return status == 429 or '"code":"429000"' in text
+
+    @staticmethod
+    def retry_after(headers) -> float:
+        try:
+            return float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
@@ -1,4 +1,5 @@
-from threading import Thread
+from threading import Thread, Lock
+from queue import Queue
 import json
 import websocket
 from time import sleep
@@ -6,7 +7,7 @@ from CustomExceptions import SocketDisconnect
 from APIs import ExchangeAPI
 
 class WebSocketClient:
-    def __init__(self, parentExchange: ExchangeAPI, url: str):
+    def __init__(self, parentExchange: ExchangeAPI, url: str, connect_id:str=None, ping_interval:float=None):
         self.url = url
         self.ws = websocket.WebSocketApp(url, on_message=self.on_message, 
                                             on_open=self.on_open, 
@@ -15,6 +16,10 @@ class WebSocketClient:
         self.parentExchange  = parentExchange
         self.socket_open = False
         self.thread_started = False
+        self.connect_id = connect_id
+        self.ping_interval = ping_interval
+        self.last_pong_time = 0
+        self.subscriptions = [] # Subscription payloads sent on this connection
 
     def on_open(self, wsapp):
         self.socket_open = True
@@ -90,3 +95,80 @@ class WebSocketClient:
         print("Websocket disconnected, attempting to reconnect...")
         sleep(5)
         return self.connect()
+
+class WebSocketPool:
+    '''
+    Spreads topic subscriptions over as many WebSocketClients as needed to stay within the per socket 
+    subscription limit. Frames from every connection are queued in arrival order and passed to the 
+    parent exchange's stream_listen by a single dispatch thread, so socket reads never wait on parsing
+    '''
+    def __init__(self, parentExchange: ExchangeAPI, new_connection, subscription_limit:int=300):
+        self.parentExchange = parentExchange
+        self.new_connection = new_connection # fn(pool) -> WebSocketClient with a fresh url and connect id
+        self.subscription_limit = subscription_limit
+        self.connections = []
+        self.topic_counts = [] # Topics subscribed on each connection
+        self.connection_listeners = [] # Called with every connection, including ones opened later
+        self.lock = Lock()
+        self.frames = Queue()
+        self.dispatch_thread = Thread(target=self.dispatch)
+        self.dispatch_thread.daemon = True
+        self.dispatch_thread.start()
+        self.open_connection()
+
+    @property
+    def connected(self) -> bool:
+        return any(connection.connected for connection in self.connections)
+
+    def open_connection(self) -> WebSocketClient:
+        connection = self.new_connection(self)
+        self.connections.append(connection)
+        self.topic_counts.append(0)
+        for listener in self.connection_listeners:
+            listener(connection)
+        return connection
+
+    def for_each_connection(self, listener) -> None:
+        ''' Call listener with every open connection and with each connection opened from now on'''
+        with self.lock:
+            self.connection_listeners.append(listener)
+            connections = list(self.connections)
+        for connection in connections:
+            listener(connection)
+
+    def subscribe(self, payload:dict, n_topics:int=1) -> WebSocketClient:
+        ''' Send a subscription on the first connection with room for n_topics more, opening a new one if none has'''
+        with self.lock:
+            for i, count in enumerate(self.topic_counts):
+                if count + n_topics <= self.subscription_limit:
+                    break
+            else:
+                self.open_connection()
+                i = len(self.connections) - 1
+                print(f"Opened websocket connection {i + 1} for {n_topics} more topics")
+            self.topic_counts[i] += n_topics
+            connection = self.connections[i]
+            connection.subscriptions.append(payload)
+        connection.send(json.dumps(payload))
+        return connection
+
+    def send(self, payload:json):
+        ''' Send a non subscription message on the first connection'''
+        self.connections[0].send(payload)
+
+    def pong_received(self, connect_id:str, receive_time:float) -> None:
+        for connection in self.connections:
+            if connection.connect_id == connect_id:
+                connection.last_pong_time = receive_time
+
+    def stream_listen(self, message) -> None:
+        # Called on each connection's socket thread, only queue the frame
+        self.frames.put(message)
+
+    def dispatch(self) -> None:
+        while True:
+            message = self.frames.get()
+            try:
+                self.parentExchange.stream_listen(message)
+            except Exception as e:
+                print(f"Failed to process websocket message: {e}")
@@ -2,7 +2,7 @@ import base64
 import hashlib
 import hmac
 import time
-import requests
+from APIs.HTTPSession import HTTPSession
 from util.obj_funcs import load_json
 
 class KucoinAuthenticator:
@@ -18,8 +18,9 @@ class KucoinAuthenticator:
     else:
         PASSPHRASE = None
 
-    def __init__(self, server):
+    def __init__(self, server, http:HTTPSession=None):
         self.SERVER = server
+        self.http = http or HTTPSession()
         self.unlock()
 
     def unlock(self):
@@ -29,6 +30,16 @@ class KucoinAuthenticator:
     
     def request(self, endpoint, type="GET", data=None):
         URL = self.SERVER + endpoint
+        headers = lambda: self.headers(endpoint, type, data) # Signed per attempt so retries carry a fresh timestamp
+
+        if type.upper() == "POST":
+            return self.http.post(URL, headers=headers, data=data)
+
+        if type.upper() == "GET":
+            return self.http.get(URL, headers=headers)
+
+    def headers(self, endpoint, type="GET", data=None) -> dict:
+        ''' Return the signed headers for a request (shared with the asyncio client)'''
         now = int(time.time() * 1000)
         str_to_sign = str(now) + type.upper() + endpoint
         if data:
@@ -41,19 +52,15 @@ class KucoinAuthenticator:
 
         passphrase = self.encode(self.PASSPHRASE)
         headers = {
-                    "KC-API-SIGN": signature,
+                    "KC-API-SIGN": signature.decode(),
                     "KC-API-TIMESTAMP": str(now),
                     "KC-API-KEY": self.API_KEY,
-                    "KC-API-PASSPHRASE": passphrase,
+                    "KC-API-PASSPHRASE": passphrase.decode(),
                     "KC-API-KEY-VERSION": "2"
                    }
-
         if type.upper() == "POST":
             headers["Content-Type"] = "application/json"
-            return requests.request('post', URL, headers=headers, data=data)
-
-        if type.upper() == "GET":
-            return requests.request('get', URL, headers=headers)    
+        return headers
 
     def encode(self, msg):
         return base64.b64encode(hmac.new(self.API_SECRET.encode('utf-8'), msg.encode('utf-8'), hashlib.sha256).digest())
@@ -0,0 +1,123 @@
+import numpy as np
+from ArbitrageEngines import SequenceTrader
+from enums import tradeSide
+
+class CycleEvaluator:
+    '''
+    Evaluates every sequence in a fixed universe at once.
+    Sequences are stored as int arrays of pair ids and side codes (one row per sequence, one column
+    per trade) so profits can be computed with NumPy gathers instead of per-sequence calls
+    '''
+    def __init__(self, SequenceTrader:SequenceTrader, sequences:tuple[tuple]):
+        self.SequenceTrader = SequenceTrader
+        self.OrderVolumeSizer = SequenceTrader.OrderVolumeSizer
+        self.Pairs = SequenceTrader.DataManager.Pairs
+        self.sequences = tuple(sequences)
+
+        sizer = self.OrderVolumeSizer
+        shape = (len(self.sequences), len(self.sequences[0]) if self.sequences else 0)
+        self.pair_ids = np.array([[sizer.get_pair_id(pair) for _, pair in seq] for seq in self.sequences],
+                                 dtype=np.int64).reshape(shape)
+        self.sides = np.array([[sizer.SIDE_CODE[side] for side, _ in seq] for seq in self.sequences],
+                              dtype=np.int64).reshape(shape)
+        self.buy = self.sides == sizer.SIDE_CODE[tradeSide.BUY]
+        self.fees = np.array([self.Pairs[pair].fee or 0 for pair in sizer.pairList])
+        self.profits = np.full(len(self.sequences), -1.0)
+        self.evaluated = False # Set once every sequence has been priced
+        self.evaluated_amount = None # Starting amount the cached profits were computed with
+        self.updated = np.zeros(0, dtype=np.int64) # Indices of the sequences re-priced by the last evaluation
+        self.index_of = {sequence: i for i, sequence in enumerate(self.sequences)}
+
+        # Inverted index of pair id -> indices of the sequences that trade it
+        flat_ids = self.pair_ids.ravel()
+        seq_index = np.repeat(np.arange(len(self.sequences)), self.pair_ids.shape[1])
+        order = np.argsort(flat_ids, kind='stable')
+        ids, starts = np.unique(flat_ids[order], return_index=True)
+        self.pair_sequences = {int(pair_id): np.unique(indices) 
+                               for pair_id, indices in zip(ids, np.split(seq_index[order], starts[1:]))}
+
+    def __len__(self) -> int:
+        return len(self.sequences)
+
+    def top_of_book_profits(self, index:np.ndarray=None) -> np.ndarray:
+        ''' Profit of each sequence when every trade fills at the best price level'''
+        pair_ids, sides, buy = self.__select(index)
+        prices = self.OrderVolumeSizer.get_top_prices(pair_ids.ravel(), sides.ravel()).reshape(pair_ids.shape)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = np.where(buy, 1/prices, prices)*(1 - self.fees[pair_ids])
+            profits = rates.prod(axis=1) - 1
+        return np.where(np.isnan(profits), -1, profits)
+
+    def depth_profits(self, starting_amount:float, index:np.ndarray=None) -> np.ndarray:
+        ''' Profit of each sequence when trading starting_amount through the book depth of each trade'''
+        pair_ids, sides, buy = self.__select(index)
+        amounts = np.full(len(pair_ids), float(starting_amount))
+        exhausted = np.zeros(len(pair_ids), dtype=bool)
+        for i in range(pair_ids.shape[1]):
+            fill_prices, leg_exhausted = self.OrderVolumeSizer.get_batch_fill_prices(pair_ids[:, i], sides[:, i], amounts)
+            exhausted |= leg_exhausted
+            with np.errstate(divide='ignore', invalid='ignore'):
+                amounts = np.where(buy[:, i], amounts/fill_prices, amounts*fill_prices)*(1 - self.fees[pair_ids[:, i]])
+        return np.where(exhausted, -1, amounts/starting_amount - 1)
+
+    def evaluate(self, starting_amount:float=None, index:np.ndarray=None) -> np.ndarray:
+        '''
+        Compute and cache the profit of the sequences (all of them unless an index is given). Book depth is
+        accounted for when a starting amount is given, otherwise top of book prices are used
+        '''
+        if len(self.sequences) == 0:
+            return self.profits
+        if starting_amount:
+            profits = self.depth_profits(starting_amount, index)
+        else:
+            profits = self.top_of_book_profits(index)
+
+        if index is None:
+            self.profits = profits
+            self.updated = np.arange(len(self.sequences))
+            self.evaluated = True
+        else:
+            self.profits[index] = profits
+            self.updated = index
+        self.evaluated_amount = starting_amount
+        return self.profits
+
+    def affected_sequences(self, pairs) -> np.ndarray:
+        ''' Return the indices of the sequences that trade any of the given pairs'''
+        pair_ids = self.OrderVolumeSizer.pair_ids
+        indices = [self.pair_sequences[pair_ids[pair]] for pair in pairs 
+                   if pair in pair_ids and pair_ids[pair] in self.pair_sequences]
+        if not indices:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(indices))
+
+    def reevaluate(self, dirty_pairs, starting_amount:float=None) -> np.ndarray:
+        ''' 
+        Re-price only the sequences that trade a pair in dirty_pairs and keep the cached profit for the rest.
+        Everything is re-priced if the starting amount changed since the last evaluation
+        '''
+        if not self.evaluated or starting_amount != self.evaluated_amount:
+            return self.evaluate(starting_amount)
+        
+        index = self.affected_sequences(dirty_pairs)
+        if len(index):
+            self.evaluate(starting_amount, index)
+        else:
+            self.updated = index
+        return self.profits
+
+    def best(self, n:int=1, min_profit:float=None) -> list[tuple[float, tuple]]:
+        ''' Return up to n (profit, sequence) tuples with the highest cached profit'''
+        n = min(n, len(self.sequences))
+        if n == 0:
+            return []
+        top = np.argpartition(self.profits, -n)[-n:]
+        top = top[np.argsort(self.profits[top])[::-1]]
+        if min_profit is not None:
+            top = top[self.profits[top] > min_profit]
+        return [(float(self.profits[i]), self.sequences[i]) for i in top]
+
+    def __select(self, index:np.ndarray=None):
+        if index is None:
+            return self.pair_ids, self.sides, self.buy
+        return self.pair_ids[index], self.sides[index], self.buy[index]
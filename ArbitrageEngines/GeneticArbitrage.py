@@ -1,9 +1,17 @@
-import random
-from statistics import median
+import os
+import time
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import Thread, Lock
 from typing import Tuple
 from util.currency_funcs import remove_single_swapable_coins
+from util.MarketGraph import MarketGraph
 from Modules.DataManagement import ExchangeData
 from ArbitrageEngines import SequenceTrader
+from ArbitrageEngines.SequencePopulation import MarketEncoding, SequencePopulation, sequence_profits, next_generation
+from ArbitrageEngines.IslandModel import DepthSnapshot, init_island_worker, evolve_island, migrate
 
 class GeneticArbitrageEngine:
     def __init__(self, set_size, DataManager:ExchangeData, SequenceTrader:SequenceTrader, base_cur="USDT"):
@@ -16,55 +24,83 @@ class GeneticArbitrageEngine:
         self.sequence_lengths = (3,4)
         self.set_size = set_size
         self.base_cur = base_cur
+        self.rng = np.random.default_rng()
+        self.encoding = None # MarketEncoding of the pairs being evolved over
+        self.gene_rows = None # OrderVolumeSizer depth matrix row of each gene
+        self.gene_fees = None
+
+        # Fitness memoized on (genes, orderbook versions of the pairs traded) for the current starting amount
+        self.fitness_memo = OrderedDict()
+        self.fitness_memo_size = 100000
+        self.fitness_memo_lock = Lock()
+        self.fitness_amount = None
+        self.fitness_hits = 0
+        self.fitness_misses = 0
+
+        self.island_pool = None # ProcessPoolExecutor used by do_island_evolution
+        self.island_workers = 0
+        self.island_encoding = None # Encoding the pool's workers were initialized with
+
+        # Continuous evolution mode
+        self.injection_rate = .1 # Fraction of set_size replaced with fresh random sequences each generation
+        self.elite_size = 10
+        self.population = None # Persistent SequencePopulation
+        self.elite = [] # [(profit, sequence), ...] best first, replaced (never mutated) each generation
+        self.thread = None
+        self.running = False
         
-    def generate_sequence(self, pairList, vector_length, starting_cur, ending_cur):
-        # start with a
-        # loop:
-        # find currencies tradeable with a
-        # choose a currency from that list (b)
-        # find pairs tradeable with b
-        # b becomes a
-
-        sequence = []
-        prev_choice = None
-        Cur_A = starting_cur
-        for i in range(vector_length-1):
-            tradeable_w_A = [pair for pair in pairList if Cur_A in pair]
-
-            if not tradeable_w_A:
-                print(f"Couldn't match a tradeable pair with {Cur_A}")
-                return
-
-            choice = random.choice(tradeable_w_A)
-
-            if i < vector_length - 2:
-                pairList.remove(choice)
-            if prev_choice:
-                pairList.append(prev_choice)
-
-            prev_choice = choice
-
-            if Cur_A == choice[0]: # Owned cur on top
-                Cur_B = choice[1]
-                # sell the owned cur for the next cur
-                sequence.append(("sell", (Cur_A, Cur_B)))
-            elif Cur_A == choice[1]:
-                Cur_B = choice[0]
-                # buy the next cur for the owned cur
-                sequence.append(("buy", (Cur_B, Cur_A)))
-            else:
-                raise Exception("Fatal error occured during arbitrage sequence generation")
-            Cur_A = Cur_B
-
-        if ending_cur != Cur_A:
-            if (Cur_A, ending_cur) in pairList:
-                sequence.append(("sell", (Cur_A, ending_cur)))
-            elif (ending_cur, Cur_A) in pairList:
-                sequence.append(("buy", (ending_cur, Cur_A)))
-            else:
-                return self.generate_sequence(pairList, vector_length, starting_cur, ending_cur)
-        
-        return sequence
+    def build_encoding(self, pairList) -> MarketEncoding:
+        ''' Encode the pairs as genes and map each gene to its OrderVolumeSizer depth row and fee'''
+        self.encoding = MarketEncoding(MarketGraph(pairList))
+        sizer = self.SequenceTrader.OrderVolumeSizer
+        pair_ids = np.array([sizer.get_pair_id(pair) for pair in self.encoding.pairs], dtype=np.int64)
+        self.gene_rows = np.repeat(2*pair_ids, 2) + np.tile(np.arange(2), len(pair_ids))
+        self.gene_fees = np.repeat([self.Pairs[pair].fee or 0 for pair in self.encoding.pairs], 2)
+        return self.encoding
+
+    def fitness(self, population:SequencePopulation) -> np.ndarray:
+        ''' 
+        Profit of every sequence in the population, priced in one pass per trade index. Scores are memoized on
+        the genes and the orderbook versions of the pairs traded, so duplicate and unchanged sequences cost a lookup
+        '''
+        starting_amount = self.SequenceTrader.session.balance.get(self.base_cur)
+        versions = np.array([self.Pairs[pair].orderbook.version for pair in self.encoding.pairs], dtype=np.int64)
+        genes = population.genes
+        active = genes >= 0
+        touched = np.where(active, versions[np.where(active, genes >> 1, 0)], -1)
+        keys = [row.tobytes() for row in np.concatenate((genes, touched), axis=1)]
+
+        profits = np.empty(len(keys))
+        missing = []
+        with self.fitness_memo_lock:
+            if starting_amount != self.fitness_amount:
+                self.fitness_memo.clear()
+                self.fitness_amount = starting_amount
+            for i, key in enumerate(keys):
+                profit = self.fitness_memo.get(key)
+                if profit is None:
+                    missing.append(i)
+                else:
+                    self.fitness_memo.move_to_end(key)
+                    profits[i] = profit
+            self.fitness_hits += len(keys) - len(missing)
+            self.fitness_misses += len(missing)
+        if not missing:
+            return profits
+
+        genes = genes[missing]
+        sizer = self.SequenceTrader.OrderVolumeSizer
+        with sizer.depth_lock:
+            sizer.refresh_depth_rows(np.unique(self.gene_rows[genes[genes >= 0]]))
+            depth = (sizer.depth_prices, sizer.depth_sizes, sizer.depth_cum_base, sizer.depth_cum_qoute)
+            profits[missing] = sequence_profits(genes, self.gene_rows, self.gene_fees, depth, starting_amount)
+
+        with self.fitness_memo_lock:
+            for i in missing:
+                self.fitness_memo[keys[i]] = float(profits[i])
+            while len(self.fitness_memo) > self.fitness_memo_size:
+                self.fitness_memo.popitem(last=False)
+        return profits
 
     def choose_pregenerated_sequence(self):
         pass
@@ -86,134 +122,140 @@ class GeneticArbitrageEngine:
         out_list = remove_single_swapable_coins(pairList)
         return out_list
 
-    def do_evolution(self) -> Tuple[float, Tuple[str]]:
+    def do_evolution(self) -> Tuple[float, Tuple[tuple]]:
         ''' Generates sequences, evaluates their performance, then kills off the poorest performers '''
     
         cleaned_pairs = self.cleanup_pairList() # Removes pairList pairs if there is only one qoute currency
         if len(cleaned_pairs) < 100:
             return (None, None)
+        if self.encoding is None or set(self.encoding.pairs) != set(cleaned_pairs):
+            self.build_encoding(cleaned_pairs)
         
         # Get first generation of sequences
-        population = [self.generate_sequence(cleaned_pairs, random.choice(self.sequence_lengths), self.base_cur, self.base_cur) for _ in range(self.set_size)]
+        population = SequencePopulation.random(self.encoding, self.rng, self.set_size, self.sequence_lengths, 
+                                               self.base_cur, self.base_cur)
 
         while len(population) > 2:
             # Evaluate sequences
-            profits = [self.SequenceTrader.get_sequence_profit(sequence)[0] for sequence in population if sequence]
+            profits = self.fitness(population)
             
-            # Take the best
-            i = profits.index(max(profits))
-            best = population[i]
-
-            # Filter out bottom 50%
-            filtered_population = [sequence for sequence, profit in zip(population,profits) if profit > median(profits)]
-            
-            # Recombine to form new sequences
-            population = self.recombine_sequences(filtered_population)
-            
-            if not population:
-                population.append(best)
-                population = prev_population
+            # Keep the best, recombine the top 50% and mutate the children
+            children = next_generation(population, profits, self.rng, self.mutation_rate, self.base_cur)
+            if not len(children):
                 break
-
-            # Mutate
-            for i, sequence in enumerate(population):
-                if random.random() < self.mutation_rate:
-                    i_rand = random.randint(1,len(sequence)-2)
-                    cutoff_sequence = sequence[:i_rand]
-                    if "buy" in cutoff_sequence[-1][0]:
-                        owned = cutoff_sequence[-1][1][0]
-                    else:
-                        owned = cutoff_sequence[-1][1][1]  
-                    
-                    mutated = cutoff_sequence + self.generate_sequence(cleaned_pairs, 
-                                                                       len(sequence) - len(cutoff_sequence), 
-                                                                       starting_cur=owned, 
-                                                                       ending_cur=self.base_cur)
-                    population[i] = mutated
-            
-            population.append(best)
-            prev_population = population
-        
-        final_profits = [self.SequenceTrader.get_sequence_profit(sequence)[0] for sequence in population]
-        profit_max = max(final_profits)
-        i_max = final_profits.index(profit_max)
-        sequence = population[final_profits.index(profit_max)]
-        return (profit_max, population[i_max])
-
-    def recombine_sequences(self, sequences):
-        duplicate_attempts = 0
-        attempted = []
-        children = []
-        while len(sequences) > 1 and duplicate_attempts < 200:
-            # Choose two at random (remove chosen from list)
-            parent1 = random.choice(sequences)
-            sequences.remove(parent1)
-
-            parent2 = random.choice(sequences)
-            sequences.remove(parent2)
-
-            if (parent1, parent2) in attempted:
-                duplicate_attempts += 1
-                #print(duplicate_attempts)
-                continue
-
-            # Check if any of the parents own the same  currency at the same index
-            i_swap = None
-            i = 1
-            for p1, p2 in zip(parent1[:-2], parent2[:-2]):
-                if "buy" in p1[0]:
-                    p1_owned = p1[1][0]
-                else: 
-                    p1_owned = p1[1][1]
-                if "buy" in p2[0]:
-                    p2_owned = p2[1][0]
-                else:
-                    p2_owned = p2[1][1]
-                
-                if p2_owned == p1_owned: # Parents own same coin at this index
-                    i_swap = i
-                    break
-                i += 1
-            
-            # Swap at that index
-            if i_swap:
-                child1 = parent1[:i_swap] + parent2[i_swap:]
-                child2 = parent2[:i_swap] + parent2[i_swap:]
-                if child1 not in children:
-                    children.append(child1)
-                if child2 not in children:
-                    children.append(child2)
-                if self.check_illegal_sequences(children):
-                    raise Exception("Illegal sequence detected")
-            else:
-                attempted.append((parent1,parent2))
-                sequences.append(parent1)
-                sequences.append(parent2)
+            population = children
         
-        return  children
-
-    def check_illegal_sequences(self, sequences): # Testing funciton
-        for sequence in sequences:
-            for i in range(len(sequence)-1):
-                first_coin_in_next = sequence[i][1][0] in sequence[i+1][1][0] or sequence[i][1][0] in sequence[i+1][1][1]
-                second_coin_in_next = sequence[i][1][1] in sequence[i+1][1][0] or sequence[i][1][1] in sequence[i+1][1][1]
-                if not first_coin_in_next:
-                    if not second_coin_in_next:
-                        return True
-
-                if sequence[i][0] == "buy":
-                    owned = sequence[i][1][0]
-                    if sequence[i+1][0] == "sell":
-                        valid = owned == sequence[i+1][1][0]
-                    else:
-                        valid = owned == sequence[i+1][1][1]
-                else:
-                    if sequence[i+1][0] == "sell":
-                        valid = sequence[i][1][1] == sequence[i+1][1][0]
-                    else:
-                        valid = sequence[i][1][1] == sequence[i+1][1][1]
-                if not valid:
-                    return True
-        return False
-
-   
+        final_profits = self.fitness(population)
+        sequence = population.sequence(final_profits.argmax())
+        profit_max = self.SequenceTrader.get_sequence_profit(sequence)
+        return (profit_max, sequence)
+
+    def do_island_evolution(self, islands:int=None, epochs:int=10, generations:int=5, migrants:int=2) -> Tuple[float, Tuple[tuple]]:
+        '''
+        Island model evolution across a process pool. Each of the islands (one per core by default) evolves
+        its own sub-population against a shared memory snapshot of the books for a number of generations,
+        then passes its best migrants to the next island. The global best is verified after the last epoch.
+        Spawned workers re-import the __main__ module, so a script calling this must keep its exchange
+        setup (KucoinAPI(), build_orderbook, ...) under an if __name__ == "__main__" guard
+        '''
+        if epochs < 1:
+            raise Exception("Island evolution needs at least one epoch")
+        cleaned_pairs = self.cleanup_pairList()
+        if len(cleaned_pairs) < 100:
+            return (None, None)
+        if self.encoding is None or set(self.encoding.pairs) != set(cleaned_pairs):
+            self.build_encoding(cleaned_pairs)
+
+        islands = islands or os.cpu_count()
+        if self.island_workers != islands or self.island_encoding is not self.encoding:
+            # Workers are spawned rather than forked (forking a process running websocket threads isn't safe)
+            # and receive the encoding once on startup, so the pool is rebuilt when the encoding changes
+            if self.island_pool:
+                self.island_pool.shutdown()
+            self.island_pool = ProcessPoolExecutor(max_workers=islands, mp_context=get_context("spawn"),
+                                                   initializer=init_island_worker,
+                                                   initargs=(self.encoding, self.gene_fees))
+            self.island_workers = islands
+            self.island_encoding = self.encoding
+
+        island_size = max(self.set_size // islands, 4)
+        populations = [SequencePopulation.random(self.encoding, self.rng, island_size, self.sequence_lengths, 
+                                                 self.base_cur, self.base_cur) for _ in range(islands)]
+        starting_amount = self.SequenceTrader.session.balance.get(self.base_cur)
+        snapshot = DepthSnapshot(self.SequenceTrader.OrderVolumeSizer, self.gene_rows)
+        try:
+            for _ in range(epochs):
+                seeds = self.rng.integers(2**32, size=islands)
+                futures = [self.island_pool.submit(evolve_island, snapshot.spec, snapshot.gene_rows, population.genes,
+                                                   population.owned, generations, starting_amount, self.mutation_rate,
+                                                   self.sequence_lengths, self.base_cur, seed) 
+                           for population, seed in zip(populations, seeds)]
+                results = [future.result() for future in futures]
+                populations = migrate([SequencePopulation(self.encoding, genes, owned) for genes, owned, _ in results], migrants)
+        finally:
+            snapshot.close()
+
+        # Results are sorted best first, so the global best is the best island head
+        if not any(len(profits) for _, _, profits in results):
+            return (None, None)
+        i_best = max(range(islands), key=lambda i: results[i][2][0] if len(results[i][2]) else -1)
+        sequence = self.encoding.decode(results[i_best][0][0])
+        profit_max = self.SequenceTrader.get_sequence_profit(sequence)
+        return (profit_max, sequence)
+
+    def evolve_step(self) -> list[tuple[float, tuple]]:
+        '''
+        Advance the persistent population by one generation: re-score it against the current books, publish
+        the elite, breed the next generation and inject fresh random sequences. Returns the new elite
+        '''
+        cleaned_pairs = self.cleanup_pairList()
+        if len(cleaned_pairs) < 100:
+            return self.elite
+        if self.encoding is None or set(self.encoding.pairs) != set(cleaned_pairs):
+            self.build_encoding(cleaned_pairs)
+            self.population = None
+        if self.population is None or not len(self.population):
+            self.population = SequencePopulation.random(self.encoding, self.rng, self.set_size, self.sequence_lengths,
+                                                        self.base_cur, self.base_cur)
+
+        profits = self.fitness(self.population)
+        top = np.argsort(profits)[::-1][:self.elite_size]
+        self.elite = [(float(profits[i]), self.population.sequence(i)) for i in top]
+
+        children = next_generation(self.population, profits, self.rng, self.mutation_rate, self.base_cur)
+        n_fresh = max(int(self.injection_rate*self.set_size), self.set_size - len(children))
+        fresh = SequencePopulation.random(self.encoding, self.rng, n_fresh, self.sequence_lengths, self.base_cur, self.base_cur)
+        self.population = SequencePopulation.concat(children, fresh).unique()
+        return self.elite
+
+    def get_elite(self, n:int=None) -> list[tuple[float, tuple]]:
+        ''' Return the (profit, sequence) elite of the last generation without waiting on the evolution thread'''
+        return self.elite[:n]
+
+    def begin(self, candidates:int=3, loop_delay:float=.1):
+        '''
+        Continuous evolution mode. The population persists between generations so search progress
+        carries over as the books move:
+        1. Evolve the population by one generation
+        2. Pass the elite sequences (up to candidates) above the profit tolerance to the SequenceTrader
+        3. Repeat from 1
+        '''
+        def mainloop():
+            self.running = True
+            while self.running:
+                for profit, sequence in self.evolve_step()[:candidates]:
+                    if profit > self.SequenceTrader.profit_tolerance:
+                        self.SequenceTrader.get_sequence_profit(sequence, autoExecute=True)
+                time.sleep(loop_delay)
+
+        if not self.thread:
+            self.thread = Thread(target=mainloop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread = None
+
+    def check_illegal_sequences(self, population:SequencePopulation) -> bool: # Testing funciton
+        return bool(population.illegal().any())
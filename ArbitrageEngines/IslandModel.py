@@ -0,0 +1,87 @@
+import numpy as np
+from multiprocessing import shared_memory
+from ArbitrageEngines.SequencePopulation import MarketEncoding, SequencePopulation, sequence_profits, next_generation
+
+class DepthSnapshot:
+    '''
+    Read only copy of the OrderVolumeSizer depth matrix rows used by a set of genes, held in shared memory
+    so worker processes can price sequences without pickling the books. spec is passed to the workers
+    and gene_rows maps each gene to its row in the snapshot
+    '''
+    FIELDS = ("depth_prices", "depth_sizes", "depth_cum_base", "depth_cum_qoute")
+
+    def __init__(self, OrderVolumeSizer, gene_rows:np.ndarray):
+        rows = np.unique(gene_rows)
+        with OrderVolumeSizer.depth_lock:
+            OrderVolumeSizer.refresh_depth_rows(rows)
+            matrices = [getattr(OrderVolumeSizer, field)[rows] for field in self.FIELDS]
+        self.gene_rows = np.searchsorted(rows, gene_rows)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(sum(m.nbytes for m in matrices), 1))
+
+        offset = 0
+        layout = []
+        for matrix in matrices:
+            np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=self.shm.buf, offset=offset)[:] = matrix
+            layout.append((matrix.shape, offset))
+            offset += matrix.nbytes
+        self.spec = (self.shm.name, tuple(layout))
+
+    @staticmethod
+    def attach(spec) -> tuple[shared_memory.SharedMemory, tuple[np.ndarray]]:
+        name, layout = spec
+        shm = shared_memory.SharedMemory(name=name)
+        depth = tuple(np.ndarray(shape, dtype=float, buffer=shm.buf, offset=offset) for shape, offset in layout)
+        return shm, depth
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+# Set in each worker process by init_island_worker
+worker_encoding = None
+worker_gene_fees = None
+
+def init_island_worker(encoding:MarketEncoding, gene_fees:np.ndarray) -> None:
+    ''' Process pool initializer, so the encoding is sent to each worker once instead of with every task'''
+    global worker_encoding, worker_gene_fees
+    worker_encoding, worker_gene_fees = encoding, gene_fees
+
+def evolve_island(spec, gene_rows:np.ndarray, genes:np.ndarray, owned:np.ndarray, generations:int,
+                  starting_amount:float, mutation_rate:float, sequence_lengths:tuple[int], base_cur:str,
+                  seed:int) -> tuple[np.ndarray]:
+    '''
+    Worker process entry point. Evolves one island's population for a number of generations against the
+    shared depth snapshot, topping it back up with random sequences so it doesn't collapse between migrations.
+    Returns (genes, owned, profits) sorted best first
+    '''
+    encoding, gene_fees = worker_encoding, worker_gene_fees
+    shm, depth = DepthSnapshot.attach(spec)
+    try:
+        rng = np.random.default_rng(seed)
+        population = SequencePopulation(encoding, genes, owned)
+        size = len(population)
+        for _ in range(generations):
+            profits = sequence_profits(population.genes, gene_rows, gene_fees, depth, starting_amount)
+            children = next_generation(population, profits, rng, mutation_rate, base_cur)
+            if len(children) < size:
+                children = SequencePopulation.concat(children, SequencePopulation.random(
+                    encoding, rng, size - len(children), sequence_lengths, base_cur, base_cur)).unique()
+            population = children
+
+        profits = sequence_profits(population.genes, gene_rows, gene_fees, depth, starting_amount)
+        order = np.argsort(profits)[::-1]
+        return population.genes[order], population.owned[order], profits[order]
+    finally:
+        del depth
+        shm.close()
+
+def migrate(populations:list[SequencePopulation], migrants:int) -> list[SequencePopulation]:
+    ''' Ring migration: each island's best migrants (populations sorted best first) replace the worst of the next island'''
+    if len(populations) < 2 or migrants < 1:
+        return populations
+    migrated = []
+    for i, population in enumerate(populations):
+        incoming = populations[i - 1].take(slice(0, migrants))
+        kept = population.take(slice(0, max(len(population) - len(incoming), 0)))
+        migrated.append(SequencePopulation.concat(incoming, kept).unique())
+    return migrated
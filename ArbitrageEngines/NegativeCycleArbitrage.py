@@ -0,0 +1,215 @@
+from itertools import count
+import heapq
+import math
+import time
+from threading import Thread
+import numpy as np
+from util.currency_funcs import remove_single_swapable_coins
+from ArbitrageEngines import SequenceTrader
+from util import events
+from enums import tradeSide
+
+class NegativeCycleArbitrageEngine:
+    ''' Deterministic arbitrage model that keeps the market as a weighted directed graph of currencies.
+        Each edge is a trade weighted with -log(rate*(1 - fee)) from the current best bid/ask, so a cycle
+        with a negative total weight is profitable. A hop-bounded Bellman-Ford pass towards the session
+        currency gives a lower bound on the weight needed to get back from any currency, and is repaired
+        from the changed edges whenever orderbooks move. find_cycles uses it to prune a depth first search, so it returns
+        every profitable simple cycle through the session currency without walking the unprofitable ones
+    '''
+    def __init__(self, SequenceTrader:SequenceTrader, max_length:int=6):
+        self.SequenceTrader = SequenceTrader
+        self.Pairs = SequenceTrader.DataManager.Pairs
+        self.max_length = max_length # Longest cycle to search for (the search gets exponential in this when many books are out of line)
+        self.graph = {} # owned cur: {aquired cur: [weight, (side, pair)]}
+        self.source = None
+        self.new_source = None # Set when the starting currency changes, applied by the mainloop
+
+        # Edge list mirrored into arrays for the vectorized bound computation
+        self.cur_index = {} # cur: index
+        self.edge_index = {} # (owned cur, aquired cur): index
+        self.edge_tails = np.zeros(0, dtype=np.int64)
+        self.edge_heads = np.zeros(0, dtype=np.int64)
+        self.edge_weights = np.zeros(0)
+        self.out_edges = [] # cur index: [(edge index, aquired cur index)]
+        self.bounds = np.zeros((1, 0)) # bounds[k, i]: lowest weight back to the source from currency i in at most k trades
+        self.thread = None
+        self.running = False
+        events.subscribe(SequenceTrader.START_CUR_CHANGE_EVENT_ID, self.start_cur_change_listener)
+
+    def build_graph(self, pairList) -> None:
+        self.graph = {}
+        for base, qoute in pairList:
+            self.graph.setdefault(base, {})[qoute] = [math.inf, (tradeSide.SELL, (base, qoute))]
+            self.graph.setdefault(qoute, {})[base] = [math.inf, (tradeSide.BUY, (base, qoute))]
+
+        self.cur_index = {cur: i for i, cur in enumerate(self.graph)}
+        edges = [(u, v) for u, edges in self.graph.items() for v in edges]
+        self.edge_index = {edge: i for i, edge in enumerate(edges)}
+        self.edge_tails = np.array([self.cur_index[u] for u, _ in edges], dtype=np.int64)
+        self.edge_heads = np.array([self.cur_index[v] for _, v in edges], dtype=np.int64)
+        self.edge_weights = np.full(len(edges), np.inf)
+        self.out_edges = [[] for _ in self.cur_index]
+        for i, (u, v) in enumerate(edges):
+            self.out_edges[self.cur_index[u]].append((i, self.cur_index[v]))
+        self.update_edges(pairList)
+
+    def edge_weight(self, side:tradeSide, pair:tuple[str]) -> float:
+        ''' Return -log of the top of book exchange rate after fees (inf if that side of the book is empty)'''
+        book = self.Pairs[pair].orderbook.asks if side == tradeSide.BUY else self.Pairs[pair].orderbook.bids
+        if not book:
+            return math.inf
+        price = book.top(1)[0][0]
+        rate = (1/price if side == tradeSide.BUY else price)*(1 - (self.Pairs[pair].fee or 0))
+        return -math.log(rate)
+
+    def update_edges(self, pairs) -> list[tuple]:
+        ''' Refresh the edge weights of the given pairs and return the changed edges as (u, v, old, new)'''
+        changed = []
+        for base, qoute in pairs:
+            for u, v, side in ((base, qoute, tradeSide.SELL), (qoute, base, tradeSide.BUY)):
+                edge = self.graph.get(u, {}).get(v)
+                if edge is None:
+                    continue
+                weight = self.edge_weight(side, (base, qoute))
+                if weight != edge[0]:
+                    changed.append((u, v, edge[0], weight))
+                    edge[0] = weight
+                    self.edge_weights[self.edge_index[(u, v)]] = weight
+        return changed
+
+    def set_source(self, source:str) -> None:
+        self.source = source
+        self.update_bounds()
+
+    def update_bounds(self) -> None:
+        '''
+        Hop-bounded Bellman-Ford towards the source. Row k holds the lowest weight of any walk back to the
+        source in at most k trades, which can't be more than the weight of the best simple path, so it is
+        a safe bound for pruning partial cycles
+        '''
+        bound = np.full(len(self.cur_index), np.inf)
+        bound[self.cur_index[self.source]] = 0
+        bounds = [bound]
+        for _ in range(self.max_length):
+            relaxed = bound.copy()
+            np.minimum.at(relaxed, self.edge_tails, self.edge_weights + bound[self.edge_heads])
+            bounds.append(relaxed)
+            bound = relaxed
+        self.bounds = np.array(bounds)
+
+    def repair_bounds(self, changed:list[tuple]) -> None:
+        '''
+        Bring the bounds up to date after update_edges changed the given (u, v, old, new) edges.
+        Row k only depends on row k - 1, so the rows are repaired in order: a currency is re-relaxed when
+        a changed edge out of it would now lower its bound, or was the edge its bound came through, or
+        when the bound of a currency it trades into changed in the row before
+        '''
+        changed = [(self.cur_index[u], self.cur_index[v], old, new) for u, v, old, new in changed]
+        moved = [] # Currencies whose bound changed in the previous row
+        for k in range(1, len(self.bounds)):
+            prev, row = self.bounds[k - 1], self.bounds[k]
+            stale = set(moved)
+            for i in moved:
+                stale.update(v for _, v in self.out_edges[i]) # The graph has both directions of every pair
+            for u, v, old, new in changed:
+                if new + prev[v] < row[u] or old + prev[v] <= row[u]:
+                    stale.add(u)
+
+            moved = []
+            for u in stale:
+                bound = prev[u]
+                for edge, v in self.out_edges[u]:
+                    bound = min(bound, self.edge_weights[edge] + prev[v])
+                if bound != row[u]:
+                    row[u] = bound
+                    moved.append(u)
+
+    def find_cycles(self, min_profit:float=0, limit:int=None) -> list[tuple[float, tuple]]:
+        ''' 
+        Return (profit, sequence) for every simple cycle through the source above min_profit, best first.
+        With a limit only the limit most profitable cycles are returned, and the search bound tightens to
+        the worst of them as better ones are found (the number of profitable cycles can grow exponentially
+        with max_length when the books are far out of line)
+        '''
+        max_weight = -math.log1p(min_profit)
+        last_bound = len(self.bounds) - 1
+        cycles = [] # Heap of (-weight, order, sequence) when limited
+        order = count()
+        trades = []
+        on_path = {self.source}
+        stack = [(self.source, 0.0, iter(self.graph[self.source].items()))]
+        while stack:
+            u, weight, edges = stack[-1]
+            for v, (edge_weight, trade) in edges:
+                total = weight + edge_weight
+                if v == self.source:
+                    if trades and total < max_weight:
+                        cycle = (-total, next(order), tuple(trades) + (trade,))
+                        if limit is None:
+                            cycles.append(cycle)
+                        elif len(cycles) < limit:
+                            heapq.heappush(cycles, cycle)
+                        else:
+                            heapq.heapreplace(cycles, cycle)
+                        if limit and len(cycles) == limit:
+                            max_weight = -cycles[0][0]
+                    continue
+
+                # Trades still available after this one to get back to the source
+                remaining = self.max_length - len(trades) - 1
+                if remaining < 1 or v in on_path:
+                    continue
+                if total + self.bounds[min(remaining, last_bound), self.cur_index[v]] >= max_weight:
+                    continue
+                on_path.add(v)
+                trades.append(trade)
+                stack.append((v, total, iter(self.graph[v].items())))
+                break
+            else:
+                stack.pop()
+                if trades:
+                    on_path.discard(u)
+                    trades.pop()
+        return [(math.expm1(weight), sequence) for weight, _, sequence in sorted(cycles, reverse=True)]
+
+    def begin(self, start_cur="USDT", candidates=10, loop_delay=.1):
+        '''
+        Algorithm:
+        1. Build the currency graph and the path weight bounds towards the starting currency
+        2. Update the edges for pairs whose orderbooks changed and repair the bounds from them
+        3. Pass the most profitable cycles (up to candidates) above the profit tolerance to
+           the SequenceTrader for verification and execution
+        4. Repeat from 2
+        '''
+        def mainloop():
+            self.running = True
+            pairList = remove_single_swapable_coins(list(self.Pairs.keys()))
+            dirty_pairs = self.SequenceTrader.DataManager.track_dirty_pairs()
+            self.build_graph(pairList)
+            self.set_source(start_cur)
+
+            while self.running:
+                if self.new_source:
+                    self.set_source(self.new_source)
+                    self.new_source = None
+                changed = self.update_edges(dirty_pairs.drain())
+                if changed:
+                    self.repair_bounds(changed)
+                for _, sequence in self.find_cycles(self.SequenceTrader.profit_tolerance, limit=candidates):
+                    self.SequenceTrader.get_sequence_profit(sequence, autoExecute=True)
+
+                time.sleep(loop_delay)
+
+        if not self.thread:
+            self.thread = Thread(target=mainloop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread = None
+
+    def start_cur_change_listener(self, new_cur):
+        print(f"Changing starting currency to {new_cur}")
+        self.new_source = new_cur
@@ -0,0 +1,240 @@
+import numpy as np
+from Modules.OrderCreation import OrderVolumeSizer, batch_fill_prices
+from util.MarketGraph import MarketGraph
+from enums import tradeSide
+
+SIDE_CODE = OrderVolumeSizer.SIDE_CODE
+BUY_CODE = SIDE_CODE[tradeSide.BUY]
+
+class MarketEncoding:
+    '''
+    Integer encoding of a MarketGraph for array backed populations. Currencies are ids into currencies and
+    each trade is a gene (pair index*2 + side code), so a sequence is a row of genes and the currencies it
+    holds along the way are a row of currency ids
+    '''
+    SIDES = tuple(sorted(SIDE_CODE, key=SIDE_CODE.get))
+
+    def __init__(self, graph:MarketGraph):
+        self.pairs = graph.pairs
+        self.pair_index = {pair: i for i, pair in enumerate(self.pairs)}
+        self.currencies = graph.currencies
+        self.cur_ids = {cur: i for i, cur in enumerate(self.currencies)}
+
+        n_genes = 2*len(self.pairs)
+        self.gene_from = np.empty(n_genes, dtype=np.int64) # Currency each gene spends
+        self.gene_to = np.empty(n_genes, dtype=np.int64) # Currency each gene aquires
+        for i, (base, qoute) in enumerate(self.pairs):
+            buy, sell = 2*i + SIDE_CODE[tradeSide.BUY], 2*i + SIDE_CODE[tradeSide.SELL]
+            self.gene_from[buy], self.gene_to[buy] = self.cur_ids[qoute], self.cur_ids[base]
+            self.gene_from[sell], self.gene_to[sell] = self.cur_ids[base], self.cur_ids[qoute]
+
+        # Genes spending each currency (CSR layout): out_genes[out_start[cur]:out_start[cur+1]]
+        self.out_genes = np.argsort(self.gene_from, kind='stable')
+        self.out_start = np.searchsorted(self.gene_from[self.out_genes], np.arange(len(self.currencies) + 1))
+
+        # Gene trading cur_a for cur_b (-1 if no pair trades them)
+        self.close_gene = np.full((len(self.currencies), len(self.currencies)), -1, dtype=np.int64)
+        self.close_gene[self.gene_from, self.gene_to] = np.arange(n_genes)
+
+    def encode(self, sequence:tuple[tuple]) -> np.ndarray:
+        return np.array([2*self.pair_index[pair] + SIDE_CODE[side] for side, pair in sequence], dtype=np.int64)
+
+    def decode(self, genes:np.ndarray) -> tuple[tuple]:
+        return tuple((self.SIDES[gene & 1], self.pairs[gene >> 1]) for gene in genes.tolist() if gene >= 0)
+
+    def random_walks(self, rng:np.random.Generator, start:np.ndarray, lengths:np.ndarray, end, prev_pair:np.ndarray=None):
+        '''
+        Generate one random sequence per start currency id with the given number of trades, closing back
+        into the end currency id(s). A pair is never traded twice in a row.
+        Returns (genes, owned, valid) where invalid rows couldn't be closed and should be discarded
+        '''
+        n = len(start)
+        width = int(lengths.max()) if n else 0
+        end = np.broadcast_to(end, (n,))
+        genes = np.full((n, width), -1, dtype=np.int64)
+        owned = np.full((n, width + 1), -1, dtype=np.int64)
+        owned[:, 0] = start
+        valid = np.ones(n, dtype=bool)
+        prev_pair = np.full(n, -1, dtype=np.int64) if prev_pair is None else prev_pair.copy()
+
+        for t in range(width):
+            free = np.flatnonzero(valid & (t < lengths - 1))
+            cur = owned[free, t]
+            first, degree = self.out_start[cur], self.out_start[cur + 1] - self.out_start[cur]
+            pick = (rng.random(len(free))*degree).astype(np.int64)
+            # Re-draw from the other pairs if the pair just traded was picked
+            repeat = (self.out_genes[first + pick] >> 1) == prev_pair[free]
+            offset = 1 + (rng.random(len(free))*np.maximum(degree - 1, 1)).astype(np.int64)
+            pick = np.where(repeat, (pick + offset) % np.maximum(degree, 1), pick)
+            free_genes = self.out_genes[first + pick]
+            valid[free[(free_genes >> 1) == prev_pair[free]]] = False
+
+            closing = np.flatnonzero(valid & (t == lengths - 1))
+            close_genes = self.close_gene[owned[closing, t], end[closing]]
+            valid[closing[(close_genes < 0) | ((close_genes >> 1) == prev_pair[closing])]] = False
+
+            rows = np.concatenate((free, closing))
+            step = np.concatenate((free_genes, close_genes))
+            genes[rows, t] = step
+            owned[rows, t + 1] = np.where(step >= 0, self.gene_to[step], -1)
+            prev_pair[rows] = step >> 1
+        return genes, owned, valid
+
+class SequencePopulation:
+    '''
+    Population of sequences held as arrays. genes has one sequence per row, padded with -1 after its last
+    trade, and owned[:, i] is the currency id held before trade i (owned[:, length] is the one ended with)
+    '''
+    def __init__(self, encoding:MarketEncoding, genes:np.ndarray, owned:np.ndarray):
+        self.encoding = encoding
+        self.genes = genes
+        self.owned = owned
+
+    @classmethod
+    def random(cls, encoding:MarketEncoding, rng:np.random.Generator, size:int, sequence_lengths:tuple[int],
+               start_cur:str, end_cur:str, attempts:int=20) -> "SequencePopulation":
+        ''' Generate size random sequences (fewer if some can't be closed into end_cur within attempts)'''
+        lengths = rng.choice(sequence_lengths, size)
+        start = np.full(size, encoding.cur_ids[start_cur], dtype=np.int64)
+        end = encoding.cur_ids[end_cur]
+        width = max(sequence_lengths)
+        genes = np.full((size, width), -1, dtype=np.int64)
+        owned = np.full((size, width + 1), -1, dtype=np.int64)
+        pending = np.arange(size)
+        for _ in range(attempts):
+            walk_genes, walk_owned, valid = encoding.random_walks(rng, start[pending], lengths[pending], end)
+            genes[pending[valid], :walk_genes.shape[1]] = walk_genes[valid]
+            owned[pending[valid], :walk_owned.shape[1]] = walk_owned[valid]
+            pending = pending[~valid]
+            if not len(pending):
+                break
+        return cls(encoding, np.delete(genes, pending, axis=0), np.delete(owned, pending, axis=0))
+
+    @classmethod
+    def concat(cls, *populations:"SequencePopulation") -> "SequencePopulation":
+        width = max(population.genes.shape[1] for population in populations)
+        genes = [np.pad(p.genes, ((0, 0), (0, width - p.genes.shape[1])), constant_values=-1) for p in populations]
+        owned = [np.pad(p.owned, ((0, 0), (0, width + 1 - p.owned.shape[1])), constant_values=-1) for p in populations]
+        return cls(populations[0].encoding, np.concatenate(genes), np.concatenate(owned))
+
+    def __len__(self) -> int:
+        return len(self.genes)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return (self.genes >= 0).sum(axis=1)
+
+    def take(self, index) -> "SequencePopulation":
+        return SequencePopulation(self.encoding, self.genes[index], self.owned[index])
+
+    def sequence(self, i:int) -> tuple[tuple]:
+        return self.encoding.decode(self.genes[i])
+
+    def unique(self) -> "SequencePopulation":
+        ''' Drop duplicate sequences, keeping the first occurence of each'''
+        if not len(self):
+            return self
+        _, index = np.unique(self.genes, axis=0, return_index=True)
+        return self.take(np.sort(index))
+
+    def illegal(self) -> np.ndarray:
+        ''' Mask of the sequences whose trades don't chain through their owned currencies'''
+        active = self.genes >= 0
+        genes = np.where(active, self.genes, 0)
+        broken = active & ((self.encoding.gene_from[genes] != self.owned[:, :-1]) |
+                           (self.encoding.gene_to[genes] != self.owned[:, 1:]))
+        gaps = ~active[:, :-1] & active[:, 1:]
+        return broken.any(axis=1) | gaps.any(axis=1)
+
+    def crossover(self, rng:np.random.Generator, rounds:int=3) -> "SequencePopulation":
+        '''
+        Pair the sequences at random and swap the tails of each pair at the first trade where both own the
+        same currency. Pairs without a common currency are re-paired for up to rounds attempts
+        '''
+        width = self.genes.shape[1]
+        lengths = self.lengths
+        gene_cols, owned_cols = np.arange(width), np.arange(width + 1)
+        swap_points = np.arange(1, width - 1)
+        parents = np.arange(len(self))
+        children = []
+        for _ in range(rounds):
+            if len(parents) < 2 or width < 3:
+                break
+            parents = rng.permutation(parents)
+            n = len(parents) // 2
+            a, b = parents[:n], parents[n:2*n]
+
+            # Both parents must own the same currency with at least two trades left in each
+            match = self.owned[a, 1:width-1] == self.owned[b, 1:width-1]
+            match &= swap_points <= np.minimum(lengths[a], lengths[b])[:, None] - 2
+            matched = match.any(axis=1)
+            swap = match.argmax(axis=1)[matched, None] + 1
+            a_match, b_match = a[matched], b[matched]
+
+            head, owned_head = gene_cols < swap, owned_cols <= swap
+            children.append(SequencePopulation(self.encoding,
+                np.concatenate((np.where(head, self.genes[a_match], self.genes[b_match]),
+                                np.where(head, self.genes[b_match], self.genes[a_match]))),
+                np.concatenate((np.where(owned_head, self.owned[a_match], self.owned[b_match]),
+                                np.where(owned_head, self.owned[b_match], self.owned[a_match])))))
+            parents = np.concatenate((a[~matched], b[~matched], parents[2*n:]))
+
+        if not children:
+            return self.take(slice(0, 0))
+        return SequencePopulation.concat(*children)
+
+    def mutate(self, rng:np.random.Generator, rate:float, end_cur:str) -> "SequencePopulation":
+        ''' Regenerate each sequence from a random cut point onwards with probability rate'''
+        lengths = self.lengths
+        rows = np.flatnonzero((rng.random(len(self)) < rate) & (lengths >= 3))
+        if not len(rows):
+            return self
+        cut = 1 + (rng.random(len(rows))*(lengths[rows] - 2)).astype(np.int64)
+        tail_lengths = lengths[rows] - cut
+        tails, tail_owned, valid = self.encoding.random_walks(rng, self.owned[rows, cut], tail_lengths,
+                                                              self.encoding.cur_ids[end_cur],
+                                                              prev_pair=self.genes[rows, cut - 1] >> 1)
+        rows, cut, tail_lengths, tails, tail_owned = rows[valid], cut[valid], tail_lengths[valid], tails[valid], tail_owned[valid]
+
+        genes, owned = self.genes.copy(), self.owned.copy()
+        cols = np.arange(tail_owned.shape[1])
+        row_index = np.broadcast_to(rows[:, None], tail_owned.shape)
+        gene_mask = cols[:-1] < tail_lengths[:, None]
+        owned_mask = cols <= tail_lengths[:, None]
+        genes[row_index[:, :-1][gene_mask], (cut[:, None] + cols[:-1])[gene_mask]] = tails[gene_mask]
+        owned[row_index[owned_mask], (cut[:, None] + cols)[owned_mask]] = tail_owned[owned_mask]
+        return SequencePopulation(self.encoding, genes, owned)
+
+def sequence_profits(genes:np.ndarray, gene_rows:np.ndarray, gene_fees:np.ndarray, depth:tuple[np.ndarray],
+                     starting_amount:float=None) -> np.ndarray:
+    '''
+    Profit of each row of genes traded through padded depth matrices (prices, sizes, cum_base, cum_qoute as
+    held by OrderVolumeSizer). gene_rows maps each gene to its depth matrix row and gene_fees to its fee.
+    Top of book prices are used if no starting amount is given, -1 where the books can't cover the sequence
+    '''
+    rates = np.ones(len(genes))
+    exhausted = np.zeros(len(genes), dtype=bool)
+    for i in range(genes.shape[1]):
+        active = genes[:, i] >= 0
+        leg = genes[active, i]
+        buy = (leg & 1) == BUY_CODE
+        fill_prices, leg_exhausted = batch_fill_prices(*depth, gene_rows[leg], buy, (starting_amount or 0)*rates[active])
+        exhausted[active] |= leg_exhausted
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates[active] *= np.where(buy, 1/fill_prices, fill_prices)*(1 - gene_fees[leg])
+    return np.where(exhausted, -1, rates - 1)
+
+def next_generation(population:SequencePopulation, profits:np.ndarray, rng:np.random.Generator,
+                    mutation_rate:float, end_cur:str) -> SequencePopulation:
+    '''
+    Keep the best sequence, recombine the sequences above the median profit and mutate the children.
+    Returns an empty population if no children could be formed
+    '''
+    best = population.take([profits.argmax()])
+    children = population.take(profits > np.median(profits)).crossover(rng)
+    if not len(children):
+        return children
+    if children.illegal().any():
+        raise Exception("Illegal sequence detected")
+    children = children.mutate(rng, mutation_rate, end_cur)
+    return SequencePopulation.concat(children, best).unique()
@@ -1,4 +1,7 @@
 from typing import Dict, List
+from dataclasses import dataclass
+from queue import Queue, Full
+from threading import Thread, Lock
 import copy
 from util import events
 
@@ -13,6 +16,13 @@ from util.SequenceTracker import SequenceTracker
 from util.round_to_increment import  round_to_increment
 
 
+@dataclass
+class SequenceEvaluation:
+    sequence: tuple[tuple]
+    profit: float # -1 when the orderbooks can't cover the sequence
+    starting_amount: float
+    exp_fills: list
+    versions: tuple # Orderbook versions of the sequence's pairs when it was priced
 
 class SequenceTrader:
     
@@ -30,55 +40,102 @@ class SequenceTrader:
         self.profit_tolerance = .00025
         self.Tracker = SequenceTracker(20)
 
+        # Profitable sequences are executed by a worker so evaluation never waits on settlement
+        self.execution_queue = Queue(maxsize=10)
+        self.execution_thread = None
+        self.queued = set()
+        self.queued_lock = Lock()
+
         self.DataManager.subscribe_order_status()
         self.DataManager.subscribe_account_balance_notice()
 
         self.owned = Session.starting_cur
                
-    def get_sequence_profit(self, sequence:tuple[tuple], autoExecute:bool=True, forceExecute:bool=False, owned_amount:float=None):
-        ''' Check if the sequence matches the expected profit to within a specified tolerance
-            If a volume is specified, it will return the average fill price
+    def evaluate_sequence(self, sequence:tuple[tuple], owned_amount:float=None) -> SequenceEvaluation:
+        ''' Price the sequence against the current orderbooks without side effects. 
+            Trades the full session balance of the first owned currency unless an owned amount is given
         '''
-    
-        type, pair = sequence[0]
         exp_owned = self.expected_to_own(sequence[0])
-         
-        starting_amount = self.session.balance[exp_owned]
+        versions = tuple(self.DataManager.Pairs[pair].orderbook.version for _, pair in sequence)
+        starting_amount = owned_amount if owned_amount else self.session.balance.get(exp_owned, 0)
+        evaluation = SequenceEvaluation(sequence, -1, starting_amount, [], versions)
+        if not starting_amount:
+            return evaluation
+
         total = copy.copy(starting_amount)
-        exp_fills = []
         for type, pair in sequence:
             fee = self.DataManager.Pairs[pair].fee
             tx = 1 - fee
-            if "BUY" in type.name:
-                try:
-                    fill_price = self.OrderVolumeSizer.get_best_fill_price(type, pair, total)
-                except (OrderVolumeDepthError, ConvergenceError):
-                    return -1
+            try:
+                fill_price = self.OrderVolumeSizer.get_best_fill_price(type, pair, total)
+            except (OrderVolumeDepthError, ConvergenceError):
+                return evaluation
 
-                exp_fills.append(fill_price)
+            if "BUY" in type.name:
                 total *= (1/fill_price)*tx
-                
             elif "SELL" in type.name:
-                try:
-                    fill_price = self.OrderVolumeSizer.get_best_fill_price(type, pair, total)
-                except (OrderVolumeDepthError, ConvergenceError):
-                    return -1
-
-                exp_fills.append(fill_price)
                 total *= fill_price*tx
             else:
                 raise Exception("Invalid sequence format")
+            evaluation.exp_fills.append(fill_price)
            
-        exp_profit = (total / starting_amount) - 1
+        evaluation.profit = (total / starting_amount) - 1
+        return evaluation
+
+    def get_sequence_profit(self, sequence:tuple[tuple], autoExecute:bool=True, forceExecute:bool=False, owned_amount:float=None):
+        ''' Check if the sequence matches the expected profit to within a specified tolerance.
+            Profitable sequences are queued for the execution worker when autoExecute is set, 
+            forceExecute executes the sequence synchronously and returns the actual profit
+        '''
+        evaluation = self.evaluate_sequence(sequence, owned_amount)
+        exp_profit = evaluation.profit
+        if exp_profit == -1:
+            return -1
         if exp_profit > 1.5:
             raise Exception("Too good, something went wrong")
         
         if forceExecute:
-            return self.execute_sequence(sequence, starting_amount, exp_fills, exp_profit=exp_profit)
-        if self.trading_conditions_statisfied(exp_profit, sequence):
-            return self.execute_sequence(sequence, starting_amount, exp_fills, exp_profit=exp_profit)  
+            return self.execute_sequence(sequence, evaluation.starting_amount, evaluation.exp_fills, exp_profit=exp_profit)
+        if autoExecute and self.trading_conditions_statisfied(exp_profit, sequence):
+            self.queue_execution(evaluation)
 
         return exp_profit
+
+    def queue_execution(self, evaluation:SequenceEvaluation) -> bool:
+        ''' Hand an evaluated sequence to the execution worker without waiting for it to settle'''
+        with self.queued_lock:
+            # Started under the lock, scan threads queue at the same time and only one worker may trade the session
+            if self.execution_thread is None:
+                self.execution_thread = Thread(target=self.execution_worker)
+                self.execution_thread.daemon = True
+                self.execution_thread.start()
+
+            if evaluation.sequence in self.queued:
+                return False
+            try:
+                self.execution_queue.put_nowait(evaluation)
+            except Full:
+                return False
+            self.queued.add(evaluation.sequence)
+        return True
+
+    def execution_worker(self):
+        ''' Drain the execution queue one sequence at a time'''
+        while True:
+            evaluation = self.execution_queue.get()
+            try:
+                # Re-price since the books and session balance may have moved while the sequence was queued
+                current = self.evaluate_sequence(evaluation.sequence)
+                if self.trading_conditions_statisfied(current.profit, current.sequence):
+                    self.execute_sequence(current.sequence, current.starting_amount, current.exp_fills, exp_profit=current.profit)
+            except RestartEngine:
+                events.post_event(self.START_CUR_CHANGE_EVENT_ID, self.session.last_cur_received)
+            except Exception as e:
+                print(f"Execution of {evaluation.sequence} failed: {e}")
+            finally:
+                with self.queued_lock:
+                    self.queued.discard(evaluation.sequence)
+                self.execution_queue.task_done()
         
     def trading_conditions_statisfied(self, exp_profit, sequence):
         if not exp_profit > self.profit_tolerance:
@@ -158,9 +215,9 @@ class SequenceTrader:
         
         try:
             if order.side == tradeSide.SELL:
-                self.DataManager.Pairs[order.pair].orderbook.bids.pop(order.price)
+                self.DataManager.remove_price_level(order.pair, "bids", price)
             elif order.side == tradeSide.BUY:
-                self.DataManager.Pairs[order.pair].orderbook.asks.pop(price)
+                self.DataManager.remove_price_level(order.pair, "asks", price)
         except KeyError:
             print("Price level no longer exists")
         
@@ -305,4 +362,4 @@ class SequenceTrader:
             return fill_price, i
         else:
             return self.get_real_fill_price_sell(trade_type, owned_amount, book_prices, book_sizes, coin_name, p_guess=fill_price, iter_num=iter_num+1) 
-'''
\ No newline at end of file
+'''
\ No newline at end of file
@@ -1,12 +1,15 @@
-import random
 import time
+import numpy as np
 from threading import Thread
 from typing import final
 from statistics import median
 from util.currency_funcs import remove_single_swapable_coins
+from util.MarketGraph import MarketGraph
+from util.CycleCache import CycleCache
 from ArbitrageEngines import SequenceTrader
+from ArbitrageEngines.CycleEvaluator import CycleEvaluator
+from util.OpportunityHeap import OpportunityHeap
 from util import events  
-from enums import tradeSide
 
 class TriangularArbitrageEngine:
     ''' Lightweight abitrage model to generate trade sequences and execute profitable sequences'
@@ -15,8 +18,27 @@ class TriangularArbitrageEngine:
     def __init__(self, SequenceTrader:SequenceTrader):
             self.SequenceTrader = SequenceTrader
             self.pregenerated_sequences = {}
-            self.thread = None
+            self.cycle_cache = CycleCache()
+            self.rebuilt_sequences = {} # start_cur: sequences, set when the cycle cache finishes a rebuild
+
+            # Cycles rooted at each scanned currency are evaluated by their own worker into their own heap
+            self.evaluators = {} # root cur: CycleEvaluator
+            self.root_opportunities = {} # root cur: OpportunityHeap of the best scoring sequences
+            self.root_threads = {} # root cur: evaluation worker Thread
+            self.active_root = None # Root the session holds, the execution loop pulls from its heap
+            self.loop_delay = .1
+            self.event_driven = False
+            self.running = False
+            self.execution_thread = None
             events.subscribe(SequenceTrader.START_CUR_CHANGE_EVENT_ID, self.start_cur_change_listener)
+
+    @property
+    def evaluator(self) -> CycleEvaluator:
+        return self.evaluators.get(self.active_root)
+
+    @property
+    def opportunities(self) -> OpportunityHeap:
+        return self.root_opportunities.get(self.active_root)
     
     def get_viable_pairs(self, check_pair_data=True):
         DataManager = self.SequenceTrader.DataManager
@@ -26,80 +48,149 @@ class TriangularArbitrageEngine:
         return tuple(pairList)
 
     def pregenerate_sequences(self, start_cur, pairList):
-        ''' 
-        This code is redundant and could be compacted (yes, I know its ugly) but I'm leaving this as is 
-        for readability (Sequences will always have a len of 3 for this arbitrage engine) 
+        ''' Enumerate every triangular sequence through the starting currency (Sequences will always 
+            have a len of 3 for this arbitrage engine) 
         '''
+        return MarketGraph(pairList).triangles(start_cur)
 
-        sequences = []
-        start_pairs = [pair for pair in pairList if start_cur in pair]
-        for base, qoute in start_pairs:
-            if base != start_cur:
-                cur_B = base
-                S1 = (tradeSide.BUY, (base,qoute))
-            elif qoute != start_cur:
-                cur_B = qoute
-                S1 = (tradeSide.SELL, (base,qoute))
-
-            next_pairs = [pair for pair in pairList if cur_B in pair and start_cur not in pair]
-            for base, qoute in next_pairs:
-                if base != cur_B:
-                    cur_C = base
-                    S2 = (tradeSide.BUY, (base,qoute))
-                if qoute != cur_B:
-                    cur_C = qoute
-                    S2 = (tradeSide.SELL, (base,qoute))
-
-                final_pairs = [pair for pair in pairList if cur_C in pair and start_cur in pair]
-                if not final_pairs:
-                    continue
-                for base, qoute in final_pairs:
-                    if base != cur_C:
-                        S3 = (tradeSide.BUY, (base,qoute))
-                    if qoute != cur_C:
-                        S3 = (tradeSide.SELL, (base,qoute))
-                    sequences.append((S1,S2,S3))
-        
-        return tuple(sequences)
-
-    def begin(self, start_cur="USDT", population_size=200, loop_delay=.1):
+    def load_sequences(self, start_cur, pairList):
+        ''' Return the pregenerated sequences from the on-disk cycle cache, only enumerating them when no cache exists'''
+        def sequences_rebuilt(sequences):
+            self.rebuilt_sequences[start_cur] = sequences
+        return self.cycle_cache.get(start_cur, pairList, self.pregenerate_sequences, on_rebuilt=sequences_rebuilt)
+
+    def begin(self, start_cur="USDT", loop_delay=.1, event_driven=False, roots:tuple[str]=None):
         '''
-        Algorithm:
-        1. Create pool of randomly generated sequences (of len population sizes)
-        2. Calculate profits for all sequences in population
-        3. Take the best performing sequences store them -> survivors
-        4. Repeat with the previous survivors added into the next population
+        Scans the cycles rooted at start_cur and every currency in roots (SequenceTrader.TRADEABLE_MARKETS 
+        by default) at once, each with its own evaluation worker, and executes from whichever root the 
+        session currently holds.
+        When event_driven is set the workers wait on the orderbook updates from ExchangeData instead of 
+        sleeping loop_delay, so they re-evaluate as soon as a book changes and idle while nothing does.
+
+        Algorithm (per root):
+        1. Load every triangular sequence through the root currency from the cycle cache
+        2. Calculate the profits for all sequences at once with the CycleEvaluator
+        3. Push the best scoring sequences into the root's opportunity heap, where the execution loop
+           pulls any sequence above the profit tolerance for verification and execution
+        4. Re-price only the sequences trading a pair whose orderbook changed and repeat from 3
 
         '''
-        def mainloop():
-            self.running = True
-            pairList = self.get_viable_pairs(check_pair_data=False)
-            sequences = self.pregenerate_sequences(start_cur, pairList)
+        def execution_loop():
+            while self.running:
+                opportunities = self.root_opportunities.get(self.holding_root())
+                if not opportunities:
+                    time.sleep(loop_delay)
+                    continue
+                # Short timeout so a change of the held root is picked up quickly
+                opportunity = opportunities.pop_best(min_profit=self.SequenceTrader.profit_tolerance, timeout=.25)
+                if opportunity:
+                    self.SequenceTrader.get_sequence_profit(opportunity.sequence, autoExecute=True)
+
+        self.active_root = start_cur
+        self.loop_delay = loop_delay
+        self.event_driven = event_driven
+        self.running = True
+        roots = self.SequenceTrader.TRADEABLE_MARKETS if roots is None else roots
+        for root in (start_cur, *roots):
+            self.add_root(root)
 
-            x = .9 # Percentile of best performing population members to remember
-            survivors = []
+        if not self.execution_thread:
+            self.execution_thread = Thread(target=execution_loop)
+            self.execution_thread.daemon = True
+            self.execution_thread.start()
+
+    def add_root(self, root:str) -> None:
+        ''' Start an evaluation worker for the cycles rooted at root (nothing is done if it's already scanned)'''
+        if root in self.root_threads:
+            return
+        self.root_opportunities[root] = OpportunityHeap(size=50)
+        self.root_threads[root] = Thread(target=self.scan_root, args=(root,))
+        self.root_threads[root].daemon = True
+        self.root_threads[root].start()
+
+    def scan_root(self, root:str) -> None:
+        ''' Evaluation worker for the cycles rooted at root, runs until the engine is stopped.
+            A failed pass is reported and the root is fully re-priced on the next one, since the pairs
+            drained by the failed pass were never re-priced
+        '''
+        DataManager = self.SequenceTrader.DataManager
+        dirty_pairs = None
+        try:
+            pairList = self.get_viable_pairs(check_pair_data=False)
+            dirty_pairs = DataManager.track_dirty_pairs()
+            sequences = None # Set when the root's evaluator needs to be (re)built
+            reprice = True # Set when every sequence needs to be re-priced
+            self.evaluators.pop(root, None)
             while self.running:
-                population = {}
-                for _ in range(population_size):
-                    sequence = random.choice(sequences)
-                    population = {self.SequenceTrader.get_sequence_profit(sequence, autoExecute=True): sequence}
-                for seq in survivors:
-                    population.update({self.SequenceTrader.get_sequence_profit(sequence, autoExecute=True):seq})
-                        
-                keys_sorted = sorted(population.keys())
-                keys_trimmed = keys_sorted[int(len(keys_sorted)*x):]
-                survivors = [population[key] for key in keys_trimmed]
-
-                time.sleep(loop_delay)
-
-        if not self.thread:
-            self.thread = Thread(target=mainloop)
-            self.thread.start()
+                try:
+                    if root in self.rebuilt_sequences:
+                        sequences = self.rebuilt_sequences.pop(root)
+                    elif root not in self.evaluators:
+                        sequences = self.load_sequences(root, pairList)
+                    if sequences is not None:
+                        self.evaluators[root] = CycleEvaluator(self.SequenceTrader, sequences)
+                        sequences = None
+                        reprice = True
+                    if reprice:
+                        dirty_pairs.drain()
+                        reprice = False
+                        self.evaluators[root].evaluate(self.SequenceTrader.session.balance.get(root))
+                        self.publish_opportunities(root)
+
+                    if self.event_driven:
+                        # Time out periodically to pick up rebuilt sequences and stop requests
+                        changed = dirty_pairs.wait_drain(timeout=1)
+                        if not changed:
+                            continue
+                    else:
+                        changed = dirty_pairs.drain()
+                    self.evaluators[root].reevaluate(changed, self.SequenceTrader.session.balance.get(root))
+                    self.publish_opportunities(root)
+                except Exception as e:
+                    print(f"Scanning cycles rooted at {root} failed: {e}")
+                    reprice = True
+                if not self.event_driven:
+                    time.sleep(self.loop_delay)
+        except Exception as e:
+            print(f"Scanning cycles rooted at {root} stopped: {e}")
+        finally:
+            if dirty_pairs is not None:
+                DataManager.untrack_dirty_pairs(dirty_pairs)
+            self.root_threads.pop(root, None)
+
+    def holding_root(self) -> str:
+        ''' Return the scanned root the session currently holds (the last active root if it holds none of them)'''
+        held = self.SequenceTrader.session.last_cur_received
+        if held in self.root_opportunities:
+            self.active_root = held
+        return self.active_root
+
+    def publish_opportunities(self, root:str=None):
+        ''' Update the root's opportunity heap with the sequences re-priced by the last evaluation that are 
+            either already held or score high enough to be held
+        '''
+        root = self.active_root if root is None else root
+        evaluator = self.evaluators[root]
+        opportunities = self.root_opportunities[root]
+        index = evaluator.updated
+        profits = evaluator.profits
+        repriced = np.zeros(len(evaluator), dtype=bool)
+        repriced[index] = True
+
+        candidates = set(index[profits[index] > opportunities.floor()].tolist())
+        candidates.update(i for i in map(evaluator.index_of.get, opportunities.snapshot()) 
+                          if i is not None and repriced[i])
+        for i in sorted(candidates, key=lambda i: profits[i], reverse=True):
+            sequence = evaluator.sequences[i]
+            versions = tuple(self.SequenceTrader.DataManager.Pairs[pair].orderbook.version for _, pair in sequence)
+            opportunities.update(sequence, float(profits[i]), versions)
     
     def stop(self):
-        pass
+        self.running = False
+        self.execution_thread = None
     
     def start_cur_change_listener(self, new_cur):
         print(f"Changing starting currency to {new_cur}")
-        self.survivors = []
-        self.begin(start_cur=new_cur)
+        self.active_root = new_cur
+        if self.running:
+            self.add_root(new_cur)
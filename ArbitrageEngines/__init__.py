@@ -1,3 +1,5 @@
 from ArbitrageEngines.TriangularArbitrage import TriangularArbitrageEngine
 from ArbitrageEngines.GeneticArbitrage import GeneticArbitrageEngine
-from ArbitrageEngines.SequenceTrader import SequenceTrader
\ No newline at end of file
+from ArbitrageEngines.NegativeCycleArbitrage import NegativeCycleArbitrageEngine
+from ArbitrageEngines.SequenceTrader import SequenceTrader
+from ArbitrageEngines.CycleEvaluator import CycleEvaluator
@@ -1,6 +1,8 @@
 
 from typing import Tuple, Dict
 from dataclasses import dataclass
+from bisect import bisect_left, insort
+from threading import Lock
 from APIs.ExchangeAPI import ExchangeAPI
 from util import events
 from util.obj_funcs import save_json
@@ -8,12 +10,95 @@ import logging
 import time
 
 
+class BookSide:
+    ''' 
+    One side of an orderbook, kept in price order as levels arrive.
+    Prices and sizes are parsed to floats once on ingest so reading the top N levels is O(N).
+    Edits and snapshots share a lock so engine threads can read while the level2 worker writes
+    '''
+    def __init__(self, descending:bool=False, levels=None):
+        self.descending = descending # Bids are best at the highest price, asks at the lowest
+        self.lock = Lock()
+        self.levels = {} # price: size
+        self._keys = [] # Sorted price keys, best level first (negated prices when descending)
+        self.revision = 0 # Incremented whenever a level changes
+        if levels:
+            self.load(levels)
+
+    def _key(self, price:float) -> float:
+        return -price if self.descending else price
+
+    def load(self, levels) -> None:
+        ''' Replace the side with an iterable of (price, size) levels (strings or floats)'''
+        parsed = {}
+        for price, size in levels:
+            size = float(size)
+            if size:
+                parsed[float(price)] = size
+        keys = sorted(self._key(price) for price in parsed)
+        with self.lock:
+            self.levels = parsed
+            self._keys = keys
+            self.revision += 1
+
+    def set(self, price, size) -> None:
+        ''' Insert, update, or remove (size of 0) a price level'''
+        price = float(price)
+        size = float(size)
+        if not size:
+            self.pop(price)
+            return
+        with self.lock:
+            is_new = price not in self.levels
+            self.levels[price] = size
+            if is_new:
+                insort(self._keys, self._key(price))
+            self.revision += 1
+
+    def pop(self, price, default=None):
+        price = float(price)
+        with self.lock:
+            if price not in self.levels:
+                return default
+            del self._keys[bisect_left(self._keys, self._key(price))]
+            self.revision += 1
+            return self.levels.pop(price)
+
+    def top(self, depth:int=None) -> tuple[tuple[float]]:
+        ''' Return the best (price, size) levels, best first'''
+        return self.snapshot(depth)[0]
+
+    def snapshot(self, depth:int=None) -> tuple[tuple[tuple[float]], int]:
+        ''' Return the best (price, size) levels, best first, with the revision they were read at'''
+        with self.lock:
+            keys = self._keys if depth is None else self._keys[:depth]
+            if self.descending:
+                return tuple((-key, self.levels[-key]) for key in keys), self.revision
+            return tuple((key, self.levels[key]) for key in keys), self.revision
+
+    def __contains__(self, price) -> bool:
+        return float(price) in self.levels
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __bool__(self) -> bool:
+        return bool(self._keys)
+
+
 @dataclass
 class Orderbook:
     last_sequence: int = None
-    bids: dict = None
-    asks: dict = None
+    bids: BookSide = None
+    asks: BookSide = None
     missing_sequences:list=None
+    version: int = 0 # Incremented on every update and snapshot load
+
+    def __post_init__(self):
+        if self.bids is None:
+            self.bids = BookSide(descending=True)
+        if self.asks is None:
+            self.asks = BookSide()
 
     def update(self, type, price, size, sequence:int):
         if int(sequence) != self.last_sequence + 1:
@@ -21,38 +106,42 @@ class Orderbook:
                 self.missing_sequences = []
             self.missing_sequences.append(sequence)     
         self.last_sequence = sequence
-        
-        if not self.bids:
-            self.bids = {}
-        if not self.asks:
-            self.asks = {}
 
         if price == "0":
             return
         if type == "bids":
-            self.bids[price] = size
-            if size == "0": 
-                self.bids.pop(price)
+            self.bids.set(price, size)
         elif type == "asks":
-            self.asks[price] = size
-            if size == "0": 
-                self.asks.pop(price)
+            self.asks.set(price, size)
+        # Bumped after the edit, so a fill price memoized under the new version was priced against it
+        self.version += 1
+
+    def remove(self, type, price):
+        ''' Remove a price level outside of the sequenced update stream'''
+        book = self.bids if type == "bids" else self.asks
+        if book.pop(price) is None:
+            raise KeyError(price)
+        self.version += 1
+
+    def load_snapshot(self, bids, asks, sequence:int):
+        ''' Replace both sides of the book with a level2 snapshot'''
+        self.bids.load(bids)
+        self.asks.load(asks)
+        self.last_sequence = int(sequence)
+        self.version += 1
                  
-    def get_book(self, type):
-        out = []
-    
+    def get_book(self, type, depth:int=None):
+        ''' Return the (price, size) levels of one side of the book, best level first'''
         if type == 'bids':
-            book_sorted = sorted(self.bids.items(), key=lambda x:float(x[0]), reverse=True)
+            book = self.bids
         elif type == 'asks':
-            book_sorted = sorted(self.asks.items(), key=lambda x:float(x[0]))
+            book = self.asks
         else:
             raise Exception("Invalid type")
-        if not book_sorted:
+        if not book:
             raise Exception("No book to get")
 
-        for price, size in book_sorted:
-            out.append((float(price), float(size)))
-        return tuple(out)
+        return book.top(depth)
 
 @dataclass
 class Pair:
@@ -77,8 +166,21 @@ class Pair:
         return self.orderbook.bids and self.orderbook.asks and self.fee
     
     def get_best_ask(self):
-        return self.orderbook.get_book("asks")[0][0]
+        return self.orderbook.get_book("asks", depth=1)[0][0]
   
+class DirtyPairTracker(events.LatestValueChannel):
+    ''' Collects the pairs whose orderbooks changed since the tracker was last drained'''
+    def mark(self, pair:tuple[str]) -> None:
+        self.put(pair)
+
+    def drain(self) -> set:
+        ''' Return the changed pairs and reset the tracker'''
+        return set(super().drain())
+
+    def wait_drain(self, timeout:float=None) -> set:
+        ''' Block until a pair is marked (or the timeout passes), then drain the tracker'''
+        return set(super().wait_drain(timeout))
+
 class ExchangeData:
     ''' 
     Opens websockets feeds
@@ -100,29 +202,32 @@ class ExchangeData:
         self.level2_calibrated = False
         self.orderbook_updates = 0
         self.orders = []
+        self.dirty_pair_trackers = [] # Notified with each pair whose orderbook changes
 
         logging.basicConfig(filename='util/orders.log', encoding='utf-8', level=logging.DEBUG)
         events.subscribe(API.PAIR_UPDATE_EVENT_ID, self.pair_update_listener)
         events.subscribe(API.LEVEL2_UPDATE_EVENT_ID, self.level_2_update_listener)
         events.subscribe(API.DISCONNECT_EVENT_ID, self.build_orderbook)
 
-    def build_orderbook(self):
-        '''Creates orderbook for each pair, start oderbook update stream, and calibrates the ordebook with the sequencial updates'''
+    def build_orderbook(self, subscribe:bool=True):
+        '''
+        Creates orderbook for each pair, start oderbook update stream, and calibrates the ordebook with the sequencial updates.
+        Without subscribe the books are rebuilt from a new snapshot over the existing stream (after dropped updates)
+        '''
         self.level2_calibrated = False
         self.orderbook_cache = {}
-        print("Subscribing to ordebook stream...")
-        self.API.subscribe_level2(list(self.Pairs.keys()))
+        if subscribe:
+            print("Subscribing to ordebook stream...")
+            self.API.subscribe_level2(list(self.Pairs.keys()))
         time.sleep(.1) # Delay to allow orders to get cached
         print("Getting orderbook snapshot...")
         snapshot = self.API.get_multiple_orderbooks(list(self.Pairs.keys()))
         
         # Create ordebook objects for each pair
         for pair in snapshot:
-            asks = {price:size for price, size in snapshot[pair]["asks"]}
-            bids = {price:size for price, size in snapshot[pair]["bids"]}
-            self.Pairs[pair].orderbook.asks = asks
-            self.Pairs[pair].orderbook.bids = bids
-            self.Pairs[pair].orderbook.last_sequence = int(snapshot[pair]['sequence'])
+            self.Pairs[pair].orderbook.load_snapshot(snapshot[pair]["bids"], 
+                                                     snapshot[pair]["asks"], 
+                                                     snapshot[pair]['sequence'])
         
         # Playback cache
         print(f"Initial orderbook built, calibrating with {len(self.orderbook_cache)} cached orderbook increments...")
@@ -132,6 +237,9 @@ class ExchangeData:
                 if int(cache_sequence) > self.Pairs[pair].orderbook.last_sequence:
                     type, price, size = self.orderbook_cache[pair][cache_sequence]
                     self.Pairs[pair].orderbook.update(type, price, size, int(cache_sequence))
+        
+        for pair in snapshot:
+            self.mark_dirty(pair)
             #try:
              #   print(f"{pair} calibration status set to True with {len(self.Pairs[pair].orderbook.missing_sequences)} missing sequences")
             ##except:
@@ -156,6 +264,27 @@ class ExchangeData:
                     price, size, sequence = change[0]
                     self.Pairs[(base,qoute)].orderbook.update(type, price, size, int(sequence))
                     self.orderbook_updates += 1
+            self.mark_dirty((base,qoute))
+
+    def track_dirty_pairs(self) -> DirtyPairTracker:
+        ''' Return a new tracker that collects every pair whose orderbook changes from now on'''
+        tracker = DirtyPairTracker()
+        # Replaced rather than edited in place so mark_dirty never iterates a list that is changing
+        self.dirty_pair_trackers = self.dirty_pair_trackers + [tracker]
+        return tracker
+
+    def untrack_dirty_pairs(self, tracker:DirtyPairTracker) -> None:
+        ''' Stop notifying a tracker returned by track_dirty_pairs'''
+        self.dirty_pair_trackers = [tracked for tracked in self.dirty_pair_trackers if tracked is not tracker]
+
+    def mark_dirty(self, pair:tuple[str]) -> None:
+        for tracker in self.dirty_pair_trackers:
+            tracker.mark(pair)
+
+    def remove_price_level(self, pair:tuple[str], type:str, price) -> None:
+        ''' Remove a price level outside of the level2 stream and flag the pair for re-evaluation'''
+        self.Pairs[pair].orderbook.remove(type, price)
+        self.mark_dirty(pair)
  
     def pair_update_listener(self, message: Tuple[tuple,Dict[str,str]]) -> None:
         '''
@@ -287,4 +416,4 @@ class ExchangeData:
                     del self.DataManager.Pairs[pair].orderbook.bids[price]
                 else:
                     print("Expected orderbook price no longer present")
-'''
\ No newline at end of file
+'''
\ No newline at end of file
@@ -5,6 +5,10 @@ from CustomExceptions import OrderVolumeDepthError
 from dataclasses import dataclass, field
 from decimal import Decimal, ROUND_DOWN
 from typing import Dict
+from collections import OrderedDict
+from threading import Lock, RLock
+import numpy as np
+import math
 
 @dataclass   
 class Order:
@@ -115,6 +119,54 @@ class OrderGenerator:
         ''' Round down to the exchange defined precision'''
         return float(Decimal(str(amount)).quantize(Decimal(precision), rounding=ROUND_DOWN))
 
+@dataclass
+class BookDepth:
+    ''' Price levels of one side of a pair's orderbook with cumulative volume arrays'''
+    prices: np.ndarray
+    sizes: np.ndarray
+    cum_base: np.ndarray # Base volume available up to and including each level
+    cum_qoute: np.ndarray # Qoute notional up to and including each level
+    revision: int = None # BookSide revision the arrays were built from
+
+    @classmethod
+    def from_levels(cls, levels:tuple[tuple[float]], revision:int=None):
+        prices, sizes = np.array(levels, dtype=float).reshape(-1, 2).T
+        return cls(prices, sizes, np.cumsum(sizes), np.cumsum(prices*sizes), revision)
+
+def batch_fill_prices(prices:np.ndarray, sizes:np.ndarray, cum_base:np.ndarray, cum_qoute:np.ndarray, 
+                      rows:np.ndarray, buy:np.ndarray, owned:np.ndarray, average:bool=False) -> tuple[np.ndarray]:
+    ''' 
+    Vectorized fill prices for many orders against padded depth matrices (one row per book side, 
+    best level first, prices padded with nan and cumulative volumes padded with inf).
+    rows: matrix row of each order, buy: True for buy orders, owned: amount of the owned currency
+    Returns (fill_prices, exhausted) where exhausted orders can't be covered by the depth held in the matrices
+    '''
+    owned = np.asarray(owned, dtype=float)
+    depth = prices.shape[1]
+    if average:
+        # Buys fill until the qoute notional is spent, sells until the base amount is sold
+        targets = np.where(buy[:, None], cum_qoute[rows], cum_base[rows])
+    else:
+        targets = cum_base[rows]
+        owned = np.where(buy, owned / prices[rows, 0], owned)
+
+    i = (targets < owned[:, None]).sum(axis=1)
+    exhausted = i >= depth
+    i = np.minimum(i, depth - 1)
+    level_price = prices[rows, i]
+    exhausted |= np.isnan(level_price)
+    if not average:
+        return np.where(exhausted, np.nan, level_price), exhausted
+
+    level_size = sizes[rows, i]
+    base_before = cum_base[rows, i] - level_size
+    qoute_before = cum_qoute[rows, i] - level_price*level_size
+    with np.errstate(divide='ignore', invalid='ignore'):
+        buy_fill = owned / (base_before + (owned - qoute_before) / level_price)
+        sell_fill = (qoute_before + (owned - base_before)*level_price) / owned
+    fill_prices = np.where(buy, buy_fill, sell_fill)
+    return np.where(exhausted, np.nan, fill_prices), exhausted
+
 class OrderVolumeSizer:
     BOOK_TYPE = {tradeSide.BUY:"asks", 
                  tradeSide.SELL:"bids"}
@@ -122,43 +174,62 @@ class OrderVolumeSizer:
     BASE_VOLUME_CALC = {tradeSide.BUY: lambda owned,price: owned/price,
                         tradeSide.SELL: lambda owned,_: owned}
  
-    def __init__(self, Pairs: Dict[tuple[str], object]) -> None:
+    SIDE_CODE = {tradeSide.BUY: 0, 
+                 tradeSide.SELL: 1}
+ 
+    DEPTH_EXHAUSTED = object() # Memoized result for orders the book can't cover
+
+    def __init__(self, Pairs: Dict[tuple[str], object], batch_depth:int=100, memo_size:int=50000) -> None:
         self.Pairs = Pairs
-        self.convergence_tol = .001
+        self.depth_cache = {} # (pair, side): BookDepth
+
+        # Fill prices memoized on (kind, pair, side, amount bucket, orderbook version)
+        self.memo = OrderedDict()
+        self.memo_size = memo_size
+        self.memo_lock = Lock()
+        self.amount_bucket_tol = .0005 # Relative width of an amount bucket
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+        # Padded depth matrices for batch queries, row = pair_id*2 + side code. depth_lock guards the pair ids
+        # and the matrices, which are rewritten in place and replaced when they grow
+        self.depth_lock = RLock()
+        self.pair_ids = {} # pair: pair_id
+        self.pairList = [] # pair_id: pair
+        self.batch_depth = batch_depth
+        self.depth_prices = np.full((0, batch_depth), np.nan)
+        self.depth_sizes = np.zeros((0, batch_depth))
+        self.depth_cum_base = np.full((0, batch_depth), np.inf)
+        self.depth_cum_qoute = np.full((0, batch_depth), np.inf)
+        self.depth_revisions = np.zeros(0, dtype=np.int64)
         
     def get_average_fill_price(self, side:tradeSide, pair:tuple[str], ownedAmount:float):
         ''' 
         Return the average price that a market order would be expected to fill at based on the current ordebook state
         '''
-        book_prices, book_sizes = self.__get_separated_book(pair, side)
-        p_guess = book_prices[0]
-      
-        def converge_price(p_guess, c=0):
-            if c > 5:
-                a = 1
-            
-            # Get amount to be filled based on the guess fill price
-            test_volume = self.BASE_VOLUME_CALC[side](ownedAmount, p_guess)
-
-            # Determine number of price levels needed to satisfy volume
-            i = 0 
-            while sum(book_sizes[:i+1]) < test_volume:
-                i += 1
-                if i > len(book_sizes):
-                    raise OrderVolumeDepthError
-
-            # Calculate the average fill price
-            remaining_volume = (test_volume - sum(book_sizes[:i]))
-            fill_price = (sum([price*vol for price,vol in zip(book_prices[:i], book_sizes[:i])]) + remaining_volume*book_prices[i]) / (test_volume)
-            real_volume = self.BASE_VOLUME_CALC[side](ownedAmount, fill_price)
-
-            # Recursively converge price
-            if abs(real_volume - test_volume) < self.convergence_tol:
-                return fill_price
-            else:
-                return converge_price(fill_price, c=c+1)
+        return self.__memoized("average", side, pair, ownedAmount, self.__average_fill_price)
 
-        return converge_price(p_guess)
+    def __average_fill_price(self, side:tradeSide, pair:tuple[str], ownedAmount:float):
+        depth = self.get_depth(pair, side)
+
+        # Find the first level where the cumulative volume covers the order, then solve for the 
+        # partial volume taken from that level
+        if side == tradeSide.BUY:
+            i = np.searchsorted(depth.cum_qoute, ownedAmount)
+            if i == len(depth.prices):
+                raise OrderVolumeDepthError(pair[0])
+            qoute_before = depth.cum_qoute[i] - depth.prices[i]*depth.sizes[i]
+            base_before = depth.cum_base[i] - depth.sizes[i]
+            base_filled = base_before + (ownedAmount - qoute_before) / depth.prices[i]
+            return float(ownedAmount / base_filled)
+        
+        i = np.searchsorted(depth.cum_base, ownedAmount)
+        if i == len(depth.prices):
+            raise OrderVolumeDepthError(pair[0])
+        qoute_before = depth.cum_qoute[i] - depth.prices[i]*depth.sizes[i]
+        base_before = depth.cum_base[i] - depth.sizes[i]
+        qoute_filled = qoute_before + (ownedAmount - base_before)*depth.prices[i]
+        return float(qoute_filled / ownedAmount)
 
     def get_best_fill_price(self, side:tradeSide, pair:tuple[str], ownedAmount:float):
         ''' 
@@ -168,18 +239,137 @@ class OrderVolumeSizer:
         this function is better suited for limit order, while get_average_fill is better suited 
         for a market order.
         '''
+        return self.__memoized("best", side, pair, ownedAmount, self.__best_fill_price)
+
+    def __best_fill_price(self, side:tradeSide, pair:tuple[str], ownedAmount:float):
+        depth = self.get_depth(pair, side)
+        test_volume = self.BASE_VOLUME_CALC[side](ownedAmount, depth.prices[0])
+
+        i = np.searchsorted(depth.cum_base, test_volume)
+        if i == len(depth.prices):
+            raise OrderVolumeDepthError(pair[0])
+        return float(depth.prices[i])
 
-        book_prices, book_sizes = self.__get_separated_book(pair, side)
+    def __memoized(self, kind:str, side:tradeSide, pair:tuple[str], ownedAmount:float, calc_fill):
+        ''' Return a memoized fill price if this amount bucket was priced against the same orderbook version'''
+        if ownedAmount <= 0:
+            return calc_fill(side, pair, ownedAmount)
         
-        i = 0
-        summed_volume = book_sizes[0]
-        test_volume = self.BASE_VOLUME_CALC[side](ownedAmount, book_prices[0])
-        while summed_volume < test_volume:
-            i += 1
-            summed_volume += book_sizes[i]
-
-        return book_prices[i]
-
-    def __get_separated_book(self, pair, side) -> tuple[tuple[float]]: 
-        ''' Return book prices and coorresponding volumes in a zipped tuple'''
-        return tuple(zip(*self.Pairs[pair].orderbook.get_book(self.BOOK_TYPE[side])))
+        bucket = int(math.log(ownedAmount) / math.log1p(self.amount_bucket_tol))
+        key = (kind, pair, side, bucket, self.Pairs[pair].orderbook.version)
+        with self.memo_lock:
+            fill_price = self.memo.get(key)
+            if fill_price is not None:
+                self.memo.move_to_end(key)
+                self.memo_hits += 1
+            else:
+                self.memo_misses += 1
+        
+        if fill_price is None:
+            try:
+                fill_price = calc_fill(side, pair, ownedAmount)
+            except OrderVolumeDepthError:
+                fill_price = self.DEPTH_EXHAUSTED
+            
+            with self.memo_lock:
+                self.memo[key] = fill_price
+                if len(self.memo) > self.memo_size:
+                    self.memo.popitem(last=False)
+
+        if fill_price is self.DEPTH_EXHAUSTED:
+            raise OrderVolumeDepthError(pair[0])
+        return fill_price
+
+    def get_depth(self, pair:tuple[str], side:tradeSide) -> BookDepth:
+        ''' Return the cumulative depth arrays for the side of the book a trade fills against, 
+            rebuilding them only when the book side has changed since they were last built
+        '''
+        book = getattr(self.Pairs[pair].orderbook, self.BOOK_TYPE[side])
+        depth = self.depth_cache.get((pair, side))
+        if depth is None or depth.revision != book.revision:
+            levels, revision = book.snapshot() # Read together so the arrays are never tagged with a newer revision
+            if not levels:
+                raise OrderVolumeDepthError(pair[0])
+            depth = BookDepth.from_levels(levels, revision)
+            self.depth_cache[(pair, side)] = depth
+        return depth
+
+    def get_pair_id(self, pair:tuple[str]) -> int:
+        ''' Return the integer id used for a pair by the batch API, assigning one if needed'''
+        pair_id = self.pair_ids.get(pair)
+        if pair_id is not None:
+            return pair_id
+        with self.depth_lock:
+            if pair not in self.pair_ids:
+                self.pairList.append(pair)
+                self.pair_ids[pair] = len(self.pairList) - 1
+            return self.pair_ids[pair]
+
+    def get_batch_fill_prices(self, pair_ids, sides, ownedAmounts, average:bool=False) -> tuple[np.ndarray]:
+        ''' 
+        Price many orders in one vectorized pass over the cached depth arrays.
+        pair_ids: ids from get_pair_id, sides: SIDE_CODE values, ownedAmounts: amount of the owned currency 
+        Returns (fill_prices, exhausted). Best fill prices are returned unless average is set, and 
+        orders that the book can't cover are flagged in exhausted with a fill price of nan
+        '''
+        pair_ids = np.asarray(pair_ids, dtype=np.int64)
+        sides = np.asarray(sides, dtype=np.int64)
+        rows = pair_ids*2 + sides
+        with self.depth_lock:
+            self.refresh_depth_rows(np.unique(rows))
+            return batch_fill_prices(self.depth_prices, self.depth_sizes, self.depth_cum_base, self.depth_cum_qoute,
+                                     rows, sides == self.SIDE_CODE[tradeSide.BUY], ownedAmounts, average=average)
+
+    def get_top_prices(self, pair_ids, sides) -> np.ndarray:
+        ''' Return the best price level for each (pair, side), nan where that side of the book is empty'''
+        rows = np.asarray(pair_ids, dtype=np.int64)*2 + np.asarray(sides, dtype=np.int64)
+        with self.depth_lock:
+            self.refresh_depth_rows(np.unique(rows))
+            return self.depth_prices[rows, 0]
+
+    def refresh_depth_rows(self, rows) -> None:
+        '''
+        Rewrite the padded depth matrix rows whose book side changed since they were last copied. Callers
+        reading the matrices directly should hold depth_lock across the refresh and the read
+        '''
+        with self.depth_lock:
+            n_rows = 2*len(self.pairList)
+            if len(self.depth_revisions) < n_rows:
+                self.__grow_depth_matrices(n_rows)
+
+            for row in rows:
+                pair = self.pairList[row // 2]
+                side = tradeSide.BUY if row % 2 == self.SIDE_CODE[tradeSide.BUY] else tradeSide.SELL
+                book = getattr(self.Pairs[pair].orderbook, self.BOOK_TYPE[side])
+                revision = book.revision
+                if self.depth_revisions[row] == revision:
+                    continue
+
+                depth = None
+                if book:
+                    try:
+                        depth = self.get_depth(pair, side)
+                    except OrderVolumeDepthError: # Emptied since it was checked
+                        pass
+                n = min(len(depth.prices), self.batch_depth) if depth else 0
+                self.depth_prices[row, n:] = np.nan
+                self.depth_sizes[row, n:] = 0
+                self.depth_cum_base[row, n:] = np.inf
+                self.depth_cum_qoute[row, n:] = np.inf
+                if n:
+                    self.depth_prices[row, :n] = depth.prices[:n]
+                    self.depth_sizes[row, :n] = depth.sizes[:n]
+                    self.depth_cum_base[row, :n] = depth.cum_base[:n]
+                    self.depth_cum_qoute[row, :n] = depth.cum_qoute[:n]
+                # Recorded last, so a row is never marked current before its data is written
+                self.depth_revisions[row] = depth.revision if depth else revision
+
+    def __grow_depth_matrices(self, n_rows:int) -> None:
+        ''' Called with depth_lock held'''
+        extra = n_rows - len(self.depth_revisions)
+        shape = (extra, self.batch_depth)
+        self.depth_prices = np.vstack((self.depth_prices, np.full(shape, np.nan)))
+        self.depth_sizes = np.vstack((self.depth_sizes, np.zeros(shape)))
+        self.depth_cum_base = np.vstack((self.depth_cum_base, np.full(shape, np.inf)))
+        self.depth_cum_qoute = np.vstack((self.depth_cum_qoute, np.full(shape, np.inf)))
+        self.depth_revisions = np.concatenate((self.depth_revisions, np.full(extra, -1, dtype=np.int64)))
@@ -1,7 +1,7 @@
 from CustomExceptions import OrderVolumeDepthError, TradeFailed, OrderTimeout
 from APIs.ExchangeAPI import ExchangeAPI
 from enums import orderStatus, tradeSide
-from Modules.OrderCreation import Order
+from Modules.OrderCreation import Order, OrderVolumeSizer
 from typing import Dict
 from util import events
 import time
@@ -30,7 +30,7 @@ Session = Session(Account, simulated=False)
 
 # Setup pair data stream
 pairsInfo = KucoinAPI.get_pair_info()
-viablePairs = remove_single_swapable_coins(list(pairsInfo.keys()))[:299] # SOcket can only maintain 300 orderbook subscriptions
+viablePairs = remove_single_swapable_coins(list(pairsInfo.keys())) # Subscriptions are spread over as many sockets as needed
 pairsInfo = {pair:info for pair, info in pairsInfo.items() if pair in viablePairs}
 ExchangeData.make_pairs(pairsInfo, populateSpread=False)
 ExchangeData.build_orderbook()
@@ -43,7 +43,7 @@ SequenceTrader = SequenceTrader(ExchangeData, Session, starting_cur=Session.star
 # Setup arbitrage model
 set_size = 500
 TA = TriangularArbitrageEngine(SequenceTrader)
-sequences = TA.pregenerate_sequences(starting_cur, list(ExchangeData.Pairs.keys()))
+sequences = TA.load_sequences(starting_cur, list(ExchangeData.Pairs.keys()))
 sequence = random.choice(sequences)
 a = SequenceTrader.get_sequence_profit(sequence, forceExecute=True)
        
@@ -0,0 +1,38 @@
+import json
+import os
+import random
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing APIs loads the Kucoin key file from the working directory, so run from a scratch directory
+# holding a dummy key when there isn't a real one
+KEY_FILE = "Kucoin_API_Key.json"
+if not os.path.exists(KEY_FILE):
+    os.chdir(tempfile.mkdtemp())
+    with open(KEY_FILE, "w") as f:
+        json.dump({"API_KEY": "key", "API_SECRET": "secret", "PASSPHRASE": "passphrase"}, f)
+
+from Modules.DataManagement import Orderbook, Pair
+
+MIDS = {"USDT": 1, "BTC": 30000, "ETH": 2000, "KCS": 10, "ADA": .5, "XRP": .6}
+PAIRS = [("BTC", "USDT"), ("ETH", "USDT"), ("ETH", "BTC"), ("KCS", "USDT"), ("KCS", "BTC"), ("KCS", "ETH"),
+         ("ADA", "USDT"), ("ADA", "BTC"), ("XRP", "USDT"), ("XRP", "ETH"), ("XRP", "BTC")]
+
+def build_market(pairs=PAIRS, mids=MIDS, levels:int=20, fee:float=.001, seed:int=0) -> dict:
+    ''' Return {pair: Pair} with a random snapshot around each pair's mid price, levels .1% apart'''
+    rng = random.Random(seed)
+    market = {}
+    for base, qoute in pairs:
+        mid = mids[base]/mids[qoute]*rng.uniform(.995, 1.005)
+        orderbook = Orderbook()
+        orderbook.load_snapshot([[mid*(1 - .001*i), rng.uniform(.1, 5)*100/mids[base]] for i in range(1, levels)],
+                                [[mid*(1 + .001*i), rng.uniform(.1, 5)*100/mids[base]] for i in range(1, levels)], 1)
+        market[(base, qoute)] = Pair(base, qoute, orderbook=orderbook, fee=fee)
+    return market
+
+@pytest.fixture
+def market() -> dict:
+    return build_market()
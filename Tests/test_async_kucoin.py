@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+import types
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from APIs.AsyncKucoinAPI import AsyncKucoinAPI, AsyncConnection
+from APIs.KucoinAPI import KucoinAPI
+
+class FakeWebSocket:
+    def __init__(self, frames):
+        self.frames = frames
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.frames:
+            raise StopAsyncIteration
+        return types.SimpleNamespace(type=aiohttp.WSMsgType.TEXT, data=self.frames.pop(0))
+
+def test_frames_are_handled_off_the_event_loop():
+    received, release = [], threading.Event()
+    def listener(message):
+        release.wait(5) # A slow listener must not hold up the socket reads
+        received.append((message, threading.current_thread()))
+
+    api = AsyncKucoinAPI(private=False, listener=listener)
+    async def read():
+        await api.read(AsyncConnection(FakeWebSocket(list("abc")), "c0", 1))
+        return threading.current_thread()
+    loop_thread = asyncio.run(asyncio.wait_for(read(), 5))
+    assert received == []
+    release.set()
+    deadline = time.monotonic() + 5
+    while len(received) < 3 and time.monotonic() < deadline:
+        time.sleep(.01)
+    assert [message for message, _ in received] == ["a", "b", "c"]
+    assert all(thread is not loop_thread for _, thread in received)
+
+def test_facade_shares_its_authenticator():
+    api = KucoinAPI(private=True, use_asyncio=True)
+    try:
+        assert api.aio.Auth is api.Auth
+    finally:
+        api.loop.call_soon_threadsafe(api.loop.stop)
+
+class FakeSession:
+    def __init__(self):
+        self.timeouts = []
+
+    def request(self, method, url, headers=None, data=None, timeout=None):
+        self.timeouts.append(timeout.total)
+        response = types.SimpleNamespace(status=200, headers={})
+        async def text():
+            return "{}"
+        response.text = text
+        class Context:
+            async def __aenter__(self):
+                return response
+            async def __aexit__(self, *exc):
+                return False
+        return Context()
+
+def test_requests_use_the_shared_endpoint_timeouts():
+    api = KucoinAPI(private=False, use_asyncio=True)
+    try:
+        api.http.set_timeout(KucoinAPI.SYMBOLS_ENDPOINT, 2)
+        api.aio.session = FakeSession()
+        for endpoint in (KucoinAPI.ORDER_ENDPOINT, f"{KucoinAPI.TICKER_ENDPOINT}?symbol=BTC-USDT",
+                         KucoinAPI.SYMBOLS_ENDPOINT, KucoinAPI.ACCOUNT_ENDPOINT):
+            asyncio.run(api.aio.request(endpoint))
+        assert api.aio.session.timeouts == [5, 5, 2, 10]
+    finally:
+        api.loop.call_soon_threadsafe(api.loop.stop)
+
+    # Without the facade the same table is used
+    api = AsyncKucoinAPI(private=False)
+    api.session = FakeSession()
+    asyncio.run(api.request(KucoinAPI.ORDER_ENDPOINT))
+    assert api.session.timeouts == [KucoinAPI.REQUEST_TIMEOUTS[KucoinAPI.ORDER_ENDPOINT]]
+
+def test_snapshot_fetches_are_bounded():
+    api = AsyncKucoinAPI(private=False, max_concurrent=5)
+    in_flight, peak = [0], [0]
+    async def get_orderbook(pair):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        await asyncio.sleep(.001)
+        in_flight[0] -= 1
+        return {"sequence": pair[0]}
+    api.get_orderbook = get_orderbook
+    pairs = [(str(i), "USDT") for i in range(50)]
+    books = asyncio.run(asyncio.wait_for(api.get_multiple_orderbooks(pairs), 5))
+    assert books == {pair: {"sequence": pair[0]} for pair in pairs}
+    assert peak[0] == 5
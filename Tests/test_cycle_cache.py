@@ -0,0 +1,61 @@
+from threading import Event
+from conftest import PAIRS
+from util.CycleCache import CycleCache
+from util.MarketGraph import MarketGraph
+
+def enumerate_triangles(start_cur, pairList):
+    return MarketGraph(pairList).triangles(start_cur)
+
+def test_round_trips_sequences(tmp_path):
+    cache = CycleCache(str(tmp_path), skipCurrencies=[])
+    sequences = enumerate_triangles("USDT", PAIRS)
+    cache.save("USDT", PAIRS, sequences)
+    topology, loaded = cache.load("USDT")
+    assert topology == cache.topology_hash(PAIRS)
+    assert loaded == sequences
+
+def test_enumerates_only_without_a_matching_cache(tmp_path):
+    cache = CycleCache(str(tmp_path), skipCurrencies=[])
+    calls = []
+    def enumerate_sequences(start_cur, pairList):
+        calls.append(start_cur)
+        return enumerate_triangles(start_cur, pairList)
+    first = cache.get("USDT", PAIRS, enumerate_sequences)
+    assert cache.get("USDT", PAIRS, enumerate_sequences) == first
+    assert calls == ["USDT"]
+
+def test_stale_cache_is_filtered_and_rebuilt(tmp_path):
+    cache = CycleCache(str(tmp_path), skipCurrencies=[])
+    cache.save("USDT", PAIRS, enumerate_triangles("USDT", PAIRS))
+    pairs = [pair for pair in PAIRS if pair != ("ETH", "BTC")]
+    rebuilt = []
+    done = Event()
+    stale = cache.get("USDT", pairs, enumerate_triangles, on_rebuilt=lambda sequences: (rebuilt.append(sequences), done.set()))
+    assert stale and all(pair != ("ETH", "BTC") for sequence in stale for _, pair in sequence)
+    assert done.wait(5)
+    assert set(rebuilt[0]) == set(enumerate_triangles("USDT", pairs))
+
+def test_topology_without_cycles(tmp_path):
+    cache = CycleCache(str(tmp_path), skipCurrencies=[])
+    pairs = [("BTC", "USDT"), ("ETH", "BTC")]
+    assert cache.get("USDT", pairs, enumerate_triangles) == ()
+    assert cache.load("USDT") == (cache.topology_hash(pairs), ())
+
+def test_failed_rebuild_can_be_retried(tmp_path, capsys):
+    cache = CycleCache(str(tmp_path), skipCurrencies=[])
+    cache.save("USDT", PAIRS, enumerate_triangles("USDT", PAIRS))
+    pairs = [pair for pair in PAIRS if pair != ("ETH", "BTC")]
+    def failing_enumeration(start_cur, pairList):
+        raise ValueError("enumeration failed")
+    cache.get("USDT", pairs, failing_enumeration)
+    thread = cache.rebuilds.get("USDT") # Already gone if the rebuild failed before this
+    if thread:
+        thread.join(5)
+    assert "USDT" not in cache.rebuilds
+    assert "Rebuilding the cycles for USDT failed" in capsys.readouterr().out
+
+    rebuilt = []
+    done = Event()
+    cache.get("USDT", pairs, enumerate_triangles, on_rebuilt=lambda sequences: (rebuilt.append(sequences), done.set()))
+    assert done.wait(5)
+    assert set(rebuilt[0]) == set(enumerate_triangles("USDT", pairs))
@@ -0,0 +1,66 @@
+import types
+import pytest
+from ArbitrageEngines.CycleEvaluator import CycleEvaluator
+from ArbitrageEngines.SequenceTrader import SequenceTrader
+from util.MarketGraph import MarketGraph
+
+@pytest.fixture
+def trader(market) -> SequenceTrader:
+    DataManager = types.SimpleNamespace(Pairs=market, subscribe_order_status=lambda: None,
+                                        subscribe_account_balance_notice=lambda: None)
+    Session = types.SimpleNamespace(starting_cur="USDT", balance={"USDT": 300})
+    return SequenceTrader(DataManager, Session)
+
+@pytest.fixture
+def sequences(market) -> tuple:
+    return MarketGraph(list(market)).triangles("USDT")
+
+def test_depth_profits_match_evaluate_sequence(trader, sequences):
+    evaluator = CycleEvaluator(trader, sequences)
+    profits = evaluator.evaluate(300)
+    assert len(sequences) > 0
+    assert profits == pytest.approx([trader.evaluate_sequence(sequence, 300).profit for sequence in sequences])
+
+def test_top_of_book_profits_match_a_tiny_order(trader, sequences):
+    evaluator = CycleEvaluator(trader, sequences)
+    profits = evaluator.evaluate()
+    assert profits == pytest.approx([trader.evaluate_sequence(sequence, 1e-9).profit for sequence in sequences])
+
+def test_best_returns_sequences_by_profit(trader, sequences):
+    evaluator = CycleEvaluator(trader, sequences)
+    profits = evaluator.evaluate(300)
+    best = evaluator.best(3)
+    assert [profit for profit, _ in best] == pytest.approx(sorted(profits, reverse=True)[:3])
+    assert evaluator.best(3, min_profit=10) == []
+
+def test_empty_sequence_set(trader):
+    evaluator = CycleEvaluator(trader, ())
+    assert len(evaluator) == 0
+    assert len(evaluator.evaluate(300)) == 0
+    assert evaluator.best(5) == []
+
+def test_reevaluate_reprices_only_touched_sequences(trader, sequences, market):
+    evaluator = CycleEvaluator(trader, sequences)
+    evaluator.evaluate(300)
+    pair = ("ETH", "BTC")
+    orderbook = market[pair].orderbook
+    orderbook.update("asks", str(orderbook.asks.top(1)[0][0]*.99), "100", 2)
+    orderbook.update("bids", str(orderbook.bids.top(1)[0][0]*1.01), "100", 3)
+
+    profits = evaluator.reevaluate({pair}, 300)
+    touched = [i for i, sequence in enumerate(sequences) if any(p == pair for _, p in sequence)]
+    assert sorted(evaluator.updated.tolist()) == touched
+    assert profits == pytest.approx([trader.evaluate_sequence(sequence, 300).profit for sequence in sequences])
+
+def test_reevaluate_reprices_everything_when_the_amount_changes(trader, sequences):
+    evaluator = CycleEvaluator(trader, sequences)
+    evaluator.evaluate(300)
+    evaluator.reevaluate(set(), 100)
+    assert len(evaluator.updated) == len(sequences)
+
+def test_evaluate_sequence_without_a_starting_balance(trader, sequences):
+    for balance in ({"USDT": 0}, {}):
+        trader.session.balance = balance
+        evaluation = trader.evaluate_sequence(sequences[0])
+        assert evaluation.profit == -1
+        assert evaluation.exp_fills == []
@@ -0,0 +1,138 @@
+import threading
+import time
+import pytest
+from util import events
+
+@pytest.fixture
+def topic(request):
+    ''' Event type whose first dispatched event blocks the worker until gate is set'''
+    event_type = request.node.name
+    received, gate = [], threading.Event()
+    def listener(data):
+        received.append(data)
+        gate.wait(5)
+    events.subscribe(event_type, listener)
+    yield event_type, received, gate
+    gate.set()
+    events.subscribers.pop(event_type, None)
+    events.topics.pop(event_type, None)
+
+def wait_for(condition, timeout:float=5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.01)
+    return True
+
+def post_while_blocked(event_type, queue, data, queued:int):
+    ''' Post data after the worker picks up the first event, leaving the rest queued'''
+    events.post_event(event_type, data[0])
+    assert wait_for(lambda: len(queue) == 0)
+    for item in data[1:]:
+        events.post_event(event_type, item)
+    assert len(queue) == queued
+
+def test_block_waits_for_room(topic):
+    event_type, received, gate = topic
+    queue = events.set_async(event_type, maxsize=2, policy=events.BLOCK)
+    post_while_blocked(event_type, queue, [1, 2, 3], queued=2)
+    poster = threading.Thread(target=events.post_event, args=(event_type, 4))
+    poster.start()
+    poster.join(.1)
+    assert poster.is_alive()
+    gate.set()
+    poster.join(5)
+    assert wait_for(lambda: received == [1, 2, 3, 4])
+    assert queue.dropped == 0
+
+def test_drop_oldest(topic):
+    event_type, received, gate = topic
+    queue = events.set_async(event_type, maxsize=2, policy=events.DROP_OLDEST)
+    post_while_blocked(event_type, queue, [1, 2, 3, 4, 5], queued=2)
+    gate.set()
+    assert wait_for(lambda: received == [1, 4, 5])
+    assert queue.dropped == 2
+
+def test_coalesce_keeps_the_newest_per_key(topic):
+    event_type, received, gate = topic
+    queue = events.set_async(event_type, maxsize=2, policy=events.COALESCE, key=lambda data: data[0])
+    post_while_blocked(event_type, queue, [("a", 1), ("b", 1), ("a", 2), ("b", 2), ("c", 1)], queued=2)
+    gate.set()
+    assert wait_for(lambda: received == [("a", 1), ("a", 2), ("c", 1)])
+    assert queue.dropped == 1
+
+def test_resync_drops_the_backlog_without_blocking(topic):
+    event_type, received, gate = topic
+    resynced, resync_threads = threading.Event(), []
+    def on_overflow():
+        resync_threads.append(threading.current_thread())
+        resynced.set()
+    queue = events.set_async(event_type, maxsize=2, policy=events.RESYNC, on_overflow=on_overflow)
+    post_while_blocked(event_type, queue, [1, 2, 3, 4], queued=1)
+    assert resynced.wait(5)
+    assert resync_threads[0] is not threading.current_thread()
+    gate.set()
+    assert wait_for(lambda: received == [1, 4])
+    assert wait_for(lambda: not queue.resyncing)
+    assert queue.dropped == 2 and queue.resyncs == 1
+
+def test_resync_runs_again_after_overflowing_during_a_resync(topic):
+    event_type, received, gate = topic
+    calls, release = [], threading.Event()
+    def on_overflow():
+        calls.append(len(calls))
+        release.wait(5)
+    queue = events.set_async(event_type, maxsize=1, policy=events.RESYNC, on_overflow=on_overflow)
+    post_while_blocked(event_type, queue, [1, 2, 3], queued=1)
+    assert wait_for(lambda: calls == [0])
+    events.post_event(event_type, 4)
+    events.post_event(event_type, 5) # Overflows while the first resync is running
+    release.set()
+    gate.set()
+    assert wait_for(lambda: not queue.resyncing)
+    assert calls == [0, 1] and queue.resyncs == 2
+
+class Listener:
+    def __init__(self):
+        self.calls = 0
+
+    def on_event(self, data):
+        self.calls += 1
+
+@pytest.fixture
+def stats():
+    events.enable_stats()
+    yield
+    events.enable_stats(False)
+    events.handler_stats.clear()
+    events.unsubscribed_posts.clear()
+
+def test_handlers_sharing_a_name_get_their_own_stats(request, stats):
+    event_type = request.node.name
+    first, second = Listener(), Listener()
+    events.subscribe(event_type, first.on_event)
+    events.subscribe(event_type, second.on_event)
+    try:
+        for _ in range(3):
+            events.post_event(event_type, 1)
+        events.post_event(request.node.name + "_unsubscribed", 1)
+    finally:
+        events.subscribers.pop(event_type)
+    snapshot = events.stats_snapshot()
+    handlers = snapshot["handlers"][event_type]
+    assert len(handlers) == 2
+    assert [stats["calls"] for stats in handlers.values()] == [3, 3]
+    assert all(name.startswith("test_events.Listener.on_event") for name in handlers)
+    assert snapshot["no_subscribers"] == {request.node.name + "_unsubscribed": 1}
+
+def test_log_stats_uses_logging(request, stats, caplog):
+    event_type = request.node.name
+    events.subscribe(event_type, Listener().on_event)
+    try:
+        events.post_event(event_type, 1)
+    finally:
+        events.subscribers.pop(event_type)
+    with caplog.at_level("INFO", logger="util.events"):
+        events.log_stats(interval=.05)
+        assert wait_for(lambda: any(event_type in record.getMessage() for record in caplog.records))
@@ -0,0 +1,156 @@
+import sys
+import numpy as np
+from threading import Event, Thread
+import pytest
+from CustomExceptions import OrderVolumeDepthError
+from Modules.OrderCreation import OrderVolumeSizer
+from enums import tradeSide
+from conftest import build_market
+
+def walk_book(levels, side:tradeSide, owned:float, average:bool) -> float:
+    ''' Level by level reference pricing of a market order'''
+    if not average:
+        volume = owned/levels[0][0] if side == tradeSide.BUY else owned
+        filled = 0
+        for price, size in levels:
+            filled += size
+            if filled >= volume:
+                return price
+        raise OrderVolumeDepthError
+
+    remaining, base, qoute = owned, 0, 0
+    for price, size in levels:
+        take = min(size, remaining/price) if side == tradeSide.BUY else min(size, remaining)
+        base += take
+        qoute += take*price
+        remaining -= take*price if side == tradeSide.BUY else take
+        if remaining <= 1e-12*owned:
+            return qoute/base
+    raise OrderVolumeDepthError
+
+@pytest.mark.parametrize("average", [False, True])
+@pytest.mark.parametrize("side", [tradeSide.BUY, tradeSide.SELL])
+def test_fill_prices_match_walking_the_book(market, side, average):
+    sizer = OrderVolumeSizer(market)
+    pair = ("ETH", "USDT")
+    levels = getattr(market[pair].orderbook, sizer.BOOK_TYPE[side]).top()
+    fill = sizer.get_average_fill_price if average else sizer.get_best_fill_price
+    for owned in (1, 50, 250, 1000):
+        owned = owned if side == tradeSide.BUY else owned/2000
+        assert fill(side, pair, owned) == pytest.approx(walk_book(levels, side, owned, average))
+
+def test_fill_price_raises_when_depth_runs_out(market):
+    sizer = OrderVolumeSizer(market)
+    with pytest.raises(OrderVolumeDepthError):
+        sizer.get_best_fill_price(tradeSide.SELL, ("ETH", "USDT"), 1e9)
+    with pytest.raises(OrderVolumeDepthError):
+        sizer.get_average_fill_price(tradeSide.BUY, ("ETH", "USDT"), 1e12)
+
+@pytest.mark.parametrize("average", [False, True])
+def test_batch_fill_prices_match_scalar_pricing(market, average):
+    sizer = OrderVolumeSizer(market)
+    rng = np.random.default_rng(0)
+    pairs = list(market)
+    sides = rng.integers(0, 2, 200)
+    pair_ids = np.array([sizer.get_pair_id(pairs[i]) for i in rng.integers(0, len(pairs), 200)])
+    owned = rng.uniform(.001, 3, 200)*np.array([market[sizer.pairList[i]].orderbook.asks.top(1)[0][0] if side == 0 else 1
+                                                   for i, side in zip(pair_ids, sides)])
+    fill_prices, exhausted = sizer.get_batch_fill_prices(pair_ids, sides, owned, average=average)
+
+    fill = sizer.get_average_fill_price if average else sizer.get_best_fill_price
+    for pair_id, side, amount, price, out in zip(pair_ids, sides, owned, fill_prices, exhausted):
+        side = tradeSide.BUY if side == 0 else tradeSide.SELL
+        try:
+            expected = fill(side, sizer.pairList[pair_id], amount)
+        except OrderVolumeDepthError:
+            assert out and np.isnan(price)
+            continue
+        assert not out and price == pytest.approx(expected)
+
+def test_batch_rows_follow_book_changes(market):
+    sizer = OrderVolumeSizer(market)
+    pair_id = sizer.get_pair_id(("ETH", "USDT"))
+    before = sizer.get_top_prices([pair_id], [0])[0]
+    market[("ETH", "USDT")].orderbook.update("asks", str(before - 1), "1", 2)
+    assert sizer.get_top_prices([pair_id], [0])[0] == before - 1
+
+def test_rows_are_not_read_while_they_are_rewritten(market):
+    # A reader must wait for a row being rewritten by another thread rather than see it half written
+    sizer = OrderVolumeSizer(market)
+    pair_id = sizer.get_pair_id(("ETH", "USDT"))
+    asks = market[("ETH", "USDT")].orderbook.asks
+    expected = float(asks.top(1)[0][0])
+    reading, release = Event(), Event()
+    snapshot = asks.snapshot
+    def slow_snapshot(*args):
+        reading.set()
+        release.wait(5)
+        return snapshot(*args)
+    asks.snapshot = slow_snapshot
+
+    writer = Thread(target=sizer.get_top_prices, args=([pair_id], [0]))
+    writer.start()
+    assert reading.wait(5)
+    prices = []
+    reader = Thread(target=lambda: prices.append(sizer.get_top_prices([pair_id], [0])[0]))
+    reader.start()
+    reader.join(.2)
+    release.set()
+    writer.join()
+    reader.join()
+    assert prices == [expected]
+
+def test_concurrent_pair_ids_and_batch_queries():
+    # Threads register pairs (growing the matrices) and price batches at the same time, as scan_root threads do
+    mids = {"USDT": 1, **{f"C{i}": 1 + i for i in range(100)}}
+    market = build_market([(f"C{i}", "USDT") for i in range(100)], mids, levels=5)
+    sizer = OrderVolumeSizer(market)
+    pairs = list(market)
+    expected = {pair: float(market[pair].orderbook.asks.top(1)[0][0]) for pair in pairs}
+    errors = []
+    def worker(seed):
+        rng = np.random.default_rng(seed)
+        try:
+            for pair in rng.permutation(len(pairs)):
+                pair = pairs[pair]
+                assert sizer.get_top_prices([sizer.get_pair_id(pair)], [0])[0] == expected[pair]
+        except Exception as e:
+            errors.append(e)
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [Thread(target=worker, args=(seed,)) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert not errors
+    assert [sizer.pair_ids[pair] for pair in sizer.pairList] == list(range(len(pairs)))
+
+class EditAfterRelease:
+    ''' BookSide lock that runs an edit as soon as it is first released, standing in for the level2 worker'''
+    def __init__(self, lock, edit):
+        self.lock = lock
+        self.edit = edit
+
+    def __enter__(self):
+        return self.lock.__enter__()
+
+    def __exit__(self, *exc):
+        self.lock.__exit__(*exc)
+        edit, self.edit = self.edit, None
+        if edit:
+            edit()
+
+def test_depth_is_never_tagged_with_a_newer_revision(market):
+    sizer = OrderVolumeSizer(market)
+    pair = ("ETH", "USDT")
+    orderbook = market[pair].orderbook
+    best_ask = orderbook.asks.top(1)[0][0]
+    orderbook.asks.lock = EditAfterRelease(orderbook.asks.lock,
+                                           lambda: orderbook.update("asks", str(best_ask*.99), "1", orderbook.last_sequence + 1))
+    sizer.get_depth(pair, tradeSide.BUY)
+    assert sizer.get_depth(pair, tradeSide.BUY).prices[0] == best_ask*.99
+    assert sizer.get_best_fill_price(tradeSide.BUY, pair, 1) == best_ask*.99
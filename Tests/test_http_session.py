@@ -0,0 +1,29 @@
+import types
+from APIs.HTTPSession import HTTPSession
+from APIs.RateLimiter import RateLimiter
+
+def fake_send(calls:list, statuses:list):
+    def send(method, url, headers=None, data=None, timeout=None):
+        calls.append((method, url, headers, timeout))
+        return types.SimpleNamespace(status_code=statuses.pop(0) if statuses else 200, text="{}", headers={})
+    return send
+
+def test_requests_use_the_endpoint_timeout():
+    http = HTTPSession(timeout=10, timeouts={"/api/v1/orders": 5})
+    calls = []
+    http.session.request = fake_send(calls, [])
+    http.get("https://host/api/v1/orders?status=active")
+    http.post("https://host/api/v1/symbols", data="{}")
+    http.set_timeout("/api/v1/symbols", 2)
+    http.get("https://host/api/v1/symbols")
+    assert [timeout for *_, timeout in calls] == [5, 10, 2]
+
+def test_rate_limited_requests_are_re_signed_and_retried():
+    limiter = RateLimiter(backoff=.001)
+    http = HTTPSession(limiter=limiter, classify=lambda method, path: RateLimiter.PRIVATE)
+    calls, signed = [], []
+    http.session.request = fake_send(calls, [429, 200])
+    response = http.get("https://host/api/v1/accounts", headers=lambda: signed.append(len(signed)) or {"n": len(signed)})
+    assert response.status_code == 200
+    assert [headers for _, _, headers, _ in calls] == [{"n": 1}, {"n": 2}]
+    assert limiter.failures[RateLimiter.PRIVATE] == 0
@@ -0,0 +1,111 @@
+import json
+import time
+import pytest
+from APIs.KucoinAPI import KucoinAPI
+from APIs.WebSocketClient import WebSocketPool
+from util import events
+
+class FakeConnection:
+    ''' Stands in for a WebSocketClient, recording what is sent on it'''
+    def __init__(self, pool, connect_id:str):
+        self.pool = pool
+        self.connect_id = connect_id
+        self.connected = True
+        self.subscriptions = []
+        self.sent = []
+        self.last_pong_time = 0
+
+    def send(self, payload):
+        self.sent.append(json.loads(payload))
+
+class FakeExchange:
+    def __init__(self):
+        self.frames = []
+
+    def stream_listen(self, message):
+        self.frames.append(message)
+
+def new_pool(parent, subscription_limit:int) -> WebSocketPool:
+    return WebSocketPool(parent, lambda pool: FakeConnection(pool, f"c{len(pool.connections)}"), subscription_limit)
+
+def test_subscriptions_open_connections_as_needed():
+    pool = new_pool(FakeExchange(), subscription_limit=10)
+    for i, n_topics in enumerate([6, 4, 3, 8, 2]):
+        pool.subscribe({"id": i}, n_topics)
+    # 6+4 fill the first socket, 3 opens a second that 2 still fits on, 8 needs a third
+    assert pool.topic_counts == [10, 5, 8]
+    assert [[payload["id"] for payload in connection.sent] for connection in pool.connections] == [[0, 1], [2, 4], [3]]
+    assert [connection.subscriptions for connection in pool.connections] == [[{"id": 0}, {"id": 1}], [{"id": 2}, {"id": 4}], [{"id": 3}]]
+
+def test_connection_listeners_see_later_connections():
+    pool = new_pool(FakeExchange(), subscription_limit=1)
+    seen = []
+    pool.for_each_connection(lambda connection: seen.append(connection.connect_id))
+    pool.subscribe({"id": 0})
+    pool.subscribe({"id": 1})
+    assert seen == ["c0", "c1"]
+
+def test_pongs_update_their_connection_only():
+    pool = new_pool(FakeExchange(), subscription_limit=1)
+    pool.subscribe({"id": 0})
+    pool.subscribe({"id": 1})
+    pool.pong_received("c1", 5.0)
+    assert [connection.last_pong_time for connection in pool.connections] == [0, 5.0]
+
+def test_frames_are_dispatched_in_arrival_order():
+    parent = FakeExchange()
+    pool = new_pool(parent, subscription_limit=10)
+    for i in range(100):
+        pool.stream_listen(i)
+    deadline = time.monotonic() + 5
+    while len(parent.frames) < 100 and time.monotonic() < deadline:
+        time.sleep(.01)
+    assert parent.frames == list(range(100))
+
+@pytest.fixture
+def api(monkeypatch) -> KucoinAPI:
+    monkeypatch.setattr(KucoinAPI, "new_connection", lambda self, pool: FakeConnection(pool, "c0"))
+    api = KucoinAPI(private=False)
+    api.connectID = "c0"
+    return api
+
+@pytest.fixture
+def posted(monkeypatch) -> list:
+    posts = []
+    monkeypatch.setattr(events, "post_event", lambda event_type, data=None: posts.append((event_type, data)))
+    return posts
+
+def frame(topic:str, subject:str, data:dict) -> str:
+    return json.dumps({"type": "message", "topic": topic, "subject": subject, "data": data})
+
+def test_level2_subscriptions_are_sharded(api):
+    pairs = [(f"C{i}", "USDT") for i in range(650)]
+    api.subscribe_level2(pairs)
+    assert api.socket.topic_counts == [300, 300, 50]
+    topics = [payload["topic"] for connection in api.socket.connections for payload in connection.sent]
+    assert len(topics) == 7 and all(topic.startswith("/market/level2:") for topic in topics)
+    assert sum(len(topic.split(":")[1].split(",")) for topic in topics) == 650
+
+def test_ticker_routes(api, posted):
+    ticker = {"price": "1", "bestBid": "0.9", "bestAsk": "1.1"}
+    api.stream_listen(frame("/market/ticker:BTC-USDT", "trade.ticker", ticker))
+    api.stream_listen(frame("/market/ticker:all", "ETH-BTC", ticker))
+    expected = {"close": "1", "bid": "0.9", "ask": "1.1"}
+    assert posted == [(api.PAIR_UPDATE_EVENT_ID, (("BTC", "USDT"), expected)),
+                      (api.PAIR_UPDATE_EVENT_ID, (("ETH", "BTC"), expected))]
+
+def test_private_and_level2_routes(api, posted, monkeypatch):
+    level2 = []
+    monkeypatch.setattr(api, "level2_handler", level2.append)
+    api.stream_listen(frame("/market/level2:BTC-USDT", "trade.l2update", {"symbol": "BTC-USDT"}))
+    api.stream_listen(frame("/spotMarket/tradeOrders", "orderChange", {"orderId": "1"}))
+    api.stream_listen(frame("/account/balance", "account.balance", {"available": "1"}))
+    api.stream_listen(frame("/market/match:BTC-USDT", "trade.l3match", {})) # Not routed
+    assert level2 == [{"symbol": "BTC-USDT"}]
+    assert posted == [(api.ORDER_UPDATE_EVENT_ID, {"orderId": "1"}),
+                      (api.ACCOUNT_BALANCE_UPDATE_EVENT_ID, {"available": "1"})]
+
+def test_pong_frames_update_the_connection(api, posted):
+    api.stream_listen(json.dumps({"type": "pong", "id": "c0"}))
+    assert api.socket.connections[0].last_pong_time == api.last_pong_time > 0
+    assert posted == []
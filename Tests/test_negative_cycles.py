@@ -0,0 +1,71 @@
+import math
+import types
+import pytest
+from ArbitrageEngines.NegativeCycleArbitrage import NegativeCycleArbitrageEngine
+from conftest import build_market
+
+def all_cycles(engine, source, max_length):
+    ''' Every simple cycle through the source with its total weight, by exhaustive search'''
+    cycles = {}
+    def search(u, trades, visited, weight):
+        for v, (edge_weight, trade) in engine.graph[u].items():
+            if v == source and trades:
+                cycles[tuple(trades) + (trade,)] = weight + edge_weight
+            elif v not in visited and len(trades) + 1 < max_length:
+                search(v, trades + [trade], visited | {v}, weight + edge_weight)
+    search(source, [], {source}, 0.0)
+    return cycles
+
+def build_engine(market, max_length=6):
+    trader = types.SimpleNamespace(DataManager=types.SimpleNamespace(Pairs=market), START_CUR_CHANGE_EVENT_ID="TestStartCurChange")
+    engine = NegativeCycleArbitrageEngine(trader, max_length)
+    engine.build_graph(list(market))
+    engine.set_source("USDT")
+    return engine
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("max_length", [3, 4, 6])
+def test_finds_every_profitable_cycle(seed, max_length):
+    # Without fees and with a wide price jitter most markets hold several profitable loops of different lengths
+    market = build_market(fee=0, seed=seed)
+    for pair in market.values():
+        for side in (pair.orderbook.bids, pair.orderbook.asks):
+            side.load([(price*(1 + .01*math.sin(seed + price)), size) for price, size in side.top()])
+    engine = build_engine(market, max_length)
+
+    expected = {sequence: math.expm1(-weight) for sequence, weight in all_cycles(engine, "USDT", engine.max_length).items()
+                if weight < 0}
+    found = engine.find_cycles(0)
+    assert {sequence for _, sequence in found} == set(expected)
+    assert [profit for profit, _ in found] == pytest.approx(sorted(expected.values(), reverse=True))
+    assert engine.find_cycles(0, limit=5) == found[:5]
+
+def test_min_profit_and_edge_updates(market):
+    engine = build_engine(market)
+    assert engine.find_cycles(.05) == []
+
+    # Make ETH-BTC far too cheap to buy, every loop buying it becomes profitable
+    orderbook = market[("ETH", "BTC")].orderbook
+    orderbook.update("asks", str(orderbook.asks.top(1)[0][0]*.9), "1000", 2)
+    changed = engine.update_edges([("ETH", "BTC")])
+    assert changed
+    engine.repair_bounds(changed)
+    cycles = engine.find_cycles(.05)
+    assert cycles and all(profit > .05 for profit, _ in cycles)
+    assert all(any(pair == ("ETH", "BTC") for _, pair in sequence) for _, sequence in cycles)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_repaired_bounds_match_a_full_recompute(seed):
+    market = build_market(fee=0, seed=seed)
+    engine = build_engine(market)
+    pairs = list(market)
+    for step in range(20):
+        # Move both sides of a few books up or down so edges get cheaper and dearer
+        moved = pairs[step % len(pairs)::7]
+        for pair in moved:
+            for side in (market[pair].orderbook.bids, market[pair].orderbook.asks):
+                side.load([(price*(1 + .02*math.sin(seed + step + price)), size) for price, size in side.top()])
+        engine.repair_bounds(engine.update_edges(moved))
+        repaired = engine.bounds.copy()
+        engine.update_bounds()
+        assert repaired == pytest.approx(engine.bounds)
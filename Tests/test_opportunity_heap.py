@@ -0,0 +1,35 @@
+from threading import Thread
+from util.OpportunityHeap import OpportunityHeap
+
+def test_keeps_the_best_sequences():
+    heap = OpportunityHeap(size=3)
+    for i, profit in enumerate([.1, .5, -.2, .3, .4]):
+        heap.update((i,), profit)
+    assert set(heap.snapshot()) == {(1,), (3,), (4,)}
+    assert heap.floor() == .3
+    assert heap.pop_best().sequence == (1,)
+    assert heap.pop_best(min_profit=.35).sequence == (4,)
+    assert heap.pop_best(min_profit=.35, timeout=0) is None
+
+def test_rescoring_replaces_the_entry():
+    heap = OpportunityHeap(size=3)
+    heap.update(("a",), .1)
+    heap.update(("b",), .2)
+    heap.update(("a",), .3)
+    assert len(heap) == 2
+    assert heap.peek().sequence == ("a",) and heap.peek().profit == .3
+    heap.discard(("a",))
+    assert heap.pop_best().sequence == ("b",)
+
+def test_snapshot_is_safe_while_other_threads_push():
+    heap = OpportunityHeap(size=500)
+    def push(offset):
+        for i in range(20000):
+            heap.update((offset, i % 1000), (i*7919 % 1000)/1000)
+    pushers = [Thread(target=push, args=(offset,)) for offset in range(3)]
+    for pusher in pushers:
+        pusher.start()
+    while any(pusher.is_alive() for pusher in pushers):
+        assert len(heap.snapshot()) <= 500
+    for pusher in pushers:
+        pusher.join()
@@ -0,0 +1,57 @@
+from Modules.DataManagement import BookSide, Orderbook
+
+def test_book_side_keeps_best_level_first():
+    asks = BookSide(levels=[("101", "1"), ("100", "2"), ("103", "0"), ("102", "3")])
+    bids = BookSide(descending=True, levels=[("99", "1"), ("98", "2"), ("99.5", "4")])
+    assert asks.top() == ((100.0, 2.0), (101.0, 1.0), (102.0, 3.0))
+    assert bids.top(2) == ((99.5, 4.0), (99.0, 1.0))
+
+def test_book_side_updates_and_removes_levels():
+    asks = BookSide(levels=[("101", "1"), ("100", "2")])
+    asks.set("99.5", "5")
+    asks.set("101", "0")
+    asks.set("100", "7")
+    assert asks.top() == ((99.5, 5.0), (100.0, 7.0))
+    assert "101" not in asks
+    assert asks.pop("200") is None
+
+def test_book_side_revision_changes_on_every_edit():
+    asks = BookSide()
+    revisions = [asks.revision]
+    for edit in (lambda: asks.load([("1", "1")]), lambda: asks.set("2", "1"), lambda: asks.pop("1")):
+        edit()
+        revisions.append(asks.revision)
+    assert len(set(revisions)) == len(revisions)
+
+def test_orderbook_tracks_missing_sequences():
+    orderbook = Orderbook()
+    orderbook.load_snapshot([("99", "1")], [("101", "1")], 10)
+    orderbook.update("asks", "102", "1", 11)
+    orderbook.update("bids", "98", "1", 13)
+    assert orderbook.missing_sequences == [13]
+    assert orderbook.get_book("asks") == ((101.0, 1.0), (102.0, 1.0))
+
+def test_book_side_reads_while_levels_change():
+    from threading import Thread
+    asks = BookSide(levels=[(str(100 + i), "1") for i in range(50)])
+    errors = []
+
+    def write():
+        for i in range(2000):
+            price = str(100 + i % 60)
+            asks.set(price, "0" if i % 3 else "2")
+
+    def read():
+        try:
+            for _ in range(2000):
+                levels = asks.top(10)
+                assert list(levels) == sorted(levels)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=write)] + [Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
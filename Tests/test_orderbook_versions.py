@@ -0,0 +1,86 @@
+import types
+import pytest
+from Modules.DataManagement import ExchangeData
+from Modules.OrderCreation import OrderVolumeSizer
+from enums import tradeSide
+
+@pytest.fixture
+def data_manager(market, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "util").mkdir()
+    API = types.SimpleNamespace(PAIR_UPDATE_EVENT_ID="TestPairUpdate", LEVEL2_UPDATE_EVENT_ID="TestLevel2Update",
+                                DISCONNECT_EVENT_ID="TestDisconnect")
+    data_manager = ExchangeData(API)
+    data_manager.Pairs = market
+    return data_manager
+
+def test_fill_prices_are_memoized_per_book_version(market):
+    sizer = OrderVolumeSizer(market)
+    pair = ("ETH", "USDT")
+    first = sizer.get_best_fill_price(tradeSide.BUY, pair, 500)
+    assert sizer.get_best_fill_price(tradeSide.BUY, pair, 500) == first
+    assert (sizer.memo_hits, sizer.memo_misses) == (1, 1)
+
+    best_ask = market[pair].orderbook.asks.top(1)[0][0]
+    market[pair].orderbook.update("asks", str(best_ask*.999), "100", 2)
+    assert sizer.get_best_fill_price(tradeSide.BUY, pair, 500) == pytest.approx(best_ask*.999)
+    assert sizer.memo_misses == 2
+
+def test_removing_a_level_bumps_the_version_and_marks_the_pair_dirty(data_manager):
+    pair = ("ETH", "USDT")
+    orderbook = data_manager.Pairs[pair].orderbook
+    tracker = data_manager.track_dirty_pairs()
+    version = orderbook.version
+    best_bid = orderbook.bids.top(1)[0][0]
+
+    data_manager.remove_price_level(pair, "bids", best_bid)
+    assert orderbook.version == version + 1
+    assert best_bid not in orderbook.bids
+    assert tracker.drain() == {pair}
+
+    with pytest.raises(KeyError):
+        data_manager.remove_price_level(pair, "bids", best_bid)
+
+def test_untracked_trackers_stop_collecting_pairs(data_manager):
+    pair = ("ETH", "USDT")
+    kept, dropped = data_manager.track_dirty_pairs(), data_manager.track_dirty_pairs()
+    data_manager.untrack_dirty_pairs(dropped)
+    data_manager.mark_dirty(pair)
+    assert kept.drain() == {pair}
+    assert dropped.drain() == set()
+    assert data_manager.dirty_pair_trackers == [kept]
+
+class ReadBeforeAcquire:
+    ''' BookSide lock that runs a read the first time it's taken, before the edit taking it lands'''
+    def __init__(self, lock, read):
+        self.lock = lock
+        self.read = read
+
+    def __enter__(self):
+        read, self.read = self.read, None
+        if read:
+            read()
+        return self.lock.__enter__()
+
+    def __exit__(self, *exc):
+        return self.lock.__exit__(*exc)
+
+def test_fill_prices_read_mid_update_are_not_memoized_under_the_new_version(market):
+    sizer = OrderVolumeSizer(market)
+    pair = ("ETH", "USDT")
+    orderbook = market[pair].orderbook
+    best_ask = orderbook.asks.top(1)[0][0]
+    stale = []
+    orderbook.asks.lock = ReadBeforeAcquire(orderbook.asks.lock,
+                                            lambda: stale.append(sizer.get_best_fill_price(tradeSide.BUY, pair, 1)))
+    version = orderbook.version
+    orderbook.update("asks", str(best_ask*.99), "100", orderbook.last_sequence + 1)
+    assert stale == [best_ask]
+    assert orderbook.version == version + 1
+    assert sizer.get_best_fill_price(tradeSide.BUY, pair, 1) == pytest.approx(best_ask*.99)
+
+def test_no_op_updates_keep_the_version(market):
+    orderbook = market[("ETH", "USDT")].orderbook
+    version = orderbook.version
+    orderbook.update("asks", "0", "0", orderbook.last_sequence + 1)
+    assert orderbook.version == version
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+import pytest
+from APIs.RateLimiter import RateLimiter
+
+PUBLIC, PRIVATE, ORDERS = RateLimiter.PUBLIC, RateLimiter.PRIVATE, RateLimiter.ORDERS
+
+def run_threads(target, args_list) -> list:
+    threads = [threading.Thread(target=target, args=args) for args in args_list]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def drain(limiter:RateLimiter) -> None:
+    ''' Empty every bucket'''
+    for bucket in (limiter.overall, *limiter.buckets.values()):
+        bucket.tokens = 0
+        bucket.last = time.monotonic()
+
+def test_snapshot_throughput_matches_the_old_pacing():
+    # Snapshots were fetched 20 at a time every .2s (100 requests/s) before the limiter
+    limiter = RateLimiter()
+    n = 100
+    start = time.monotonic()
+    threads = run_threads(lambda: [limiter.acquire(PUBLIC) for _ in range(n // 20)], [()]*20)
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    assert elapsed <= (n // 20)*.2
+    assert elapsed >= .9*(n - 20)/100 # And no faster than the public rate after the initial burst
+
+def test_orders_use_the_reserve_while_public_requests_wait():
+    limiter = RateLimiter({PUBLIC: (1000, 1000), PRIVATE: (10, 10), ORDERS: (10, 10)}, overall=(4, 4), reserve=3)
+    threads = run_threads(limiter.acquire, [(PUBLIC,)]*2) # One gets through, the other waits on the reserve
+    time.sleep(.05)
+    start = time.monotonic()
+    limiter.acquire(ORDERS)
+    assert time.monotonic() - start < .05
+    for thread in threads:
+        thread.join()
+
+def test_higher_priority_requests_take_the_next_token():
+    limiter = RateLimiter({PUBLIC: (100, 100), PRIVATE: (100, 100), ORDERS: (100, 100)}, overall=(10, 1), reserve=0)
+    drain(limiter)
+    for bucket in limiter.buckets.values():
+        bucket.tokens = 100
+    order = []
+    public = run_threads(lambda: order.append(limiter.acquire(PUBLIC) or PUBLIC), [()])[0]
+    time.sleep(.02)
+    private = run_threads(lambda: order.append(limiter.acquire(PRIVATE) or PRIVATE), [()])[0]
+    private.join()
+    public.join()
+    assert order == [PRIVATE, PUBLIC]
+
+def test_backoff_pauses_the_class_and_recovers_its_rate():
+    limiter = RateLimiter(backoff=.05, max_backoff=.15)
+    bucket = limiter.buckets[PUBLIC]
+    assert [limiter.backoff(PUBLIC) for _ in range(4)] == pytest.approx([.05, .1, .15, .15])
+    assert bucket.rate == pytest.approx(bucket.base_rate/16) # Halved each time, down to the floor
+    assert limiter.backoff(PUBLIC, retry_after=.2) == .2
+
+    start = time.monotonic()
+    limiter.acquire(PUBLIC)
+    assert time.monotonic() - start >= .15
+    limiter.acquire(ORDERS) # Other classes aren't paused
+
+    limiter.success(PUBLIC)
+    assert limiter.failures[PUBLIC] == 0
+    assert bucket.rate == pytest.approx(bucket.base_rate/16 + bucket.base_rate/20)
+    for _ in range(40):
+        limiter.success(PUBLIC)
+    assert bucket.rate == bucket.base_rate
+
+def test_rate_limited_responses():
+    assert RateLimiter.is_rate_limited(429, "")
+    assert RateLimiter.is_rate_limited(200, '{"code":"429000","msg":"Too Many Requests"}')
+    assert not RateLimiter.is_rate_limited(200, '{"code":"200000"}')
+    assert RateLimiter.retry_after({"Retry-After": "2"}) == 2
+    assert RateLimiter.retry_after({}) is None
+
+def test_async_acquire_waits_without_blocking_the_loop():
+    limiter = RateLimiter({PUBLIC: (100, 100), PRIVATE: (100, 100), ORDERS: (100, 100)}, overall=(20, 1), reserve=0)
+    drain(limiter)
+    for bucket in limiter.buckets.values():
+        bucket.tokens = 100
+
+    async def main():
+        order, ticks = [], []
+        async def request(endpoint_class):
+            await limiter.acquire_async(endpoint_class)
+            order.append(endpoint_class)
+        async def ticker():
+            while len(order) < 4:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(.005)
+        public = [asyncio.ensure_future(request(PUBLIC)) for _ in range(3)]
+        tick = asyncio.ensure_future(ticker())
+        await asyncio.sleep(.01)
+        await asyncio.gather(request(ORDERS), *public, tick)
+        return order, ticks
+    order, ticks = asyncio.run(asyncio.wait_for(main(), 5))
+    assert order[0] == ORDERS and order.count(PUBLIC) == 3
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < .05 # The loop kept running while they waited
+    assert limiter.waiting == []
@@ -0,0 +1,111 @@
+import random
+import types
+import numpy as np
+import pytest
+from ArbitrageEngines.GeneticArbitrage import GeneticArbitrageEngine
+from ArbitrageEngines.SequencePopulation import SequencePopulation
+from Modules.OrderCreation import OrderVolumeSizer
+from enums import tradeSide
+from conftest import build_market
+
+@pytest.fixture
+def engine(market) -> GeneticArbitrageEngine:
+    sizer = OrderVolumeSizer(market)
+    def profit(sequence, amount=300):
+        total = amount
+        for side, pair in sequence:
+            fill_price = sizer.get_best_fill_price(side, pair, total)
+            total = total/fill_price if side == tradeSide.BUY else total*fill_price
+            total *= 1 - market[pair].fee
+        return total/amount - 1
+    DataManager = types.SimpleNamespace(Pairs=market)
+    SequenceTrader = types.SimpleNamespace(DataManager=DataManager, OrderVolumeSizer=sizer, get_sequence_profit=profit,
+                                           session=types.SimpleNamespace(balance={"USDT": 300}))
+    engine = GeneticArbitrageEngine(200, DataManager, SequenceTrader)
+    engine.rng = np.random.default_rng(0)
+    engine.build_encoding(list(market))
+    return engine
+
+@pytest.fixture
+def population(engine) -> SequencePopulation:
+    return SequencePopulation.random(engine.encoding, engine.rng, 200, (3, 4), "USDT", "USDT")
+
+def assert_legal(population:SequencePopulation, encoding):
+    assert not population.illegal().any()
+    usdt = encoding.cur_ids["USDT"]
+    assert (population.owned[:, 0] == usdt).all()
+    assert (population.owned[np.arange(len(population)), population.lengths] == usdt).all()
+
+def test_random_sequences_are_legal(engine, population):
+    assert len(population) > 0
+    assert set(population.lengths) <= {3, 4}
+    assert_legal(population, engine.encoding)
+    for i in range(len(population)):
+        sequence = population.sequence(i)
+        assert all(sequence[j][1] != sequence[j + 1][1] for j in range(len(sequence) - 1))
+
+def test_encode_decode_round_trip(engine, population):
+    for i in range(len(population)):
+        genes = population.genes[i]
+        assert (engine.encoding.encode(population.sequence(i)) == genes[genes >= 0]).all()
+
+def test_fitness_matches_scalar_pricing(engine, population):
+    fitness = engine.fitness(population)
+    expected = [engine.SequenceTrader.get_sequence_profit(population.sequence(i)) for i in range(len(population))]
+    assert fitness == pytest.approx(expected)
+
+def test_crossover_and_mutation_stay_legal(engine, population):
+    children = population.crossover(engine.rng)
+    assert len(children) > 0
+    assert_legal(children, engine.encoding)
+    mutated = children.mutate(engine.rng, 1.0, "USDT")
+    assert (mutated.lengths == children.lengths).all()
+    assert_legal(mutated, engine.encoding)
+
+def test_unique_drops_duplicates(population):
+    doubled = SequencePopulation.concat(population, population)
+    assert len(doubled.unique()) == len(population.unique())
+    assert len(population.take(slice(0, 0)).unique()) == 0
+
+def island_engine() -> GeneticArbitrageEngine:
+    ''' Engine over a market large enough (100+ pairs) for island evolution to run'''
+    rng = random.Random(1)
+    mids = {"USDT": 1, "BTC": 30000, "ETH": 2000, **{f"C{i}": rng.uniform(.1, 100) for i in range(50)}}
+    pairs = [("BTC", "USDT"), ("ETH", "USDT"), ("ETH", "BTC")]
+    pairs += [(f"C{i}", qoute) for i in range(50) for qoute in ("USDT", "BTC", "ETH")]
+    market = build_market(pairs, mids)
+    sizer = OrderVolumeSizer(market)
+    DataManager = types.SimpleNamespace(Pairs=market)
+    SequenceTrader = types.SimpleNamespace(DataManager=DataManager, OrderVolumeSizer=sizer,
+                                           get_sequence_profit=lambda sequence: 0,
+                                           session=types.SimpleNamespace(balance={"USDT": 300}))
+    return GeneticArbitrageEngine(40, DataManager, SequenceTrader)
+
+def test_island_evolution_in_spawned_workers():
+    engine = island_engine()
+    try:
+        profit, sequence = engine.do_island_evolution(islands=2, epochs=2, generations=2)
+        pool = engine.island_pool
+        assert engine.encoding.encode(sequence).size in (3, 4)
+        assert sequence[0][1][1] == "USDT" or sequence[0][1][0] == "USDT"
+        # The pool (and the encoding its workers hold) is reused until the encoding changes
+        engine.do_island_evolution(islands=2, epochs=1, generations=1)
+        assert engine.island_pool is pool
+    finally:
+        if engine.island_pool:
+            engine.island_pool.shutdown()
+
+def test_island_evolution_needs_an_epoch(engine):
+    with pytest.raises(Exception):
+        engine.do_island_evolution(islands=2, epochs=0)
+    assert engine.island_pool is None
+
+def test_island_evolution_without_any_valid_sequence():
+    engine = island_engine()
+    engine.build_encoding(engine.cleanup_pairList())
+    class EmptyIslands:
+        ''' Stands in for the process pool, every island comes back empty'''
+        def submit(self, fn, *args):
+            return types.SimpleNamespace(result=lambda: (np.zeros((0, 4), dtype=np.int64), np.zeros((0, 5), dtype=np.int64), np.zeros(0)))
+    engine.island_pool, engine.island_workers, engine.island_encoding = EmptyIslands(), 2, engine.encoding
+    assert engine.do_island_evolution(islands=2, epochs=1) == (None, None)
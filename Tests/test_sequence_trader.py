@@ -0,0 +1,59 @@
+import sys
+import threading
+import time
+import types
+import pytest
+from ArbitrageEngines.SequenceTrader import SequenceTrader, SequenceEvaluation
+from util.MarketGraph import MarketGraph
+
+@pytest.fixture
+def trader(market) -> SequenceTrader:
+    DataManager = types.SimpleNamespace(Pairs=market, subscribe_order_status=lambda: None,
+                                        subscribe_account_balance_notice=lambda: None)
+    Session = types.SimpleNamespace(starting_cur="USDT", balance={"USDT": 300})
+    return SequenceTrader(DataManager, Session)
+
+@pytest.fixture
+def sequences(market) -> tuple:
+    return MarketGraph(list(market)).triangles("USDT")
+
+def test_queued_sequences_are_executed_once(trader, sequences):
+    executed, release = [], threading.Event()
+    def execute_sequence(sequence, starting_amount, exp_fills, exp_profit):
+        release.wait(5)
+        executed.append(sequence)
+    trader.execute_sequence = execute_sequence
+    trader.evaluate_sequence = lambda sequence: SequenceEvaluation(sequence, .01, 300, [], ())
+    trader.trading_conditions_statisfied = lambda profit, sequence: True
+
+    evaluation = SequenceEvaluation(sequences[0], .01, 300, [], ())
+    assert trader.queue_execution(evaluation)
+    assert not trader.queue_execution(evaluation) # Already waiting on the worker
+    release.set()
+    trader.execution_queue.join()
+    assert executed == [sequences[0]]
+    assert trader.queued == set()
+
+def test_one_execution_worker_is_started(trader, sequences, monkeypatch):
+    # Every root scan thread queues sequences, only one worker may trade the session
+    started, release = [], threading.Event()
+    def execution_worker():
+        started.append(threading.current_thread())
+        release.wait(5)
+    trader.execution_worker = execution_worker
+    def slow_thread(*args, **kwargs):
+        time.sleep(.05) # Holds the other queueing threads between the worker check and the worker start
+        return threading.Thread(*args, **kwargs)
+    monkeypatch.setattr(sys.modules[SequenceTrader.__module__], "Thread", slow_thread)
+
+    threads = [threading.Thread(target=trader.queue_execution, args=(SequenceEvaluation(sequence, .01, 300, [], ()),))
+               for sequence in sequences[:8]]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        release.set()
+    assert len(started) == 1
+    assert len(trader.queued) == 8
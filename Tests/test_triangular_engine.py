@@ -0,0 +1,69 @@
+import time
+import types
+from ArbitrageEngines.SequenceTrader import SequenceTrader
+from ArbitrageEngines.TriangularArbitrage import TriangularArbitrageEngine
+from Modules.DataManagement import DirtyPairTracker
+from util.CycleCache import CycleCache
+
+def build_engine(market, tmp_path) -> TriangularArbitrageEngine:
+    trackers = []
+    def track_dirty_pairs():
+        trackers.append(DirtyPairTracker())
+        return trackers[-1]
+    DataManager = types.SimpleNamespace(Pairs=market, track_dirty_pairs=track_dirty_pairs, trackers=trackers,
+                                        untrack_dirty_pairs=trackers.remove,
+                                        subscribe_order_status=lambda: None,
+                                        subscribe_account_balance_notice=lambda: None)
+    Session = types.SimpleNamespace(starting_cur="USDT", balance={"USDT": 300}, last_cur_received="USDT")
+    trader = SequenceTrader(DataManager, Session)
+    trader.START_CUR_CHANGE_EVENT_ID = "TestTriangularStartCurChange"
+    engine = TriangularArbitrageEngine(trader)
+    engine.cycle_cache = CycleCache(str(tmp_path), skipCurrencies=[])
+    return engine
+
+def wait_for(condition, timeout=5) -> bool:
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(.01)
+    return True
+
+def test_scan_survives_a_failed_pass(market, tmp_path, capsys):
+    engine = build_engine(market, tmp_path)
+    publish = engine.publish_opportunities
+    calls = []
+    def flaky_publish(root=None):
+        calls.append(root)
+        if len(calls) == 1:
+            raise KeyError("price level")
+        publish(root)
+    engine.publish_opportunities = flaky_publish
+
+    engine.running = True
+    engine.loop_delay = .01
+    engine.add_root("USDT")
+    thread = engine.root_threads["USDT"]
+    try:
+        assert thread.daemon
+        # The failed first pass is followed by a full re-price of the root
+        assert wait_for(lambda: len(engine.root_opportunities["USDT"]) > 0)
+        assert thread.is_alive()
+        assert "Scanning cycles rooted at USDT failed" in capsys.readouterr().out
+    finally:
+        engine.running = False
+        thread.join(5)
+    assert "USDT" not in engine.root_threads
+    assert engine.SequenceTrader.DataManager.trackers == []
+
+def test_failed_scan_setup_lets_the_root_restart(market, tmp_path, capsys):
+    engine = build_engine(market, tmp_path)
+    engine.SequenceTrader.DataManager.track_dirty_pairs = None
+    engine.running = True
+    engine.add_root("USDT")
+    thread = engine.root_threads.get("USDT")
+    if thread:
+        thread.join(5)
+    assert "USDT" not in engine.root_threads
+    assert "Scanning cycles rooted at USDT stopped" in capsys.readouterr().out
+    engine.running = False
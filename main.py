@@ -7,6 +7,7 @@ from Modules.Account import Account
 from util.obj_funcs import load_obj, save_obj
 from util.currency_funcs import remove_single_swapable_coins
 from util.SequenceTracker import SequenceTracker
+from util import events
 
 import logging
 from threading import Thread
@@ -18,6 +19,17 @@ SIMULATION_MODE = False
 KucoinAPI = KucoinAPI()
 ExchangeData = ExchangeData(KucoinAPI)
 
+# Dispatch stream events from worker threads so the socket never waits on listeners. 
+# Order updates must not be dropped and tickers only need the latest per pair. Level2 updates never block 
+# the socket: if they back up past the queue the books are rebuilt from a new snapshot instead
+events.set_async(KucoinAPI.LEVEL2_UPDATE_EVENT_ID, maxsize=100000, policy=events.RESYNC,
+                 on_overflow=lambda: ExchangeData.build_orderbook(subscribe=False))
+events.set_async(KucoinAPI.ORDER_UPDATE_EVENT_ID, policy=events.BLOCK)
+events.set_async(KucoinAPI.ACCOUNT_BALANCE_UPDATE_EVENT_ID, policy=events.BLOCK)
+events.set_latest_value(KucoinAPI.PAIR_UPDATE_EVENT_ID, key=lambda data: data[0])
+events.enable_stats()
+events.log_stats(interval=300)
+
 # Setup account and trading session
 Account = Account(KucoinAPI)
 starting_usd_bal = Account.get_total_equivalent_value("USDT")
@@ -26,7 +38,7 @@ Session = Session(Account)
 
 # Setup pair data stream
 pairsInfo = KucoinAPI.get_pair_info()
-viablePairs = remove_single_swapable_coins(list(pairsInfo.keys()))[:299] # SOcket can only maintain 300 orderbook subscriptions
+viablePairs = remove_single_swapable_coins(list(pairsInfo.keys())) # Subscriptions are spread over as many sockets as needed
 pairsInfo = {pair:info for pair, info in pairsInfo.items() if pair in viablePairs}
 ExchangeData.make_pairs(pairsInfo, populateSpread=False)
 ExchangeData.build_orderbook()
@@ -55,7 +67,7 @@ def display_stats(t1):
 
 
 if __name__ == "__main__":
-    TA.begin(start_cur=starting_cur)
+    TA.begin(start_cur=starting_cur, event_driven=True)
     start_time = time.time()
     while True:
         display_stats(start_time)
@@ -0,0 +1,95 @@
+import hashlib
+import os
+from threading import Thread
+import numpy as np
+import Config
+from enums import tradeSide
+
+class CycleCache:
+    '''
+    Stores enumerated sequences for each starting currency in obj/ as compact int arrays, keyed by a hash
+    of the market topology (sorted pair set and skipped currencies). A matching file loads instantly, a
+    stale one is used (restricted to pairs that still exist) while the sequences are rebuilt in the background
+    '''
+    SIDE_CODE = {tradeSide.BUY: 0, tradeSide.SELL: 1}
+    SIDES = (tradeSide.BUY, tradeSide.SELL)
+
+    def __init__(self, directory:str="obj/", skipCurrencies:list=None):
+        self.directory = directory
+        self.skipCurrencies = Config.skipCurrencies if skipCurrencies is None else skipCurrencies
+        self.rebuilds = {} # start_cur: Thread
+
+    def topology_hash(self, pairList) -> str:
+        topology = ",".join(f"{base}-{qoute}" for base, qoute in sorted(pairList))
+        topology += "|" + ",".join(sorted(self.skipCurrencies))
+        return hashlib.sha1(topology.encode('utf-8')).hexdigest()
+
+    def path(self, start_cur:str) -> str:
+        return os.path.join(self.directory, f"cycles_{start_cur}.npz")
+
+    def save(self, start_cur:str, pairList, sequences:tuple[tuple]) -> None:
+        pairs = sorted({pair for sequence in sequences for _, pair in sequence})
+        pair_index = {pair: i for i, pair in enumerate(pairs)}
+        shape = (len(sequences), len(sequences[0]) if sequences else 0)
+        pair_ids = np.array([[pair_index[pair] for _, pair in sequence] for sequence in sequences], dtype=np.int32).reshape(shape)
+        sides = np.array([[self.SIDE_CODE[side] for side, _ in sequence] for sequence in sequences], dtype=np.int8).reshape(shape)
+
+        # Write to a temporary file first so a reader never sees a partially written cache
+        tmp_path = self.path(start_cur) + ".tmp.npz"
+        np.savez_compressed(tmp_path,
+                            topology=np.array(self.topology_hash(pairList)),
+                            pairs=np.array([f"{base}-{qoute}" for base, qoute in pairs]),
+                            pair_ids=pair_ids,
+                            sides=sides)
+        os.replace(tmp_path, self.path(start_cur))
+
+    def load(self, start_cur:str) -> tuple[str, tuple[tuple]]:
+        ''' Return (topology hash, sequences) from the cache file, or (None, None) if there isn't one'''
+        try:
+            with np.load(self.path(start_cur)) as data:
+                topology = str(data['topology'])
+                pairs = [tuple(symbol.split("-")) for symbol in data['pairs'].tolist()]
+                pair_ids = data['pair_ids'].tolist()
+                sides = data['sides'].tolist()
+        except (OSError, KeyError, ValueError):
+            return None, None
+
+        sequences = tuple(tuple((self.SIDES[side], pairs[pair_id]) for pair_id, side in zip(seq_ids, seq_sides))
+                          for seq_ids, seq_sides in zip(pair_ids, sides))
+        return topology, sequences
+
+    def get(self, start_cur:str, pairList, enumerate_sequences, on_rebuilt=None) -> tuple[tuple]:
+        '''
+        Return the sequences for start_cur, enumerating them with enumerate_sequences(start_cur, pairList)
+        only if no cache exists. A stale cache is returned right away and on_rebuilt(sequences) is called
+        once the background rebuild finishes
+        '''
+        topology, sequences = self.load(start_cur)
+        if topology == self.topology_hash(pairList):
+            return sequences
+
+        if sequences is None:
+            sequences = enumerate_sequences(start_cur, pairList)
+            self.save(start_cur, pairList, sequences)
+            return sequences
+
+        def rebuild():
+            try:
+                rebuilt = enumerate_sequences(start_cur, pairList)
+                self.save(start_cur, pairList, rebuilt)
+            except Exception as e:
+                print(f"Rebuilding the cycles for {start_cur} failed: {e}")
+                return
+            finally:
+                # Cleared even on failure so the next get can start another rebuild
+                self.rebuilds.pop(start_cur, None)
+            if on_rebuilt:
+                on_rebuilt(rebuilt)
+
+        if start_cur not in self.rebuilds:
+            self.rebuilds[start_cur] = Thread(target=rebuild)
+            self.rebuilds[start_cur].daemon = True
+            self.rebuilds[start_cur].start()
+
+        available = set(pairList)
+        return tuple(sequence for sequence in sequences if all(pair in available for _, pair in sequence))
@@ -0,0 +1,62 @@
+from typing import List
+from enums import tradeSide
+
+class MarketGraph:
+    ''' Adjacency index mapping each currency to the ('base','qoute') pairs it can be traded through'''
+    def __init__(self, pairList: List[tuple[str]]):
+        self.pairs = tuple(pairList)
+        self.adjacent = {} # cur: [pair, ...]
+        self.pair_lookup = {} # (cur_a, cur_b): pair, for both orderings
+        for pair in self.pairs:
+            base, qoute = pair
+            self.adjacent.setdefault(base, []).append(pair)
+            self.adjacent.setdefault(qoute, []).append(pair)
+            self.pair_lookup[(base, qoute)] = pair
+            self.pair_lookup[(qoute, base)] = pair
+
+    @classmethod
+    def from_exchange_data(cls, DataManager) -> "MarketGraph":
+        return cls(list(DataManager.Pairs.keys()))
+
+    @property
+    def currencies(self) -> tuple[str]:
+        return tuple(self.adjacent)
+
+    def get_pairs(self, cur:str) -> list[tuple[str]]:
+        ''' Return the pairs that trade cur'''
+        return self.adjacent.get(cur, [])
+
+    def get_pair(self, cur_a:str, cur_b:str) -> tuple[str]:
+        ''' Return the pair that trades cur_a for cur_b (None if there isn't one)'''
+        return self.pair_lookup.get((cur_a, cur_b))
+
+    def degree(self, cur:str) -> int:
+        return len(self.adjacent.get(cur, ()))
+
+    def trade(self, owned:str, pair:tuple[str]) -> tuple[tuple, str]:
+        ''' Return the (side, pair) trade that spends the owned currency through the pair and the currency aquired'''
+        base, qoute = pair
+        if owned == qoute:
+            return (tradeSide.BUY, pair), base
+        if owned == base:
+            return (tradeSide.SELL, pair), qoute
+        raise Exception(f"{owned} is not traded by {pair}")
+
+    def remove_single_swapable(self) -> list[tuple[str]]:
+        ''' Return the pairs without the currencies that can only be traded through a single pair'''
+        return [pair for pair in self.pairs if self.degree(pair[0]) > 1 and self.degree(pair[1]) > 1]
+
+    def triangles(self, start_cur:str) -> tuple[tuple]:
+        ''' Enumerate every 3 trade sequence starting and ending with start_cur'''
+        sequences = []
+        for pair1 in self.get_pairs(start_cur):
+            S1, cur_B = self.trade(start_cur, pair1)
+            for pair2 in self.get_pairs(cur_B):
+                if start_cur in pair2:
+                    continue
+                S2, cur_C = self.trade(cur_B, pair2)
+                pair3 = self.get_pair(cur_C, start_cur)
+                if pair3:
+                    S3, _ = self.trade(cur_C, pair3)
+                    sequences.append((S1, S2, S3))
+        return tuple(sequences)
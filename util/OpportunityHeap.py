@@ -0,0 +1,101 @@
+import heapq
+import itertools
+import math
+import time
+from dataclasses import dataclass, field
+from threading import Condition
+
+@dataclass
+class Opportunity:
+    profit: float
+    sequence: tuple
+    versions: tuple = None # Orderbook versions of the sequence's pairs when it was evaluated
+    updated: float = field(default_factory=time.time)
+
+class OpportunityHeap:
+    '''
+    Holds the best scoring sequences with their last evaluated profit.
+    Two lazily cleaned heaps give O(log K) access to both the best entry (for execution)
+    and the worst entry (for eviction once more than size sequences are held)
+    '''
+    def __init__(self, size:int=50):
+        self.size = size
+        self.entries = {} # sequence: Opportunity
+        self._best = [] # (-profit, count, Opportunity)
+        self._worst = [] # (profit, count, Opportunity)
+        self._count = itertools.count()
+        self.cond = Condition()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, sequence) -> bool:
+        return sequence in self.entries
+
+    def update(self, sequence:tuple, profit:float, versions:tuple=None) -> None:
+        ''' Insert or re-score a sequence, evicting the worst held sequence if over size'''
+        with self.cond:
+            if sequence not in self.entries and len(self.entries) >= self.size and profit <= self._floor():
+                return
+            opportunity = Opportunity(profit, sequence, versions)
+            self.entries[sequence] = opportunity
+            count = next(self._count)
+            heapq.heappush(self._best, (-profit, count, opportunity))
+            heapq.heappush(self._worst, (profit, count, opportunity))
+
+            if len(self.entries) > self.size:
+                self._clean(self._worst)
+                _, _, worst = heapq.heappop(self._worst)
+                del self.entries[worst.sequence]
+            if max(len(self._best), len(self._worst)) > 4*self.size:
+                self._compact()
+            self.cond.notify_all()
+
+    def snapshot(self) -> tuple[tuple]:
+        ''' Return the sequences currently held'''
+        with self.cond:
+            return tuple(self.entries)
+
+    def discard(self, sequence:tuple) -> None:
+        with self.cond:
+            self.entries.pop(sequence, None)
+
+    def floor(self) -> float:
+        ''' Return the profit a sequence has to beat to be held (-inf while there is room)'''
+        with self.cond:
+            if len(self.entries) < self.size:
+                return -math.inf
+            return self._floor()
+
+    def peek(self) -> Opportunity:
+        with self.cond:
+            self._clean(self._best)
+            return self._best[0][2] if self._best else None
+
+    def pop_best(self, min_profit:float=None, timeout:float=None) -> Opportunity:
+        ''' Remove and return the best opportunity, waiting up to timeout for one above min_profit'''
+        def head_ready():
+            self._clean(self._best)
+            return bool(self._best) and (min_profit is None or self._best[0][2].profit > min_profit)
+
+        with self.cond:
+            if not self.cond.wait_for(head_ready, timeout):
+                return None
+            _, _, best = heapq.heappop(self._best)
+            del self.entries[best.sequence]
+            return best
+
+    def _floor(self) -> float:
+        self._clean(self._worst)
+        return self._worst[0][0] if self._worst else -math.inf
+
+    def _clean(self, heap:list) -> None:
+        # Drop entries that were re-scored, evicted, or popped from the other heap
+        while heap and self.entries.get(heap[0][2].sequence) is not heap[0][2]:
+            heapq.heappop(heap)
+
+    def _compact(self) -> None:
+        self._best = [entry for entry in self._best if self.entries.get(entry[2].sequence) is entry[2]]
+        self._worst = [entry for entry in self._worst if self.entries.get(entry[2].sequence) is entry[2]]
+        heapq.heapify(self._best)
+        heapq.heapify(self._worst)
@@ -1,4 +1,183 @@
+import logging
+import math
+import time
+from collections import deque
+from threading import Thread, Condition, Lock
+
+logger = logging.getLogger(__name__)
 subscribers = {}
+topics = {} # event_type: TopicQueue for event types dispatched from worker threads
+channels = {} # event_type: LatestValueChannel for event types coalesced to the latest data per key
+
+# Handler instrumentation, off unless enable_stats() is called
+instrumented = False
+handler_stats = {} # (event_type, id(subscriber fn)): HandlerStats
+unsubscribed_posts = {} # event_type: number of events posted with no subscribers
+
+# Backpressure policies for a full TopicQueue
+BLOCK = "block" # Wait for room in the queue
+DROP_OLDEST = "drop_oldest" # Discard the oldest queued event
+COALESCE = "coalesce" # Replace the queued event with the same key, dropping the oldest key if full
+RESYNC = "resync" # Discard the queued events and call on_overflow (from its own thread) to rebuild the state they'd have updated
+
+class TopicQueue:
+    ''' Bounded queue of the events posted for one event type, drained by a pool of worker threads'''
+    def __init__(self, event_type, workers:int=1, maxsize:int=1000, policy:str=BLOCK, key=None, on_overflow=None):
+        self.event_type = event_type
+        self.maxsize = maxsize
+        self.policy = policy
+        self.key = key or (lambda data: None) # Coalescing key of an event's data
+        self.on_overflow = on_overflow # Called after an overflow in RESYNC mode
+        self.items = deque() # Event data, or coalescing keys in COALESCE mode
+        self.latest = {} # key: newest data, in COALESCE mode
+        self.dropped = 0
+        self.resyncs = 0
+        self.resyncing = False # An on_overflow call is running
+        self.resync_pending = False # Overflowed again during the running call
+        self.cond = Condition()
+        self.workers = [Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def put(self, data=None) -> None:
+        with self.cond:
+            if self.policy == COALESCE:
+                key = self.key(data)
+                if key not in self.latest:
+                    if len(self.items) >= self.maxsize:
+                        del self.latest[self.items.popleft()]
+                        self.dropped += 1
+                    self.items.append(key)
+                self.latest[key] = data
+            else:
+                if len(self.items) >= self.maxsize:
+                    if self.policy == DROP_OLDEST:
+                        self.items.popleft()
+                        self.dropped += 1
+                    elif self.policy == RESYNC:
+                        self.dropped += len(self.items)
+                        self.items.clear()
+                        self.start_resync()
+                    else:
+                        self.cond.wait_for(lambda: len(self.items) < self.maxsize)
+                self.items.append(data)
+            self.cond.notify_all()
+
+    def get(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.items)
+            data = self.items.popleft()
+            if self.policy == COALESCE:
+                data = self.latest.pop(data)
+            self.cond.notify_all()
+        return data
+
+    def work(self) -> None:
+        while True:
+            data = self.get()
+            try:
+                dispatch(self.event_type, data)
+            except Exception as e:
+                print(f"Listener for event {self.event_type} failed: {e}")
+
+    def start_resync(self) -> None:
+        ''' Run on_overflow in a new thread so the poster never waits on it (call with cond held)'''
+        if self.resyncing:
+            self.resync_pending = True
+            return
+        self.resyncing = True
+        Thread(target=self.resync, daemon=True).start()
+
+    def resync(self) -> None:
+        while True:
+            print(f"Event queue for {self.event_type} overflowed, resyncing")
+            try:
+                if self.on_overflow:
+                    self.on_overflow()
+            except Exception as e:
+                print(f"Resync for event {self.event_type} failed: {e}")
+            with self.cond:
+                self.resyncs += 1
+                # Events dropped while resyncing may not be covered by it, so go again
+                if not self.resync_pending:
+                    self.resyncing = False
+                    return
+                self.resync_pending = False
+
+class LatestValueChannel:
+    ''' 
+    Keeps only the newest data posted for each key. Consumers drain a snapshot of the keys changed since 
+    the last drain, so a burst of events costs one call per distinct key instead of one per event
+    '''
+    def __init__(self, key=None):
+        self.key = key or (lambda data: data)
+        self.latest = {} # key: newest data
+        self.cond = Condition()
+
+    def __len__(self) -> int:
+        return len(self.latest)
+
+    def put(self, data=None) -> None:
+        with self.cond:
+            self.latest[self.key(data)] = data
+            self.cond.notify()
+
+    def drain(self) -> dict:
+        ''' Return {key: newest data} for the keys changed since the last drain'''
+        with self.cond:
+            latest, self.latest = self.latest, {}
+        return latest
+
+    def wait_drain(self, timeout:float=None) -> dict:
+        ''' Block until a key changes (or the timeout passes), then drain the channel'''
+        with self.cond:
+            self.cond.wait_for(lambda: self.latest, timeout)
+            latest, self.latest = self.latest, {}
+        return latest
+
+class HandlerStats:
+    ''' Call count, total time and a log bucketed latency histogram (~5% bucket width, 1us to ~1h) of one subscriber'''
+    MIN_LATENCY = 1e-6
+    GROWTH = 1.05
+    N_BUCKETS = 450
+
+    def __init__(self, name:str):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0]*self.N_BUCKETS
+        self.lock = Lock()
+
+    def record(self, elapsed:float) -> None:
+        i = int(math.log(max(elapsed, self.MIN_LATENCY) / self.MIN_LATENCY, self.GROWTH))
+        with self.lock:
+            self.calls += 1
+            self.total += elapsed
+            self.max = max(self.max, elapsed)
+            self.buckets[min(i, self.N_BUCKETS - 1)] += 1
+
+    def percentile(self, q:float) -> float:
+        ''' Upper edge of the bucket holding the q quantile of the recorded latencies'''
+        target = q*self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return min(self.MIN_LATENCY*self.GROWTH**(i + 1), self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"calls": self.calls,
+                    "total": self.total,
+                    "mean": self.total / self.calls if self.calls else 0.0,
+                    "p50": self.percentile(.5),
+                    "p99": self.percentile(.99),
+                    "max": self.max}
 
 def subscribe(event_type: str, fn):
     if event_type not in subscribers:
@@ -6,11 +185,108 @@ def subscribe(event_type: str, fn):
     else:
         subscribers[event_type].append(fn)
 
+def set_async(event_type, workers:int=1, maxsize:int=1000, policy:str=BLOCK, key=None, on_overflow=None) -> TopicQueue:
+    ''' 
+    Dispatch event_type from a bounded queue drained by worker threads instead of inline on the posting thread.
+    policy decides what a post does when the queue is full (BLOCK, DROP_OLDEST, COALESCE on key(data) or
+    RESYNC with on_overflow). Events are dispatched in order with a single worker
+    '''
+    topics[event_type] = TopicQueue(event_type, workers, maxsize, policy, key, on_overflow)
+    return topics[event_type]
+
+def set_latest_value(event_type, key=None) -> LatestValueChannel:
+    '''
+    Coalesce event_type into a LatestValueChannel on key(data). A dispatcher thread drains the channel
+    and passes only the newest data of each changed key to the subscribers
+    '''
+    channel = LatestValueChannel(key)
+    def dispatcher():
+        while True:
+            for data in channel.wait_drain().values():
+                try:
+                    dispatch(event_type, data)
+                except Exception as e:
+                    print(f"Listener for event {event_type} failed: {e}")
+
+    channels[event_type] = channel
+    Thread(target=dispatcher, daemon=True).start()
+    return channel
+
+def queue_depths() -> dict:
+    ''' Return the number of queued events (changed keys for coalesced channels) for each asynchronously dispatched event type'''
+    depths = {event_type: len(topic) for event_type, topic in topics.items()}
+    depths.update({event_type: len(channel) for event_type, channel in channels.items()})
+    return depths
+
+def enable_stats(enabled:bool=True) -> None:
+    ''' Record the latency of every subscriber call and count events posted with no subscribers'''
+    global instrumented
+    instrumented = enabled
+
+def stats_snapshot() -> dict:
+    ''' 
+    Return {"handlers": {event_type: {subscriber: stats}}, "no_subscribers": {event_type: count}}. Subscribers
+    are named module.qualname, with the function id appended where two subscribers of an event share a name
+    '''
+    handlers = {}
+    for (event_type, fn_id), stats in list(handler_stats.items()):
+        event_handlers = handlers.setdefault(event_type, {})
+        name = stats.name if stats.name not in event_handlers else f"{stats.name} ({fn_id:#x})"
+        event_handlers[name] = stats.snapshot()
+    return {"handlers": handlers, "no_subscribers": dict(unsubscribed_posts)}
+
+def log_stats(interval:float=60) -> Thread:
+    ''' Log the handler stats every interval seconds from a daemon thread'''
+    def log():
+        while True:
+            time.sleep(interval)
+            snapshot = stats_snapshot()
+            lines = [f"Event handler stats (queue depths: {queue_depths()})"]
+            for event_type, handlers in snapshot["handlers"].items():
+                for name, stats in handlers.items():
+                    lines.append(f"  {event_type} -> {name}: {stats['calls']} calls, {round(stats['total'], 3)} s total, "
+                                 f"p50 {round(stats['p50']*1e6)} us, p99 {round(stats['p99']*1e6)} us, max {round(stats['max']*1e6)} us")
+            for event_type, count in snapshot["no_subscribers"].items():
+                lines.append(f"  {event_type}: {count} posted with no subscribers")
+            logger.info("\n".join(lines))
+    thread = Thread(target=log, daemon=True)
+    thread.start()
+    return thread
+
 def post_event(event_type: str, data=None):
     if not event_type in subscribers:
+        if instrumented:
+            unsubscribed_posts[event_type] = unsubscribed_posts.get(event_type, 0) + 1
         return
+    if event_type in channels:
+        channels[event_type].put(data)
+    elif event_type in topics:
+        topics[event_type].put(data)
+    else:
+        dispatch(event_type, data)
+
+def dispatch(event_type: str, data=None):
     for fn in subscribers[event_type]:
-        if data: 
-            fn(data)
-        else:
-            fn()
\ No newline at end of file
+        if instrumented:
+            start = time.perf_counter()
+        try:
+            if data: 
+                fn(data)
+            else:
+                fn()
+        finally:
+            if instrumented:
+                record_call(event_type, fn, time.perf_counter() - start)
+
+def handler_name(fn) -> str:
+    qualname = getattr(fn, "__qualname__", None)
+    if qualname is None:
+        return repr(fn)
+    return f"{getattr(fn, '__module__', None) or '?'}.{qualname}"
+
+def record_call(event_type, fn, elapsed:float) -> None:
+    # Keyed on the subscribed object's id, which subscribers keeps alive
+    stats = handler_stats.get((event_type, id(fn)))
+    if stats is None:
+        stats = handler_stats.setdefault((event_type, id(fn)), HandlerStats(handler_name(fn)))
+    stats.record(elapsed)